@@ -0,0 +1,279 @@
+"""Beckn request signature verification with a cached registry key store
+
+ONDC participants sign each callback: the Authorization header carries an
+Ed25519 signature over "(created)", "(expires)" and a BLAKE2b-512 digest of
+the body. The gateway checks it over the raw request bytes, with the hashing
+and curve arithmetic on a worker thread, so Node only sees verified callbacks.
+
+Public keys come from the ONDC registry's /lookup. SubscriberKeyStore keeps
+each subscriber's keys for a TTL, remembers unknown subscribers for a shorter
+one, refreshes keys still in use before they expire and serves the last known
+keys while the registry is unreachable. A key ID it has not seen, or a
+signature that fails with a cached key, triggers at most one early refetch
+per subscriber every min_refetch seconds, which picks up key rotation without
+letting forged headers turn into registry traffic.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import logging
+import re
+import time
+from typing import Dict, Optional
+
+import httpx
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from cryptography.hazmat.primitives.serialization import load_der_public_key
+
+logger = logging.getLogger(__name__)
+
+HEADER_PARAM = re.compile(r'(\w+)="([^"]*)"')
+
+
+class SignatureError(Exception):
+    """The Authorization header does not prove the body came from its signer"""
+
+
+def parse_authorization(header: Optional[str]) -> Dict[str, str]:
+    if not header or not header.startswith("Signature "):
+        raise SignatureError("Missing or invalid Authorization header format")
+    params = dict(HEADER_PARAM.findall(header))
+    for name in ("keyId", "created", "expires", "signature"):
+        if name not in params:
+            raise SignatureError(f"Authorization header has no {name}")
+    return params
+
+
+def signing_string(created: str, expires: str, body: bytes) -> bytes:
+    digest = base64.b64encode(hashlib.blake2b(body, digest_size=64).digest()).decode()
+    return f"(created): {created}\n(expires): {expires}\ndigest: BLAKE-512={digest}".encode()
+
+
+def authorization_header(private_key: Ed25519PrivateKey, subscriber_id: str, key_id: str,
+                         body: bytes, ttl: int = 10) -> str:
+    """Sign body the way becknAuth.createAuthorizationHeader does"""
+    created = int(time.time())
+    expires = created + ttl
+    signature = base64.b64encode(private_key.sign(signing_string(str(created), str(expires), body))).decode()
+    return (
+        f'Signature keyId="{subscriber_id}|{key_id}|ed25519",algorithm="ed25519",'
+        f'created="{created}",expires="{expires}",headers="(created) (expires) digest",'
+        f'signature="{signature}"'
+    )
+
+
+def load_public_key(encoded: str) -> Ed25519PublicKey:
+    """Registry signing keys are base64 raw 32-byte keys or DER SubjectPublicKeyInfo"""
+    raw = base64.b64decode(encoded)
+    if len(raw) == 32:
+        return Ed25519PublicKey.from_public_bytes(raw)
+    key = load_der_public_key(raw)
+    if not isinstance(key, Ed25519PublicKey):
+        raise ValueError("Not an Ed25519 key")
+    return key
+
+
+def check_signature(public_key: Ed25519PublicKey, params: Dict[str, str], body: bytes):
+    """CPU-bound part of verification; raises SignatureError"""
+    try:
+        signature = base64.b64decode(params["signature"], validate=True)
+        public_key.verify(signature, signing_string(params["created"], params["expires"], body))
+    except (InvalidSignature, binascii.Error):
+        raise SignatureError("Signature verification failed")
+
+
+class _Subscriber:
+    __slots__ = ("keys", "expires_at", "fetched_at", "last_used")
+
+    def __init__(self, keys: Dict[str, Ed25519PublicKey], ttl: float):
+        now = time.monotonic()
+        self.keys = keys
+        self.fetched_at = now
+        self.expires_at = now + ttl
+        self.last_used = now
+
+
+class SubscriberKeyStore:
+    """Registry signing keys by subscriber ID and unique key ID"""
+
+    def __init__(self, registry_url: str, domain: str, country: str, city: str,
+                 ttl: float = 3600.0, negative_ttl: float = 60.0,
+                 min_refetch: float = 30.0, refresh_interval: float = 60.0,
+                 max_subscribers: int = 10000, timeout: float = 5.0,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.client = client
+        self.registry_url = registry_url
+        self.domain = domain
+        self.country = country
+        self.city = city
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.min_refetch = min_refetch
+        self.refresh_interval = refresh_interval
+        self.max_subscribers = max_subscribers
+        self.timeout = timeout
+        self._subscribers: Dict[str, _Subscriber] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+        self.lookup_failures = 0
+
+    def bind(self, client: httpx.AsyncClient):
+        self.client = client
+
+    async def _lookup(self, subscriber_id: str) -> Dict[str, Ed25519PublicKey]:
+        self.lookups += 1
+        response = await self.client.post(self.registry_url, json={
+            "subscriber_id": subscriber_id,
+            "domain": self.domain,
+            "country": self.country,
+            "city": self.city,
+        }, timeout=self.timeout)
+        response.raise_for_status()
+        entries = response.json()
+        keys = {}
+        for entry in entries if isinstance(entries, list) else []:
+            key_id = entry.get("ukId") or entry.get("unique_key_id")
+            encoded = entry.get("signing_public_key")
+            if key_id and encoded:
+                try:
+                    keys[key_id] = load_public_key(encoded)
+                except ValueError as e:
+                    logger.warning(f"Ignoring bad signing key {subscriber_id}|{key_id}: {e}")
+        return keys
+
+    async def _fetch(self, subscriber_id: str, stale: Optional[_Subscriber]) -> _Subscriber:
+        try:
+            keys = await self._lookup(subscriber_id)
+        except (httpx.HTTPError, ValueError) as e:
+            self.lookup_failures += 1
+            if stale is not None:
+                # Stale keys beat rejecting every callback while the registry is down
+                logger.warning(f"Registry lookup for {subscriber_id} failed, keeping cached keys: {e!r}")
+                stale.fetched_at = time.monotonic()
+                stale.expires_at = stale.fetched_at + self.negative_ttl
+                return stale
+            logger.warning(f"Registry lookup for {subscriber_id} failed: {e!r}")
+            keys = {}
+        entry = _Subscriber(keys, self.ttl if keys else self.negative_ttl)
+        if stale is not None:
+            entry.last_used = stale.last_used
+        if subscriber_id not in self._subscribers and len(self._subscribers) >= self.max_subscribers:
+            # Drop the least recently used subscriber
+            oldest = min(self._subscribers, key=lambda sid: self._subscribers[sid].last_used)
+            del self._subscribers[oldest]
+        self._subscribers[subscriber_id] = entry
+        return entry
+
+    async def _refresh(self, subscriber_id: str) -> _Subscriber:
+        """One registry round trip per subscriber, however many callers wait"""
+        pending = self._pending.get(subscriber_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch(subscriber_id, self._subscribers.get(subscriber_id)))
+            self._pending[subscriber_id] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(subscriber_id, None))
+        # Shielded so one cancelled caller does not fail the others
+        return await asyncio.shield(pending)
+
+    def _may_refetch(self, entry: _Subscriber) -> bool:
+        return time.monotonic() - entry.fetched_at >= self.min_refetch
+
+    async def get(self, subscriber_id: str, key_id: str) -> Optional[Ed25519PublicKey]:
+        entry = self._subscribers.get(subscriber_id)
+        now = time.monotonic()
+        if entry is None or entry.expires_at <= now or (key_id not in entry.keys and self._may_refetch(entry)):
+            self.misses += 1
+            entry = await self._refresh(subscriber_id)
+        else:
+            self.hits += 1
+        entry.last_used = now
+        return entry.keys.get(key_id)
+
+    async def rotated(self, subscriber_id: str, key_id: str) -> Optional[Ed25519PublicKey]:
+        """A newer key for key_id after a cached one failed, if the registry has one"""
+        entry = self._subscribers.get(subscriber_id)
+        if entry is None or not self._may_refetch(entry):
+            return None
+        old = entry.keys.get(key_id)
+        entry = await self._refresh(subscriber_id)
+        new = entry.keys.get(key_id)
+        return new if new is not None and new is not old else None
+
+    async def _refresh_ahead(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            now = time.monotonic()
+            for subscriber_id, entry in list(self._subscribers.items()):
+                if now - entry.last_used > self.ttl:
+                    # Not used for a whole TTL; let it expire
+                    del self._subscribers[subscriber_id]
+                elif entry.keys and entry.expires_at - now < 2 * self.refresh_interval:
+                    try:
+                        await self._refresh(subscriber_id)
+                    except Exception as e:
+                        logger.warning(f"Refreshing keys of {subscriber_id} failed: {e!r}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_ahead())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "lookups": self.lookups,
+            "lookup_failures": self.lookup_failures,
+        }
+
+
+class BecknVerifier:
+    """Checks Beckn Authorization headers against registry keys"""
+
+    def __init__(self, keys: SubscriberKeyStore):
+        self.keys = keys
+        self.verified = 0
+        self.rejected = 0
+
+    async def verify(self, header: Optional[str], body: bytes) -> str:
+        """The signer's subscriber ID; raises SignatureError"""
+        try:
+            params = parse_authorization(header)
+            subscriber_id, key_id, algorithm = (params["keyId"].split("|") + ["", ""])[:3]
+            if algorithm != "ed25519" or params.get("algorithm", "ed25519") != "ed25519":
+                raise SignatureError("Unsupported algorithm")
+            try:
+                expires = int(params["expires"])
+            except ValueError:
+                raise SignatureError("Invalid expires")
+            if expires < time.time():
+                raise SignatureError("Signature expired")
+            public_key = await self.keys.get(subscriber_id, key_id)
+            if public_key is None:
+                raise SignatureError(f"Public Key not found for subscriber: {subscriber_id}")
+            try:
+                await asyncio.to_thread(check_signature, public_key, params, body)
+            except SignatureError:
+                # The subscriber may have rotated the key behind this key ID
+                public_key = await self.keys.rotated(subscriber_id, key_id)
+                if public_key is None:
+                    raise
+                await asyncio.to_thread(check_signature, public_key, params, body)
+        except SignatureError:
+            self.rejected += 1
+            raise
+        self.verified += 1
+        return subscriber_id
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Home-screen load: separate calls vs. POST /api/v1/batch
+Starts node_stub.py and the gateway like loadgen.py and puts a TCP relay in
+front of the gateway that delays every chunk by half the round trip time in
+each direction, plus a round trip for each new connection's handshake, to
+stand in for a mobile network. The app's home screen calls are then made
+
+    sequential  one after another on one connection
+    parallel    all at once, over up to --connections connections
+    batch       in one POST /api/v1/batch
+    stream      in one POST /api/v1/batch with "stream": true
+
+and the time until the last (and for stream, the first) response arrives is
+reported. With --cold every load opens new connections, as after the app has
+been in the background.
+
+Usage:
+    python benchmarks/batch_bench.py --rtt-ms 150
+    python benchmarks/batch_bench.py --rtt-ms 300 --cold --stub-latency-ms 40
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import jwt
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+from loadgen import free_port, start_processes, wait_until_ready  # noqa: E402
+
+HOME_SCREEN = [
+    {"id": "surge", "path": "surge/forecast?originLat=19.0760&originLng=72.8777&destLat=19.1136&destLng=72.8697"},
+    {"id": "factors", "path": "pricing/factors"},
+    {"id": "summary", "path": "insights/summary"},
+    {"id": "recommendation", "path": "recommendations/smart"},
+    {"id": "locations", "path": "locations"},
+]
+
+
+class DelayRelay:
+    """TCP relay adding rtt / 2 of latency to each direction"""
+
+    def __init__(self, target_port: int, rtt: float):
+        self.target_port = target_port
+        self.rtt = rtt
+        self.connections = 0
+        self._handlers = set()
+
+    async def start(self) -> int:
+        port = free_port()
+        self.server = await asyncio.start_server(self._relay, "127.0.0.1", port)
+        return port
+
+    async def close(self):
+        self.server.close()
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def _relay(self, client_reader, client_writer):
+        self.connections += 1
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        handler.add_done_callback(self._handlers.discard)
+        # TCP handshake before the first request can go out
+        try:
+            await asyncio.sleep(self.rtt)
+        except asyncio.CancelledError:
+            client_writer.close()
+            return
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+        try:
+            await asyncio.gather(
+                self._pipe(client_reader, upstream_writer),
+                self._pipe(upstream_reader, client_writer),
+                return_exceptions=True,
+            )
+        except asyncio.CancelledError:
+            # Closed with the relay; asyncio's stream server logs handlers
+            # that end cancelled
+            client_writer.close()
+            upstream_writer.close()
+
+    async def _pipe(self, reader, writer):
+        # Chunks keep their order and are each held for the one-way delay,
+        # without one chunk's delay holding back the next one's
+        queue = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                due, chunk = await queue.get()
+                await asyncio.sleep(max(0.0, due - time.monotonic()))
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+            writer.close()
+
+        delivery = asyncio.create_task(deliver())
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                queue.put_nowait((time.monotonic() + self.rtt / 2, chunk))
+                if not chunk:
+                    break
+        except BaseException:
+            delivery.cancel()
+            raise
+        await delivery
+
+
+async def sequential(client, headers):
+    for call in HOME_SCREEN:
+        (await client.get(f"/api/v1/{call['path']}", headers=headers)).raise_for_status()
+
+
+async def parallel(client, headers):
+    responses = await asyncio.gather(*(client.get(f"/api/v1/{call['path']}", headers=headers) for call in HOME_SCREEN))
+    for response in responses:
+        response.raise_for_status()
+
+
+async def batch(client, headers):
+    response = await client.post("/api/v1/batch", json={"requests": HOME_SCREEN}, headers=headers)
+    response.raise_for_status()
+    if any(item["status"] != 200 for item in response.json()["responses"]):
+        raise RuntimeError(f"Sub-request failed: {response.text[:200]}")
+
+
+async def batch_stream(client, headers):
+    """Seconds from the start until the first item arrived"""
+    start = time.perf_counter()
+    first = None
+    payload = {"requests": HOME_SCREEN, "stream": True}
+    async with client.stream("POST", "/api/v1/batch", json=payload, headers=headers) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line and first is None:
+                first = time.perf_counter() - start
+            if line and json.loads(line)["status"] != 200:
+                raise RuntimeError(f"Sub-request failed: {line[:200]}")
+    return first
+
+
+MODES = {"sequential": sequential, "parallel": parallel, "batch": batch, "stream": batch_stream}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def bench_mode(name, url, headers, args, relay):
+    limits = httpx.Limits(max_connections=1 if name == "sequential" else args.connections)
+    client = httpx.AsyncClient(base_url=url, limits=limits, timeout=30)
+    connections = relay.connections
+    totals, firsts = [], []
+    try:
+        for iteration in range(args.warmup + args.iterations):
+            if args.cold and iteration:
+                await client.aclose()
+                client = httpx.AsyncClient(base_url=url, limits=limits, timeout=30)
+            start = time.perf_counter()
+            first = await MODES[name](client, headers)
+            elapsed = time.perf_counter() - start
+            if iteration >= args.warmup:
+                totals.append(elapsed)
+                firsts.append(elapsed if first is None else first)
+    finally:
+        await client.aclose()
+    return {
+        "mode": name,
+        "p50_ms": round(statistics.median(totals) * 1000, 1),
+        "p90_ms": round(percentile(totals, 0.9) * 1000, 1),
+        "first_p50_ms": round(statistics.median(firsts) * 1000, 1),
+        "connections": relay.connections - connections,
+    }
+
+
+def print_table(rows, rtt_ms):
+    base = rows[0]["p50_ms"]
+    print(f"{'mode':>10} {'p50 ms':>8} {'p90 ms':>8} {'first ms':>9} {'vs seq':>7} {'RTTs':>5} {'conns':>6}")
+    for row in rows:
+        print(f"{row['mode']:>10} {row['p50_ms']:>8.1f} {row['p90_ms']:>8.1f} {row['first_p50_ms']:>9.1f} "
+              f"{base / row['p50_ms']:>6.1f}x {row['p50_ms'] / rtt_ms:>5.1f} {row['connections']:>6}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=150.0, help="Simulated client round trip time")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--connections", type=int, default=6, help="Connection limit for parallel calls")
+    parser.add_argument("--cold", action="store_true", help="New connections for every home-screen load")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated subset of " + ",".join(MODES))
+    parser.add_argument("--stub-latency-ms", type=float, default=20.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=10.0)
+    parser.add_argument("--stub-payload-kb", type=float, default=4.0)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Signed with the gateway's secret so the batch and the calls are authorized alike
+    os.environ.setdefault("JWT_SECRET", "batch-bench-secret-for-local-runs-only")
+    token = jwt.encode({"userId": "64b7f0c2a1b2c3d4e5f60718", "exp": int(time.time()) + 3600},
+                       os.environ["JWT_SECRET"], algorithm="HS256")
+    headers = {"authorization": f"Bearer {token}"}
+
+    processes, stub_url, gateway_url = start_processes(args)
+    try:
+        await wait_until_ready(f"{stub_url}/api/v1/health")
+        await wait_until_ready(f"{gateway_url}/api/")
+        relay = DelayRelay(int(gateway_url.rsplit(":", 1)[1]), args.rtt_ms / 1000)
+        url = f"http://127.0.0.1:{await relay.start()}"
+        print(f"{len(HOME_SCREEN)} calls, {args.rtt_ms:.0f} ms RTT, {args.stub_latency_ms:.0f}+"
+              f"{args.stub_jitter_ms:.0f} ms stub, {'cold' if args.cold else 'warm'} connections, "
+              f"{args.iterations} loads per mode")
+        rows = [await bench_mode(name, url, headers, args, relay) for name in args.modes.split(",")]
+        await relay.close()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    print()
+    print_table(rows, args.rtt_ms)
+    if args.save:
+        Path(args.save).write_text(json.dumps(rows, indent=2) + "\n")
+        print(f"saved {args.save}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
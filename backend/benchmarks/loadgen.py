@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Gateway load generator
+Starts the node_stub upstream and the FastAPI gateway as local processes (or
+targets a running gateway), drives it at a fixed concurrency or a fixed
+arrival rate and reports RPS, latency percentiles and gateway RSS
+
+Results can be saved as JSON baselines and later runs compared against them;
+the exit status is 1 when a run regresses beyond the tolerance.
+
+Usage:
+    python benchmarks/loadgen.py --scenario surge --concurrency 64 --duration 20
+    python benchmarks/loadgen.py --scenario mix --rate 500 --save benchmarks/baselines/mix.json
+    python benchmarks/loadgen.py --scenario mix --rate 500 --compare benchmarks/baselines/mix.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+
+# Mumbai points the app searches between
+POINTS = [(19.1188, 72.8913), (19.0661, 72.8354), (19.0634, 72.8350), (19.1249, 72.9077)]
+
+
+def random_point():
+    lat, lng = random.choice(POINTS)
+    return lat + random.uniform(-0.01, 0.01), lng + random.uniform(-0.01, 0.01)
+
+
+def health_request():
+    return "GET", "/api/v1/health", None, None
+
+
+def surge_request():
+    (origin_lat, origin_lng), (dest_lat, dest_lng) = random_point(), random_point()
+    return "GET", "/api/v1/surge/forecast", {
+        "originLat": origin_lat, "originLng": origin_lng, "destLat": dest_lat, "destLng": dest_lng,
+    }, None
+
+
+def pricing_request():
+    return "GET", "/api/v1/pricing/factors", None, None
+
+
+def commute_request():
+    (origin_lat, origin_lng), (dest_lat, dest_lng) = random_point(), random_point()
+    return "POST", "/api/v1/commute/search", None, {
+        "mode": "EXPLORER",
+        "origin": {"latitude": origin_lat, "longitude": origin_lng},
+        "destination": {"latitude": dest_lat, "longitude": dest_lng},
+    }
+
+
+def ondc_request():
+    lat, lng = random_point()
+    return "POST", "/ondc/search", None, {"latitude": lat, "longitude": lng}
+
+
+SCENARIOS = {
+    "health": [(health_request, 1)],
+    "surge": [(surge_request, 1)],
+    "pricing": [(pricing_request, 1)],
+    "commute": [(commute_request, 1)],
+    "ondc": [(ondc_request, 1)],
+    # Home screen polling dominates, searches are the expensive minority
+    "mix": [(surge_request, 4), (pricing_request, 3), (health_request, 1), (commute_request, 2)],
+}
+
+
+def pick_request(scenario):
+    makers, weights = zip(*SCENARIOS[scenario])
+    return random.choices(makers, weights)[0]()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_mb(pid):
+    """Current and peak resident set size of a process, from /proc"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value, _ = line.split()
+                    values[key.rstrip(":")] = int(value) / 1024
+    except OSError:
+        return None, None
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+async def wait_until_ready(url, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_processes(args):
+    stub_port, gateway_port = free_port(), free_port()
+    env = dict(os.environ)
+    env.update({
+        "STUB_LATENCY_MS": str(args.stub_latency_ms),
+        "STUB_JITTER_MS": str(args.stub_jitter_ms),
+        "STUB_PAYLOAD_KB": str(args.stub_payload_kb),
+        "NODE_UPSTREAMS": f"http://127.0.0.1:{stub_port}",
+    })
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    quiet = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "node_stub:app", "--port", str(stub_port), "--log-level", "warning"],
+        cwd=BENCHMARKS_DIR, env=env, **quiet,
+    )
+    gateway = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(gateway_port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, **quiet,
+    )
+    return [stub, gateway], f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{gateway_port}"
+
+
+async def timed_request(client, scenario, latencies, errors, scheduled=None):
+    method, path, params, body = pick_request(scenario)
+    # Open-loop latency counts from the scheduled send time, so a stalled
+    # gateway cannot hide queueing delay (coordinated omission)
+    start = scheduled if scheduled is not None else time.perf_counter()
+    try:
+        response = await client.request(method, path, params=params, json=body)
+        if response.status_code >= 400:
+            errors[response.status_code] = errors.get(response.status_code, 0) + 1
+    except httpx.HTTPError as e:
+        errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+    latencies.append(time.perf_counter() - start)
+
+
+async def run_closed_loop(client, scenario, concurrency, duration, latencies, errors):
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await timed_request(client, scenario, latencies, errors)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_open_loop(client, scenario, rate, duration, latencies, errors, max_outstanding):
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    pending = set()
+    skipped = 0
+    for i in range(int(duration * rate)):
+        scheduled = start + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(pending) >= max_outstanding:
+            skipped += 1
+            continue
+        task = asyncio.ensure_future(timed_request(client, scenario, latencies, errors, scheduled))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+    if skipped:
+        errors["skipped"] = skipped
+
+
+async def run(args, base_url, gateway_pid):
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        if args.warmup > 0:
+            await run_closed_loop(client, args.scenario, min(args.concurrency, 16), args.warmup, [], {})
+        rss_start, _ = rss_mb(gateway_pid) if gateway_pid else (None, None)
+        latencies, errors = [], {}
+        started = time.perf_counter()
+        if args.rate:
+            await run_open_loop(client, args.scenario, args.rate, args.duration, latencies, errors,
+                                max_outstanding=args.connections * 4)
+        else:
+            await run_closed_loop(client, args.scenario, args.concurrency, args.duration, latencies, errors)
+        elapsed = time.perf_counter() - started
+        rss_end, rss_peak = rss_mb(gateway_pid) if gateway_pid else (None, None)
+
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "scenario": args.scenario,
+        "mode": "fixed_rate" if args.rate else "fixed_concurrency",
+        "rate": args.rate,
+        "concurrency": None if args.rate else args.concurrency,
+        "duration_s": round(elapsed, 3),
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(float(ms.mean()), 3),
+            "p50": round(float(np.percentile(ms, 50)), 3),
+            "p95": round(float(np.percentile(ms, 95)), 3),
+            "p99": round(float(np.percentile(ms, 99)), 3),
+            "max": round(float(ms.max()), 3),
+        },
+        "rss_mb": {"start": rss_start, "end": rss_end, "peak": rss_peak},
+        "stub": {
+            "latency_ms": args.stub_latency_ms,
+            "jitter_ms": args.stub_jitter_ms,
+            "payload_kb": args.stub_payload_kb,
+        } if not args.gateway else None,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Regressions of throughput and tail latency beyond tolerance"""
+    regressions = []
+    if result["rps"] < baseline["rps"] * (1 - tolerance):
+        regressions.append(f"rps {result['rps']} < baseline {baseline['rps']}")
+    for key in ("p50", "p95", "p99"):
+        now, before = result["latency_ms"][key], baseline["latency_ms"][key]
+        if now > before * (1 + tolerance):
+            regressions.append(f"{key} {now} ms > baseline {before} ms")
+    return regressions
+
+
+def print_result(result):
+    latency = result["latency_ms"]
+    print(f"{result['scenario']} ({result['mode']}): {result['requests']} requests in {result['duration_s']} s")
+    print(f"  rps {result['rps']}  p50 {latency['p50']} ms  p95 {latency['p95']} ms  "
+          f"p99 {latency['p99']} ms  max {latency['max']} ms")
+    if result["rss_mb"]["peak"]:
+        print(f"  gateway rss {result['rss_mb']['end']:.1f} MB (peak {result['rss_mb']['peak']:.1f} MB)")
+    if result["errors"]:
+        print(f"  errors {result['errors']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mix")
+    parser.add_argument("--concurrency", type=int, default=32, help="Closed-loop workers")
+    parser.add_argument("--rate", type=float, help="Open-loop requests per second (overrides --concurrency)")
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--connections", type=int, default=100, help="Client connection pool size")
+    parser.add_argument("--gateway", help="Target a running gateway instead of starting one")
+    parser.add_argument("--stub-latency-ms", type=float, default=5.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--stub-payload-kb", type=float, default=4.0)
+    parser.add_argument("--save", help="Write the result to this JSON baseline")
+    parser.add_argument("--compare", help="Compare against this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    processes = []
+    gateway_pid = None
+    base_url = args.gateway
+    try:
+        if not base_url:
+            processes, stub_url, base_url = start_processes(args)
+            gateway_pid = processes[1].pid
+            await wait_until_ready(f"{stub_url}/api/v1/health")
+            await wait_until_ready(f"{base_url}/api/")
+        result = await run(args, base_url, gateway_pid)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    print_result(result)
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps(result, indent=2) + "\n")
+        print(f"  saved {args.save}")
+    if args.compare:
+        regressions = compare(result, json.loads(Path(args.compare).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("  no regression against baseline")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the Node.js backend, for benchmarking the gateway in isolation
+Serves the routes the app hammers with response shapes like the real ones,
+after a configurable delay and with configurable payload sizes
+
+Environment:
+    STUB_LATENCY_MS   base handler latency (default 5)
+    STUB_JITTER_MS    extra uniform random latency (default 0)
+    STUB_PAYLOAD_KB   approximate size of list-style responses (default 4)
+
+Usage:
+    uvicorn node_stub:app --port 8002
+"""
+
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI, Request
+
+LATENCY_MS = float(os.environ.get('STUB_LATENCY_MS', '5'))
+JITTER_MS = float(os.environ.get('STUB_JITTER_MS', '0'))
+PAYLOAD_KB = float(os.environ.get('STUB_PAYLOAD_KB', '4'))
+
+app = FastAPI()
+
+
+async def simulate_work():
+    delay = LATENCY_MS + random.uniform(0, JITTER_MS)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+
+
+def padded_items(make_item):
+    """Repeat make_item until the list is roughly PAYLOAD_KB in JSON"""
+    sample = len(str(make_item(0)))
+    return [make_item(i) for i in range(max(1, int(PAYLOAD_KB * 1024 / sample)))]
+
+
+@app.get("/api/v1/health")
+async def health():
+    return {"status": "OK", "app": "HailO", "version": "stub", "uberMode": "MOCK", "database": "MongoDB"}
+
+
+@app.get("/api/v1/surge/forecast")
+async def surge_forecast(originLat: float = 0, originLng: float = 0, destLat: float = 0, destLng: float = 0):
+    await simulate_work()
+    now = datetime.utcnow()
+    return {
+        "forecast": [
+            {
+                "multiplier": round(1.0 + random.random() * 0.5, 1),
+                "time": "Now" if minutes == 0 else f"{minutes}m",
+                "timestamp": (now + timedelta(minutes=minutes)).isoformat() + "Z",
+            }
+            for minutes in (0, 15, 30, 45, 60)
+        ],
+        "location": {
+            "origin": {"lat": originLat, "lng": originLng},
+            "destination": {"lat": destLat, "lng": destLng},
+        },
+    }
+
+
+@app.get("/api/v1/surge/current")
+async def surge_current(lat: float = 0, lng: float = 0):
+    await simulate_work()
+    return {"multiplier": 1.3, "location": {"lat": lat, "lng": lng}, "timestamp": datetime.utcnow().isoformat() + "Z"}
+
+
+@app.get("/api/v1/pricing/factors")
+async def pricing_factors():
+    await simulate_work()
+    return {
+        "factors": [
+            {"id": "weather", "title": "Weather Impact", "description": "Clear", "impact": 0, "icon": "cloud", "color": "success"},
+            {"id": "traffic", "title": "Traffic Density", "description": "Light traffic", "impact": 5, "icon": "car", "color": "success"},
+            {"id": "peak", "title": "Peak Hours", "description": "Off-peak hours", "impact": 0, "icon": "time", "color": "success"},
+        ],
+        "totalImpact": 5,
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "isLive": True,
+    }
+
+
+@app.get("/api/v1/pricing/estimate")
+async def pricing_estimate(distance: float = 0, duration: float = 0, surgeMultiplier: float = 1.0):
+    await simulate_work()
+    subtotal = 40 + distance * 12 + duration * 2
+    total = subtotal * surgeMultiplier
+    return {
+        "breakdown": {"baseFare": 40, "subtotal": round(subtotal), "total": round(total)},
+        "surgeMultiplier": surgeMultiplier,
+        "estimatedRange": {"min": round(total * 0.9), "max": round(total * 1.1)},
+    }
+
+
+@app.get("/api/v1/insights/summary")
+async def insights_summary():
+    await simulate_work()
+    return {
+        "stats": {"totalRides": 42, "totalDistance": 318.4, "totalSaved": 1260, "totalSpent": 9120,
+                  "avgPricePerRide": 217, "timeSaved": 95, "rating": 4.9},
+        "savingsBreakdown": [{"provider": "ONDC", "saved": 840}, {"provider": "Uber", "saved": 420}],
+        "topRoutes": [{"id": i + 1, "from": "Andheri", "to": "BKC", "count": 12 - i} for i in range(3)],
+    }
+
+
+@app.get("/api/v1/recommendations/smart")
+async def recommendations_smart():
+    await simulate_work()
+    return {
+        "hasRecommendation": True,
+        "type": "timing",
+        "title": "Best Booking Time",
+        "message": "Book before 8:40 to avoid the morning surge",
+        "confidence": 0.82,
+    }
+
+
+@app.get("/api/v1/locations")
+async def locations():
+    await simulate_work()
+    return padded_items(lambda i: {
+        "id": f"loc-{i}", "name": f"Place {i}", "address": "Bandra Kurla Complex, Mumbai",
+        "latitude": 19.0661, "longitude": 72.8354, "type": "OTHER",
+    })
+
+
+@app.post("/api/v1/commute/search")
+async def commute_search(request: Request):
+    await request.body()
+    await simulate_work()
+    return {
+        "commuteLogId": "stub",
+        "productName": "UberGo",
+        "etaMinutes": 21,
+        "estimateMin": 146,
+        "estimateMax": 172,
+        "currency": "INR",
+        "distance": "8.3",
+        "surgePercent": 0,
+        "deepLinkUrl": "https://m.uber.com/ul/?action=setPickup",
+        "isMock": True,
+        "history": padded_items(lambda i: {"id": f"ride-{i}", "price": 150 + i % 40, "provider": "stub"}),
+    }
+
+
+@app.post("/ondc/search")
+async def ondc_search(request: Request):
+    await request.body()
+    await simulate_work()
+    return {
+        "transactionId": f"txn-{random.getrandbits(48):012x}",
+        "status": "SEARCHING",
+        "catalog": padded_items(lambda i: {
+            "id": f"item-{i}", "provider": f"bpp-{i % 20}", "price": {"currency": "INR", "value": str(120 + i % 60)},
+        }),
+    }
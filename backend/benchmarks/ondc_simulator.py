@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Local ONDC network simulator
+Plays the ONDC gateway, the registry and a fleet of BPPs for the HailO BAP,
+and drives end-to-end search -> on_search flows (optionally on through
+select, init, confirm and status) via the gateway. Reports how long each
+callback takes to become visible and how many searches per second complete
+
+Each search Node sends to the simulated gateway is answered by every BPP,
+each after its own random delay, with a signed on_search carrying
+providers x items quotes. A callback is visible once its update reaches a
+client subscribed to the transaction's push stream on the gateway, so the
+measured path is: gateway signature check -> Node onSearch -> brainProcess ->
+$push results -> event feed -> push hub -> client.
+
+Point Node and the gateway at the simulator (default port 8090):
+
+    # server/: Node signs outgoing calls with its own key; GEMINI_MOCK stands
+    # in for the model behind the AI insights sent after the quotes
+    ONDC_MOCK=false ONDC_GATEWAY_URL=http://127.0.0.1:8090/search \\
+    ONDC_SUBSCRIBER_URL=http://127.0.0.1:8001/ondc ONDC_PRIVATE_KEY=... \\
+    ONDC_GATEWAY_TOKEN=sim GEMINI_MOCK=true GEMINI_MOCK_LATENCY_MS=800 npm start
+    # backend/: callbacks are verified against the simulated registry
+    ONDC_REGISTRY_URL=http://127.0.0.1:8090/lookup ONDC_GATEWAY_TOKEN=sim \\
+    uvicorn server:app --port 8001
+
+Usage:
+    python benchmarks/ondc_simulator.py --rate 5 --duration 30
+    python benchmarks/ondc_simulator.py --bpps 20 --providers 2 --items 4 --jitter-ms 50,400 --flow status
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+import httpx
+import numpy as np
+import uvicorn
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from fastapi import FastAPI, Request
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from beckn_auth import (  # noqa: E402
+    SignatureError, authorization_header, check_signature, load_public_key, parse_authorization,
+)
+
+ACK = {"message": {"ack": {"status": "ACK"}}}
+
+# Mumbai points the app searches between
+POINTS = [(19.1188, 72.8913), (19.0661, 72.8354), (19.0634, 72.8350), (19.1249, 72.9077)]
+VEHICLES = ["Auto", "Cab", "Cab XL", "Bike"]
+
+# The action each BAP call is answered with, and the event Node publishes
+# once the answer is processed
+FLOW = {
+    "search": ("on_search", "search_update"),
+    "select": ("on_select", "select_update"),
+    "init": ("on_init", "init_update"),
+    "confirm": ("on_confirm", "confirm_update"),
+    "status": ("on_status", "status_update"),
+}
+FLOWS = {
+    "search": ["search"],
+    "select": ["search", "select"],
+    "status": ["search", "select", "init", "confirm", "status"],
+}
+
+
+class SimulatedBpp:
+    def __init__(self, index: int, base_url: str):
+        self.subscriber_id = f"bpp-{index}.sim.local"
+        self.key_id = f"sim-key-{index}"
+        self.uri = f"{base_url}/bpp/{index}"
+        # Same keys every run, so the gateway's cached registry keys stay valid
+        self.private_key = Ed25519PrivateKey.from_private_bytes(
+            hashlib.sha256(self.subscriber_id.encode()).digest()
+        )
+        self.public_key = base64.b64encode(
+            self.private_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+        ).decode()
+
+
+class Network:
+    """Simulated gateway, registry and BPPs, recording when callbacks leave"""
+
+    def __init__(self, args, base_url: str):
+        self.args = args
+        self.bpps = [SimulatedBpp(index, base_url) for index in range(args.bpps)]
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=args.connections), timeout=30.0
+        )
+        self.bap_key = load_public_key(args.bap_public_key) if args.bap_public_key else None
+        # (transaction ID, BPP subscriber ID, callback action) -> send time
+        self.sent = {}
+        # Fan-out of a search waits until the driver is subscribed to it
+        self.subscribed = {}
+        self.callbacks = Counter()
+        self.inbound = Counter()
+        self.tasks = set()
+        self.app = self.build_app()
+
+    def jitter(self) -> float:
+        low, high = self.args.jitter_ms
+        return random.uniform(low, high) / 1000
+
+    def check_inbound(self, action: str, request: Request, body: bytes):
+        header = request.headers.get("authorization")
+        if header is None:
+            self.inbound[f"{action}_unsigned"] += 1
+            return
+        if self.bap_key is not None:
+            try:
+                check_signature(self.bap_key, parse_authorization(header), body)
+            except SignatureError:
+                self.inbound[f"{action}_bad_signature"] += 1
+                return
+        self.inbound[action] += 1
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def callback(self, bpp: SimulatedBpp, action: str, context: dict, message: dict):
+        context = {
+            **context,
+            "action": action,
+            "bpp_id": bpp.subscriber_id,
+            "bpp_uri": bpp.uri,
+            "message_id": str(uuid.uuid4()),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        body = json.dumps({"context": context, "message": message}, separators=(",", ":")).encode()
+        headers = {
+            "authorization": authorization_header(bpp.private_key, bpp.subscriber_id, bpp.key_id, body, ttl=30),
+            "content-type": "application/json",
+        }
+        self.sent[(context["transaction_id"], bpp.subscriber_id, action)] = time.perf_counter()
+        try:
+            response = await self.client.post(f"{context['bap_uri']}/{action}", content=body, headers=headers)
+            status = response.json().get("message", {}).get("ack", {}).get("status", response.status_code)
+        except (httpx.HTTPError, ValueError) as e:
+            status = type(e).__name__
+        self.callbacks[f"{action} {status}"] += 1
+
+    def catalog(self, bpp: SimulatedBpp) -> dict:
+        providers = []
+        for p in range(self.args.providers):
+            items = [
+                {
+                    "id": f"{bpp.subscriber_id}-p{p}-i{i}",
+                    "descriptor": {"name": VEHICLES[i % len(VEHICLES)]},
+                    "price": {"value": str(random.randint(80, 600)), "currency": "INR"},
+                    "fulfillment_ids": [f"f-{p}-{i}"],
+                }
+                for i in range(self.args.items)
+            ]
+            providers.append({"id": f"{bpp.subscriber_id}-p{p}", "descriptor": {"name": f"Sim Fleet {p}"}, "items": items})
+        return {"catalog": {"descriptor": {"name": bpp.subscriber_id}, "providers": providers}}
+
+    async def fan_out(self, context: dict):
+        subscribed = self.subscribed.setdefault(context["transaction_id"], asyncio.Event())
+        try:
+            await asyncio.wait_for(subscribed.wait(), timeout=5.0)
+        except asyncio.TimeoutError:
+            pass
+        self.subscribed.pop(context["transaction_id"], None)
+
+        async def answer(bpp):
+            await asyncio.sleep(self.jitter())
+            await self.callback(bpp, "on_search", context, self.catalog(bpp))
+
+        await asyncio.gather(*(answer(bpp) for bpp in self.bpps))
+
+    def order(self, index: int, context: dict, action: str, message: dict) -> dict:
+        order = dict(message.get("order") or {})
+        price = {"value": str(random.randint(80, 600)), "currency": "INR"}
+        order.setdefault("quote", {"price": price, "breakup": [{"title": "BASE_FARE", "price": price}]})
+        if action == "on_init":
+            order["billing"] = {"name": "Sim Rider"}
+            order["fulfillments"] = [{"id": "f-0-0", "type": "DELIVERY"}]
+        elif action in ("on_confirm", "on_status"):
+            order["id"] = f"order-{context['transaction_id']}"
+            order["status"] = "ACTIVE"
+            state = {"descriptor": {"code": "RIDE_ASSIGNED" if action == "on_confirm" else "RIDE_STARTED"}}
+            order["fulfillment"] = {"state": state, "start": {"location": {"gps": "19.0760,72.8777"}}}
+            order["fulfillments"] = [order["fulfillment"]]
+        return {"order": order}
+
+    async def answer_bpp(self, index: int, action: str, context: dict, message: dict):
+        await asyncio.sleep(self.jitter())
+        callback = FLOW[action][0]
+        await self.callback(self.bpps[index], callback, context, self.order(index, context, callback, message))
+
+    def build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/lookup")
+        async def lookup(request: Request):
+            subscriber_id = (await request.json()).get("subscriber_id")
+            return [
+                {
+                    "subscriber_id": bpp.subscriber_id,
+                    "subscriber_url": bpp.uri,
+                    "type": "BPP",
+                    "ukId": bpp.key_id,
+                    "signing_public_key": bpp.public_key,
+                }
+                for bpp in self.bpps if bpp.subscriber_id == subscriber_id
+            ]
+
+        @app.post("/search")
+        async def search(request: Request):
+            body = await request.body()
+            self.check_inbound("search", request, body)
+            self.spawn(self.fan_out(json.loads(body)["context"]))
+            return ACK
+
+        @app.post("/bpp/{index}/{action}")
+        async def bpp_action(index: int, action: str, request: Request):
+            body = await request.body()
+            self.check_inbound(action, request, body)
+            if action not in FLOW or not 0 <= index < len(self.bpps):
+                return {"message": {"ack": {"status": "NACK"}}, "error": {"code": "30000", "message": "Unknown action"}}
+            payload = json.loads(body)
+            self.spawn(self.answer_bpp(index, action, payload["context"], payload.get("message") or {}))
+            return ACK
+
+        return app
+
+    def release(self, transaction_id: str):
+        self.subscribed.setdefault(transaction_id, asyncio.Event()).set()
+
+
+async def read_events(response: httpx.Response):
+    """(event name, data, arrival time) from a Server-Sent Events stream"""
+    name, data = None, []
+    async for line in response.aiter_lines():
+        if line.startswith("event:"):
+            name = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].lstrip())
+        elif not line and data:
+            yield name, json.loads("\n".join(data)), time.perf_counter()
+            name, data = None, []
+
+
+class Results:
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.failures = Counter()
+        # Callback action -> seconds from the BPP sending it to the client seeing it
+        self.visible = {FLOW[action][0]: [] for action in FLOW}
+        self.search_complete = []
+        self.flow_complete = []
+
+
+class Transaction:
+    def __init__(self, transaction_id: str, started: float, steps, bpps):
+        self.id = transaction_id
+        self.started = started
+        self.steps = steps
+        self.step = 0
+        self.waiting_for = {bpp.subscriber_id for bpp in bpps}
+        self.selected = None
+
+    @property
+    def action(self) -> str:
+        return self.steps[self.step]
+
+    @property
+    def done(self) -> bool:
+        return self.step == len(self.steps)
+
+
+async def follow(client: httpx.AsyncClient, network: Network, results: Results, transaction: Transaction):
+    """Walk the flow, timing each callback until its update reaches the client"""
+    url = f"/api/push/transactions/{transaction.id}/events"
+    async with client.stream("GET", url) as stream:
+        network.release(transaction.id)
+        async for name, event, arrived in read_events(stream):
+            callback, expected = FLOW[transaction.action]
+            if name != expected:
+                continue
+            if transaction.action == "search":
+                for quote in event.get("data") or []:
+                    bpp_id = quote.get("bppId")
+                    if bpp_id in transaction.waiting_for:
+                        transaction.waiting_for.discard(bpp_id)
+                        sent = network.sent[(transaction.id, bpp_id, callback)]
+                        results.visible[callback].append(arrived - sent)
+                        transaction.selected = transaction.selected or quote
+                if transaction.waiting_for:
+                    continue
+                results.search_complete.append(arrived - transaction.started)
+            else:
+                sent = network.sent[(transaction.id, transaction.selected["bppId"], callback)]
+                results.visible[callback].append(arrived - sent)
+            transaction.step += 1
+            if transaction.done:
+                return
+            payload = {"transactionId": transaction.id}
+            if transaction.action == "select":
+                payload.update(providerId=transaction.selected["providerId"], itemId=transaction.selected["id"])
+            response = await client.post(f"/ondc/{transaction.action}", json=payload)
+            response.raise_for_status()
+
+
+async def run_transaction(client: httpx.AsyncClient, network: Network, results: Results, args):
+    lat, lng = random.choice(POINTS)
+    started = time.perf_counter()
+    results.started += 1
+    try:
+        response = await client.post("/ondc/search", json={
+            "latitude": lat, "longitude": lng,
+            "destination": {"latitude": lat + 0.03, "longitude": lng + 0.02},
+        })
+        response.raise_for_status()
+        transaction = Transaction(response.json()["transactionId"], started, FLOWS[args.flow], network.bpps)
+    except (httpx.HTTPError, ValueError, KeyError) as e:
+        results.failures[f"search {type(e).__name__}"] += 1
+        return
+
+    try:
+        # The push stream's heartbeats keep reads alive, so bound the whole flow
+        await asyncio.wait_for(follow(client, network, results, transaction), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        results.failures[f"{transaction.action} timeout"] += 1
+        return
+    except httpx.HTTPError as e:
+        results.failures[f"{transaction.action} {type(e).__name__}"] += 1
+        return
+    if not transaction.done:
+        results.failures[f"{transaction.action} stream closed"] += 1
+        return
+    results.completed += 1
+    results.flow_complete.append(time.perf_counter() - started)
+
+
+async def drive(client, network, results, args):
+    pending = set()
+    end = time.perf_counter() + args.duration
+    if args.rate:
+        interval = 1 / args.rate
+        next_start = time.perf_counter()
+        while next_start < end:
+            await asyncio.sleep(max(0.0, next_start - time.perf_counter()))
+            task = asyncio.create_task(run_transaction(client, network, results, args))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            next_start += interval
+    else:
+        async def worker():
+            while time.perf_counter() < end:
+                await run_transaction(client, network, results, args)
+        pending = {asyncio.create_task(worker()) for _ in range(args.concurrency)}
+    if pending:
+        await asyncio.wait(pending)
+
+
+def percentiles(values):
+    if not values:
+        return "-"
+    ms = np.array(values) * 1000
+    return (f"p50 {np.percentile(ms, 50):8.1f} ms  p95 {np.percentile(ms, 95):8.1f} ms  "
+            f"p99 {np.percentile(ms, 99):8.1f} ms  (n={len(values)})")
+
+
+def report(results: Results, network: Network, elapsed: float, args):
+    quotes = args.bpps * args.providers * args.items
+    print(f"{args.flow} flow: {args.bpps} BPPs x {args.providers} providers x {args.items} items "
+          f"({quotes} quotes per search), jitter {args.jitter_ms[0]:.0f}-{args.jitter_ms[1]:.0f} ms")
+    print(f"  searches started {results.started}, completed {results.completed} in {elapsed:.1f} s "
+          f"-> {results.completed / elapsed:.2f} completed/s")
+    print("  callback -> visible")
+    for callback, values in results.visible.items():
+        if values:
+            print(f"    {callback:<11} {percentiles(values)}")
+    print(f"  search -> all quotes visible  {percentiles(results.search_complete)}")
+    if args.flow != "search":
+        print(f"  whole flow                    {percentiles(results.flow_complete)}")
+    print(f"  callbacks {dict(sorted(network.callbacks.items()))}")
+    print(f"  inbound   {dict(sorted(network.inbound.items()))}")
+    if results.failures:
+        print(f"  failures  {dict(results.failures)}")
+
+
+def jitter_range(value: str):
+    low, _, high = value.partition(",")
+    return float(low), float(high or low)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gateway", default="http://127.0.0.1:8001", help="Gateway the BAP is reached through")
+    parser.add_argument("--host", default="127.0.0.1", help="Simulator listen address")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--public-url", help="Simulator URL as seen by Node (default http://host:port)")
+    parser.add_argument("--bpps", type=int, default=5, help="BPPs answering each search")
+    parser.add_argument("--providers", type=int, default=1, help="Providers per on_search catalog")
+    parser.add_argument("--items", type=int, default=3, help="Items per provider")
+    parser.add_argument("--jitter-ms", type=jitter_range, default=(20.0, 200.0),
+                        help="BPP answer delay range, e.g. 20,200")
+    parser.add_argument("--flow", choices=sorted(FLOWS), default="search")
+    parser.add_argument("--rate", type=float, help="Searches started per second (open loop)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Closed-loop transactions in flight")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-transaction deadline")
+    parser.add_argument("--connections", type=int, default=200, help="Callback connection pool size")
+    parser.add_argument("--bap-public-key", help="Node's ONDC_PUBLIC_KEY, to verify inbound signatures")
+    parser.add_argument("--serve", action="store_true", help="Only run the simulated network")
+    args = parser.parse_args()
+
+    network = Network(args, args.public_url or f"http://{args.host}:{args.port}")
+    server = uvicorn.Server(uvicorn.Config(network.app, host=args.host, port=args.port, log_level="warning"))
+    # Ctrl-C should stop the driver too, not just the simulated network
+    server.install_signal_handlers = lambda: None
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    try:
+        if args.serve:
+            await serving
+            return
+        results = Results()
+        limits = httpx.Limits(max_connections=args.connections)
+        async with httpx.AsyncClient(base_url=args.gateway, limits=limits, timeout=30.0) as client:
+            started = time.perf_counter()
+            await drive(client, network, results, args)
+            elapsed = time.perf_counter() - started
+        report(results, network, elapsed, args)
+    finally:
+        server.should_exit = True
+        await serving
+        await network.client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
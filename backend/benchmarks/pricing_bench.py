@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Fare engine benchmark
+Compares per-pair latency of the vectorized pricing engine, the gateway's
+/api/pricing/batch endpoint and one proxied /api/v1/pricing/estimate call per pair
+
+Usage:
+    python benchmarks/pricing_bench.py                      # engine + batch endpoint
+    python benchmarks/pricing_bench.py --gateway http://localhost:8001
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+
+import pricing_engine  # noqa: E402
+
+# Mumbai bounding box the app operates in
+LAT_RANGE = (18.90, 19.30)
+LNG_RANGE = (72.78, 73.00)
+
+
+def random_pairs(n, seed=7):
+    rng = np.random.default_rng(seed)
+    return (
+        rng.uniform(*LAT_RANGE, n), rng.uniform(*LNG_RANGE, n),
+        rng.uniform(*LAT_RANGE, n), rng.uniform(*LNG_RANGE, n),
+        rng.integers(0, 24, n),
+    )
+
+
+def bench_engine(sizes, repeats):
+    print("In-process engine")
+    for n in sizes:
+        pairs = random_pairs(n)
+        pricing_engine.price_batch(*pairs)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            pricing_engine.price_batch(*pairs)
+        elapsed = (time.perf_counter() - start) / repeats
+        print(f"  {n:>6} pairs: {elapsed * 1e3:8.3f} ms/batch  {elapsed / n * 1e6:8.3f} us/pair")
+
+
+def batch_payload(n):
+    origin_lat, origin_lng, dest_lat, dest_lng, _ = random_pairs(n)
+    return {
+        "originLat": origin_lat.tolist(), "originLng": origin_lng.tolist(),
+        "destLat": dest_lat.tolist(), "destLng": dest_lng.tolist(),
+    }
+
+
+async def bench_batch_endpoint(client, sizes, repeats):
+    print("POST /api/pricing/batch")
+    for n in sizes:
+        payload = batch_payload(n)
+        await client.post("/api/pricing/batch", json=payload)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            response = await client.post("/api/pricing/batch", json=payload)
+            response.raise_for_status()
+        elapsed = (time.perf_counter() - start) / repeats
+        print(f"  {n:>6} pairs: {elapsed * 1e3:8.3f} ms/call   {elapsed / n * 1e6:8.3f} us/pair")
+
+
+async def bench_proxied_estimate(client, n):
+    print("GET /api/v1/pricing/estimate (one proxied call per pair)")
+    distances = pricing_engine.haversine_km(*random_pairs(n)[:4])
+    durations = pricing_engine.travel_minutes(distances)
+    start = time.perf_counter()
+    for distance, duration in zip(distances, durations):
+        response = await client.get("/api/v1/pricing/estimate", params={
+            "distance": float(distance), "duration": float(duration),
+        })
+        response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    print(f"  {n:>6} pairs: {elapsed * 1e3:8.3f} ms total  {elapsed / n * 1e6:8.3f} us/pair")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gateway", help="Running gateway URL; also benchmarks the proxied path")
+    parser.add_argument("--sizes", default="1,100,1000,10000", help="Comma-separated batch sizes")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--proxied-pairs", type=int, default=200)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    bench_engine(sizes, args.repeats)
+
+    if args.gateway:
+        client = httpx.AsyncClient(base_url=args.gateway, timeout=60.0)
+    else:
+        from server import app
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://gateway")
+    async with client:
+        await bench_batch_endpoint(client, sizes, args.repeats)
+        if args.gateway:
+            await bench_proxied_estimate(client, args.proxied_pairs)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
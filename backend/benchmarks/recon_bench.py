@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Settlement reconciliation benchmark
+Builds a synthetic on_receiver_recon orderbook (default 100k orders) with a
+known share of amount mismatches, missing UTRs and orphan orders, then times
+each stage of the engine: parsing the orderbook, building the bulk upserts
+and the pandas join against confirmed transactions. The flags found are
+checked against the ones planted.
+
+With --mongo the orderbook is also written to a scratch database (--db,
+default hailo_bench, dropped afterwards): one unordered bulk_write against
+one find_one_and_update per order, as Node's reconService does, timed on a
+sample and extrapolated.
+
+Usage:
+    python benchmarks/recon_bench.py
+    python benchmarks/recon_bench.py --orders 100000 --repeat 5
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/recon_bench.py --mongo --sequential-sample 2000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from settlement_recon import (  # noqa: E402
+    SettlementRecon, confirmed_frame, reconcile_frames, settlement_frame, settlement_writes, summarize,
+)
+
+
+def synthetic_batch(n, mismatch_rate, missing_utr_rate, orphan_rate, seed=11):
+    """Orderbook orders, confirmed transactions and the order ids planted per check"""
+    rng = np.random.default_rng(seed)
+    amounts = np.round(rng.uniform(60, 900, n), 2)
+    mismatch = rng.random(n) < mismatch_rate
+    missing_utr = rng.random(n) < missing_utr_rate
+    orphan = rng.random(n) < orphan_rate
+    settled = np.where(mismatch, amounts + np.round(rng.uniform(1, 50, n), 2), amounts)
+
+    orders, transactions = [], []
+    for i in range(n):
+        order_id = f"order-{i:07d}"
+        orders.append({
+            "id": order_id,
+            "settlement_id": f"stl-{i:07d}",
+            "payment": {
+                "type": "UPI",
+                "urn": None if missing_utr[i] else f"UTR{i:010d}",
+                "params": {"amount": f"{settled[i]:.2f}", "currency": "INR"},
+            },
+        })
+        if not orphan[i]:
+            transactions.append({
+                "transactionId": f"txn-{i:07d}",
+                "status": "CONFIRMED",
+                "confirmedOrder": {
+                    "id": order_id,
+                    "quote": {"price": {"value": f"{amounts[i]:.2f}", "currency": "INR"}},
+                },
+            })
+    planted = {
+        "amount_mismatch": int((mismatch & ~orphan).sum()),
+        "missing_utr": int(missing_utr.sum()),
+        "orphan": int(orphan.sum()),
+    }
+    body = {
+        "context": {"action": "on_receiver_recon", "transaction_id": "bench-recon"},
+        "message": {"orderbook": {"orders": orders}},
+    }
+    return body, transactions, planted
+
+
+def best_of(repeat, function, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def bench_engine(body, transactions, planted, repeat):
+    orders = body["message"]["orderbook"]["orders"]
+    n = len(orders)
+    print(f"Engine stages, {n} orders, best of {repeat}:")
+    parse, (frame, _) = best_of(repeat, settlement_frame, orders)
+    writes, _ = best_of(repeat, settlement_writes, frame, "bench-recon", datetime.utcnow())
+    load, confirmed = best_of(repeat, confirmed_frame, transactions)
+    join, checked = best_of(repeat, reconcile_frames, frame, confirmed)
+    report, summary = best_of(repeat, summarize, checked)
+    total = parse + writes + load + join + report
+    for label, seconds in [("parse orderbook", parse), ("build upserts", writes),
+                           ("confirmed orders", load), ("join + checks", join), ("summary", report)]:
+        print(f"  {label:<17} {seconds * 1000:8.1f} ms")
+    print(f"  {'total':<17} {total * 1000:8.1f} ms  ({n / total:,.0f} orders/s)")
+    ok = all(summary["counts"][check] == planted[check] for check in planted)
+    print(f"  flags {summary['counts']}  planted {planted}  {'OK' if ok else 'MISMATCH'}")
+    return ok
+
+
+async def bench_mongo(body, transactions, sample, db_name):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[db_name]
+    try:
+        recon = SettlementRecon(db)
+        await recon.ensure_indexes()
+        await db.transactions.insert_many(transactions)
+        orders = body["message"]["orderbook"]["orders"]
+        n = len(orders)
+
+        start = time.perf_counter()
+        frame = await recon.ingest(body)
+        ingested = time.perf_counter() - start
+        start = time.perf_counter()
+        report = await recon.reconcile(frame)
+        reconciled = time.perf_counter() - start
+
+        # Node's loop: one awaited upsert per order
+        await db.settlements.delete_many({})
+        start = time.perf_counter()
+        for order in orders[:sample]:
+            payment = order.get("payment") or {}
+            await db.settlements.find_one_and_update(
+                {"orderId": order["id"]},
+                {"$set": {
+                    "transactionId": "bench-recon",
+                    "orderId": order["id"],
+                    "settlementId": order.get("settlement_id"),
+                    "amount": float((payment.get("params") or {}).get("amount") or 0),
+                    "status": "SETTLED",
+                    "urn": payment.get("urn"),
+                    "timestamp": datetime.utcnow(),
+                    "details": order,
+                }},
+                upsert=True,
+            )
+        sequential = (time.perf_counter() - start) / sample * n
+
+        print(f"MongoDB ({db_name}), {n} orders:")
+        print(f"  bulk_write upsert  {ingested:8.2f} s  ({n / ingested:,.0f} orders/s)")
+        print(f"  reconcile batch    {reconciled:8.2f} s  flags {report['counts']}")
+        print(f"  per-order upsert   {sequential:8.2f} s  (extrapolated from {sample})")
+        print(f"  speedup            {sequential / ingested:8.1f}x")
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--mismatch-rate", type=float, default=0.02)
+    parser.add_argument("--missing-utr-rate", type=float, default=0.01)
+    parser.add_argument("--orphan-rate", type=float, default=0.005)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--mongo", action="store_true", help="Also time writes against MONGO_URL")
+    parser.add_argument("--sequential-sample", type=int, default=1000,
+                        help="Orders upserted one by one to extrapolate Node's loop")
+    parser.add_argument("--db", default="hailo_bench")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    body, transactions, planted = synthetic_batch(
+        args.orders, args.mismatch_rate, args.missing_utr_rate, args.orphan_rate
+    )
+    print(f"Generated {args.orders} orders in {time.perf_counter() - start:.1f} s")
+    ok = bench_engine(body, transactions, planted, args.repeat)
+    if args.mongo:
+        asyncio.run(bench_mongo(body, transactions, min(args.sequential_sample, args.orders), args.db))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
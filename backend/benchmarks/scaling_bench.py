@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Multi-worker scaling benchmark
+Runs the gateway through serve.py with 1, 2, 4, ... workers against
+node_stub.py and drives each with several loadgen.py client processes (one
+Python client tops out well below a multi-core gateway), then reports total
+RPS, speedup and per-worker efficiency against the single-worker run.
+
+With --pin the gateway is restricted to as many CPUs as it has workers and
+the stub and clients to the remaining ones, so each run measures the gateway
+on exactly that many cores. Without enough CPUs for that, the load generators
+compete with the gateway and the speedup understates what it can do.
+
+Usage:
+    python benchmarks/scaling_bench.py --workers 1,2,4 --pin
+    python benchmarks/scaling_bench.py --scenario pricing --clients 6 --duration 20 --save scaling.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+from loadgen import SCENARIOS, free_port, wait_until_ready  # noqa: E402
+
+
+def default_worker_counts():
+    counts, count = [], 1
+    while count <= (os.cpu_count() or 1):
+        counts.append(count)
+        count *= 2
+    return counts
+
+
+def pinned(cpus):
+    """preexec_fn restricting a child process to cpus, or None to leave it be"""
+    if not cpus:
+        return None
+    return lambda: os.sched_setaffinity(0, cpus)
+
+
+def start_stub(port, args, cpus):
+    env = dict(os.environ)
+    env.update({
+        "STUB_LATENCY_MS": str(args.stub_latency_ms),
+        "STUB_PAYLOAD_KB": str(args.stub_payload_kb),
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "node_stub:app", "--port", str(port),
+         "--workers", str(args.stub_workers), "--log-level", "warning"],
+        cwd=BENCHMARKS_DIR, env=env, preexec_fn=pinned(cpus),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def start_gateway(port, workers, stub_url, cpus):
+    env = dict(os.environ)
+    env["NODE_UPSTREAMS"] = stub_url
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    env.pop("GATEWAY_SHARED_DIR", None)
+    return subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, preexec_fn=pinned(cpus),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def run_clients(url, args, cpus):
+    """Results of args.clients concurrent loadgen.py runs against url"""
+    with tempfile.TemporaryDirectory() as scratch:
+        paths = [os.path.join(scratch, f"client{i}.json") for i in range(args.clients)]
+        clients = [
+            subprocess.Popen(
+                [sys.executable, "loadgen.py", "--gateway", url, "--scenario", args.scenario,
+                 "--concurrency", str(args.concurrency), "--connections", str(args.concurrency),
+                 "--duration", str(args.duration), "--warmup", str(args.warmup), "--save", path],
+                cwd=BENCHMARKS_DIR, preexec_fn=pinned(cpus), stdout=subprocess.DEVNULL,
+            )
+            for path in paths
+        ]
+        for client in clients:
+            client.wait()
+        return [json.loads(Path(path).read_text()) for path in paths if Path(path).exists()]
+
+
+def combine(workers, results):
+    errors = {}
+    for result in results:
+        for name, count in result["errors"].items():
+            errors[name] = errors.get(name, 0) + count
+    return {
+        "workers": workers,
+        "clients": len(results),
+        "requests": sum(result["requests"] for result in results),
+        "rps": round(sum(result["rps"] for result in results), 1),
+        # The slowest client's percentiles; merging them would need raw samples
+        "p50_ms": max(result["latency_ms"]["p50"] for result in results),
+        "p99_ms": max(result["latency_ms"]["p99"] for result in results),
+        "errors": errors,
+    }
+
+
+def cpu_split(workers, args):
+    """CPUs for the gateway and for everything else, or (None, None) unpinned"""
+    available = sorted(os.sched_getaffinity(0))
+    if not args.pin:
+        return None, None
+    if len(available) <= workers:
+        print(f"  only {len(available)} CPUs; running {workers} workers unpinned")
+        return None, None
+    return set(available[:workers]), set(available[workers:])
+
+
+async def bench(workers, args):
+    gateway_cpus, other_cpus = cpu_split(workers, args)
+    stub_port, gateway_port = free_port(), free_port()
+    stub_url, gateway_url = f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{gateway_port}"
+    stub = start_stub(stub_port, args, other_cpus)
+    gateway = start_gateway(gateway_port, workers, stub_url, gateway_cpus)
+    try:
+        await wait_until_ready(f"{stub_url}/api/v1/health")
+        await wait_until_ready(f"{gateway_url}/api/")
+        results = await asyncio.to_thread(run_clients, gateway_url, args, other_cpus)
+    finally:
+        for process in (gateway, stub):
+            process.terminate()
+        for process in (gateway, stub):
+            process.wait()
+    if not results:
+        raise RuntimeError(f"No load generator finished against {workers} workers")
+    return combine(workers, results)
+
+
+def print_table(rows):
+    base = rows[0]["rps"] / rows[0]["workers"]
+    print(f"{'workers':>7} {'rps':>10} {'speedup':>8} {'efficiency':>10} {'p50 ms':>8} {'p99 ms':>8}  errors")
+    for row in rows:
+        speedup = row["rps"] / rows[0]["rps"]
+        efficiency = row["rps"] / (base * row["workers"])
+        print(f"{row['workers']:>7} {row['rps']:>10,.0f} {speedup:>7.2f}x {efficiency:>9.0%} "
+              f"{row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f}  {row['errors'] or ''}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=",".join(map(str, default_worker_counts())),
+                        help="Comma-separated worker counts (default 1,2,4,... up to the CPU count)")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mix")
+    parser.add_argument("--clients", type=int, default=4, help="loadgen.py processes per run")
+    parser.add_argument("--concurrency", type=int, default=32, help="Closed-loop workers per client")
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--pin", action="store_true", help="Give the gateway exactly one CPU per worker")
+    parser.add_argument("--stub-workers", type=int, default=2)
+    parser.add_argument("--stub-latency-ms", type=float, default=5.0)
+    parser.add_argument("--stub-payload-kb", type=float, default=4.0)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    rows = []
+    for workers in (int(count) for count in args.workers.split(",")):
+        print(f"{workers} worker(s): {args.clients} clients x {args.concurrency} concurrent, "
+              f"{args.scenario}, {args.duration:.0f} s")
+        rows.append(await bench(workers, args))
+    print()
+    print_table(rows)
+    if args.save:
+        Path(args.save).write_text(json.dumps(rows, indent=2) + "\n")
+        print(f"saved {args.save}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
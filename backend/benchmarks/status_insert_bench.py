@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+POST /api/status insert benchmark
+Compares inserts per second with one insert_one per request against the
+write-behind queue (STATUS_WRITE_BEHIND), at a fixed client concurrency
+
+Needs a reachable MongoDB in MONGO_URL. Writes go to a scratch database
+(--db, default hailo_bench) which is dropped afterwards.
+
+Usage:
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/status_insert_bench.py
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+
+async def run_mode(write_behind, requests, concurrency):
+    server.STATUS_WRITE_BEHIND = write_behind
+    await server.db.status_checks.delete_many({})
+    if write_behind:
+        server.status_writer.start(server.db.status_checks)
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+        remaining = iter(range(requests))
+        rejected = 0
+
+        async def worker():
+            nonlocal rejected
+            for i in remaining:
+                response = await client.post("/api/status", json={"client_name": f"bench-{i}"})
+                if response.status_code == 503:
+                    rejected += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        acknowledged = time.perf_counter() - start
+        if write_behind:
+            await server.status_writer.stop()
+        durable = time.perf_counter() - start
+
+    stored = await server.db.status_checks.count_documents({})
+    label = "write-behind" if write_behind else "insert_one"
+    print(f"  {label:<13} {requests / acknowledged:10.0f} acks/s  "
+          f"{stored / durable:10.0f} stored/s  stored={stored} rejected={rejected}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--db", default="hailo_bench")
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    # The app's own lifespan is not run; only its Mongo client is needed
+    server.client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    server.db = server.client[args.db]
+    print(f"{args.requests} requests at concurrency {args.concurrency}")
+    try:
+        await run_mode(False, args.requests, args.concurrency)
+        await run_mode(True, args.requests, args.concurrency)
+    finally:
+        await server.client.drop_database(args.db)
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
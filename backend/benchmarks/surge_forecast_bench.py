@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Surge forecaster backtest and benchmark
+Fits the model on all but the last days of observations, scores the held-out
+days against a no-surge forecast and Node's peak-hour heuristic, then times
+fitting and inference
+
+Usage:
+    python benchmarks/surge_forecast_bench.py                          # synthetic data
+    python benchmarks/surge_forecast_bench.py --mongo --commute-db ../server/prisma/dev.db
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from surge_forecast import SurgeForecaster, fit_surge_model, read_commute_logs  # noqa: E402
+
+# Mumbai bounding box the app operates in
+LAT_RANGE = (18.90, 19.30)
+LNG_RANGE = (72.78, 73.00)
+TIMEZONE = "Asia/Kolkata"
+PRECISION = 5
+
+
+def synthetic_observations(n, days, seed=7):
+    """Weekday commute peaks whose size varies by area, plus noise"""
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now(tz="UTC")
+    lat = rng.uniform(*LAT_RANGE, n)
+    lng = rng.uniform(*LNG_RANGE, n)
+    timestamps = now - pd.to_timedelta(rng.uniform(0, days * 86400, n), unit="s")
+    local = pd.DatetimeIndex(timestamps).tz_convert(TIMEZONE)
+    hour = local.hour.to_numpy() + local.minute.to_numpy() / 60
+    weekday = local.dayofweek.to_numpy() < 5
+    # Business districts surge in the evening, residential ones in the morning
+    business = np.clip((lat - LAT_RANGE[0]) / (LAT_RANGE[1] - LAT_RANGE[0]), 0, 1)
+    morning = np.exp(-((hour - 9) ** 2) / 2) * (1 - business)
+    evening = np.exp(-((hour - 18.5) ** 2) / 2) * business
+    multiplier = 1 + weekday * 0.6 * (morning + evening) + rng.normal(0, 0.08, n)
+    return pd.DataFrame({"lat": lat, "lng": lng, "timestamp": timestamps, "multiplier": multiplier})
+
+
+async def mongo_observations(commute_db, days):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[os.environ.get('DB_NAME', 'test_database')]
+    forecaster = SurgeForecaster(db, precision=PRECISION, tz=TIMEZONE, lookback_days=days,
+                                 commute_db_path=commute_db)
+    try:
+        return await forecaster.load_observations(datetime.now(timezone.utc))
+    finally:
+        client.close()
+
+
+def node_heuristic(times):
+    """Expected value of routes/surge.js /forecast, without its noise"""
+    hour = times.tz_convert(TIMEZONE).hour.to_numpy()
+    peak = ((hour >= 8) & (hour < 10)) | ((hour >= 17) & (hour < 20))
+    daytime = (hour >= 6) & (hour < 22)
+    return np.where(peak, 1.35, np.where(daytime, 1.1, 1.0))
+
+
+def report(name, predicted, actual):
+    error = predicted - actual
+    print(f"  {name:<16} MAE {np.abs(error).mean():.4f}  RMSE {np.sqrt((error ** 2).mean()):.4f}")
+
+
+def backtest(observations, test_days):
+    timestamps = pd.DatetimeIndex(pd.to_datetime(observations["timestamp"], utc=True))
+    cutoff = timestamps.max() - pd.Timedelta(days=test_days)
+    train = observations[timestamps <= cutoff]
+    test = observations[timestamps > cutoff]
+    test_times = timestamps[timestamps > cutoff]
+    print(f"Backtest: {len(train)} training, {len(test)} held-out observations after {cutoff:%Y-%m-%d %H:%M}")
+
+    start = time.perf_counter()
+    model = fit_surge_model(train, PRECISION, TIMEZONE, now=cutoff)
+    print(f"  fit {(time.perf_counter() - start) * 1e3:.1f} ms, {len(model.cells)} cells")
+
+    actual = np.clip(test["multiplier"].to_numpy(dtype=np.float64), 0.5, 3.0)
+    report("no surge", np.ones_like(actual), actual)
+    report("node heuristic", node_heuristic(test_times), actual)
+    report("model", model.predict(test["lat"].to_numpy(), test["lng"].to_numpy(), test_times), actual)
+    return model
+
+
+def bench_inference(model, sizes, repeats, horizons):
+    print(f"Inference ({len(horizons)} horizons)")
+    now = datetime.now(timezone.utc)
+    rng = np.random.default_rng(11)
+    samples = []
+    for _ in range(repeats * 50):
+        lat, lng = rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE)
+        start = time.perf_counter()
+        model.forecast(lat, lng, now, horizons)
+        samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1e6
+    print(f"  single location: p50 {np.percentile(samples, 50):7.1f} us  p99 {np.percentile(samples, 99):7.1f} us")
+    for n in sizes:
+        lat, lng = rng.uniform(*LAT_RANGE, n), rng.uniform(*LNG_RANGE, n)
+        model.forecast(lat, lng, now, horizons)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model.forecast(lat, lng, now, horizons)
+        elapsed = (time.perf_counter() - start) / repeats
+        print(f"  {n:>7} locations: {elapsed * 1e3:8.3f} ms/batch  {elapsed / n * 1e6:8.3f} us/location")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", action="store_true", help="Backtest on RideHistory from MONGO_URL/DB_NAME")
+    parser.add_argument("--commute-db", help="Prisma SQLite file with CommuteLog rows")
+    parser.add_argument("--observations", type=int, default=200000, help="Synthetic observations")
+    parser.add_argument("--days", type=float, default=28)
+    parser.add_argument("--test-days", type=float, default=7)
+    parser.add_argument("--sizes", default="100,10000,100000", help="Comma-separated batch sizes")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.mongo:
+        observations = asyncio.run(mongo_observations(args.commute_db, args.days))
+    elif args.commute_db:
+        observations = read_commute_logs(args.commute_db, 1000000)
+    else:
+        observations = synthetic_observations(args.observations, args.days)
+    if observations.empty:
+        sys.exit("No observations to backtest on")
+
+    model = backtest(observations, args.test_days)
+    bench_inference(model, [int(size) for size in args.sizes.split(",")], args.repeats, [0, 15, 30, 45, 60])
+
+
+if __name__ == "__main__":
+    main()
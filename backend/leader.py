@@ -0,0 +1,87 @@
+"""Picks the worker process that runs the gateway's once-per-host work
+
+Workers sharing GATEWAY_SHARED_DIR race for an exclusive flock on a file in
+it. The holder folds price rollups, fits the surge model and follows rides
+into user insights; the others read the results. The kernel drops the lock
+when its holder exits, and another worker takes over on its next attempt.
+Without a lock path (single process) this process is always the leader.
+"""
+import asyncio
+import fcntl
+import logging
+import os
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """flock-based leadership among the workers of one host"""
+
+    def __init__(self, lock_path: Optional[str], retry_interval: float = 5.0):
+        self.lock_path = lock_path
+        self.retry_interval = retry_interval
+        self.elected_at: Optional[datetime] = None
+        self._fd: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self.elected_at is not None
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # For whoever wonders which worker leads
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, f"{os.getpid()}\n".encode(), 0)
+        self._fd = fd
+        return True
+
+    def _elected(self, on_elected: Callable[[], None]):
+        self.elected_at = datetime.utcnow()
+        logger.info(f"Worker {os.getpid()} leads the once-per-host work")
+        try:
+            on_elected()
+        except Exception as e:
+            logger.error(f"Starting the leader's work failed: {e!r}")
+
+    def start(self, on_elected: Callable[[], None]) -> bool:
+        """Take the lead now or keep trying in the background; True if now"""
+        if self.lock_path is None or self._try_lock():
+            self._elected(on_elected)
+            return True
+        if self._task is None:
+            self._task = asyncio.create_task(self._campaign(on_elected))
+        return False
+
+    async def _campaign(self, on_elected: Callable[[], None]):
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            try:
+                if self._try_lock():
+                    self._elected(on_elected)
+                    return
+            except OSError as e:
+                logger.warning(f"Leader lock {self.lock_path} unavailable: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self.elected_at = None
+
+    def stats(self) -> Dict:
+        return {"leader": self.is_leader, "elected_at": self.elected_at, "pid": os.getpid()}
@@ -0,0 +1,291 @@
+"""Overload protection for the Node.js upstream
+
+AdaptiveLimiter caps how many requests wait on Node at once and moves the cap
+with observed latency, CircuitBreaker fails fast while Node keeps erroring and
+RetryBudget keeps retries to a small share of traffic so they cannot amplify
+a brownout.
+"""
+import asyncio
+import collections
+import heapq
+import itertools
+import time
+from typing import Deque, Dict, List, Optional
+
+
+class UpstreamOverloaded(Exception):
+    """Raised when a request is shed instead of being sent to Node"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _LatencyBaseline:
+    """Unloaded and smoothed latency of one kind of request"""
+
+    __slots__ = ("baseline", "smoothed", "window_min", "window_started")
+
+    def __init__(self, now: float):
+        self.baseline: Optional[float] = None
+        self.smoothed: Optional[float] = None
+        self.window_min: Optional[float] = None
+        self.window_started = now
+
+    def update(self, latency: float, now: float, window: float):
+        if now - self.window_started >= window:
+            self.window_started = now
+            self.baseline = self.window_min
+            self.window_min = None
+        if self.window_min is None or latency < self.window_min:
+            self.window_min = latency
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        # Smoothed so a single slow response does not cut the limit
+        self.smoothed = latency if self.smoothed is None else self.smoothed * 0.9 + latency * 0.1
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit driven by upstream latency
+
+    The limit grows by about one per limit's worth of on-time responses while
+    at least half of it is in use. It is multiplied by backoff, at most once
+    per round trip, when a response fails or the smoothed latency exceeds
+    tolerance times the baseline. Baselines are kept per route, since a health
+    check and a fare search take very different times when Node is idle; each
+    is the fastest response of the current and previous baseline_window, so
+    it is relearned when Node's unloaded speed changes. Requests over the
+    limit wait up to queue_timeout seconds.
+
+    Waiting requests are let through in start-time fair queuing order across
+    flows (callers). Each is tagged with its flow's last finish tag, or the
+    current virtual time if that is later, plus its cost, and the lowest tag
+    goes next. A caller with a deep backlog of expensive requests therefore
+    waits behind its own queue rather than in front of everyone else's; with
+    a single flow this is FIFO.
+    """
+
+    def __init__(self, initial_limit: int = 20, min_limit: int = 2, max_limit: int = 200,
+                 backoff: float = 0.9, tolerance: float = 2.0, max_queue: int = 100,
+                 queue_timeout: float = 1.0, baseline_window: float = 30.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.baseline_window = baseline_window
+        self.in_flight = 0
+        self._baselines: Dict[str, _LatencyBaseline] = {}
+        self.shed = 0
+        # (finish tag, arrival, start tag, flow, waiter)
+        self._waiters: List[tuple] = []
+        self._arrivals = itertools.count()
+        self._virtual_time = 0.0
+        self._flow_finish: Dict[str, float] = {}
+        self._last_decrease = 0.0
+
+    async def acquire(self, flow: str = "", cost: float = 1.0):
+        """Take a slot, waiting behind earlier requests of the same flow if the limit is reached"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            raise UpstreamOverloaded("queue_full", self.queue_timeout)
+        waiter = asyncio.get_running_loop().create_future()
+        start = max(self._virtual_time, self._flow_finish.get(flow, 0.0))
+        self._flow_finish[flow] = start + cost
+        heapq.heappush(self._waiters, (start + cost, next(self._arrivals), start, flow, waiter))
+        try:
+            # asyncio.wait leaves the waiter alone on timeout, so a slot handed
+            # over at the last moment is seen below rather than lost
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if not waiter.done():
+            self._abandon(waiter)
+            self.shed += 1
+            raise UpstreamOverloaded("queue_timeout", self.queue_timeout)
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done():
+            # The slot was already handed over; pass it on
+            self.release()
+        else:
+            waiter.cancel()
+            self._waiters = [entry for entry in self._waiters if entry[4] is not waiter]
+            heapq.heapify(self._waiters)
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, start, _, waiter = heapq.heappop(self._waiters)
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            self._virtual_time = start
+            waiter.set_result(None)
+        if not self._waiters:
+            # Tags only order requests that wait together
+            self._virtual_time = 0.0
+            self._flow_finish.clear()
+        elif len(self._flow_finish) > 2 * self.max_queue:
+            # Flows whose tags the virtual time has passed start from it anyway
+            self._flow_finish = {
+                flow: finish for flow, finish in self._flow_finish.items() if finish > self._virtual_time
+            }
+
+    def observe(self, latency: float, ok: bool = True, route: str = ""):
+        """Adjust the limit from one upstream response"""
+        now = time.monotonic()
+        if ok:
+            baseline = self._baselines.get(route)
+            if baseline is None:
+                baseline = self._baselines[route] = _LatencyBaseline(now)
+            baseline.update(latency, now, self.baseline_window)
+            if baseline.smoothed <= baseline.baseline * self.tolerance:
+                if self.in_flight * 2 >= self.limit:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                    self._wake()
+                return
+        # Responses already in flight when Node slowed down report the same
+        # congestion, so back off at most once per round trip
+        if now - self._last_decrease < latency:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+
+    def snapshot(self) -> Dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "queued_flows": len({entry[3] for entry in self._waiters}),
+            "baseline_ms": {
+                route: round(baseline.baseline * 1000, 3) for route, baseline in self._baselines.items()
+            },
+            "shed": self.shed,
+        }
+
+
+class CircuitBreaker:
+    """Opens on a sustained failure ratio and probes Node before closing
+
+    Outcomes are counted in one-second buckets over window seconds. With at
+    least min_requests in the window and failure_ratio of them failed, the
+    circuit opens and requests are shed for open_seconds. Then one probe is
+    let through per open_seconds (half-open) until one succeeds and closes
+    the circuit again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_ratio: float = 0.5, min_requests: int = 20,
+                 window: float = 10.0, open_seconds: float = 5.0):
+        self.failure_ratio = failure_ratio
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.opened = 0
+        self._retry_at = 0.0
+        # [second, requests, failures]
+        self._buckets: Deque[list] = collections.deque()
+
+    def allow(self):
+        """Raise UpstreamOverloaded unless a request may be sent now"""
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise UpstreamOverloaded("circuit_open", self._retry_at - now)
+        # Let this request through as a probe and hold the rest back
+        self.state = self.HALF_OPEN
+        self._retry_at = now + self.open_seconds
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            # Late results of requests sent before the circuit opened
+            return
+        if self.state == self.HALF_OPEN:
+            if ok:
+                self.state = self.CLOSED
+            else:
+                self._open(now)
+            return
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        self._buckets[-1][1] += 1
+        while self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        if ok:
+            return
+        self._buckets[-1][2] += 1
+        requests = sum(bucket[1] for bucket in self._buckets)
+        failures = sum(bucket[2] for bucket in self._buckets)
+        if requests >= self.min_requests and failures >= requests * self.failure_ratio:
+            self._open(now)
+
+    def _open(self, now: float):
+        self.state = self.OPEN
+        self.opened += 1
+        self._retry_at = now + self.open_seconds
+        self._buckets.clear()
+
+    def snapshot(self) -> Dict:
+        return {"state": self.state, "opened": self.opened}
+
+
+class RetryBudget:
+    """Retries limited to ratio of recent requests plus a small floor
+
+    Over a sliding window, each request earns ratio of a retry and each retry
+    spends one, so during a brownout retries add at most ratio extra load.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, window: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self.retries = 0
+        self.exhausted = 0
+        # [second, requests, retries]
+        self._buckets: Deque[list] = collections.deque()
+
+    def _bucket(self) -> list:
+        now = time.monotonic()
+        second = int(now)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        while self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        return self._buckets[-1]
+
+    def record_request(self):
+        self._bucket()[1] += 1
+
+    def try_retry(self) -> bool:
+        """Spend one retry if the budget allows it"""
+        bucket = self._bucket()
+        requests = sum(b[1] for b in self._buckets)
+        retries = sum(b[2] for b in self._buckets)
+        if retries + 1 > self.min_per_second * self.window + self.ratio * requests:
+            self.exhausted += 1
+            return False
+        bucket[2] += 1
+        self.retries += 1
+        return True
+
+    def snapshot(self) -> Dict:
+        return {"retries": self.retries, "exhausted": self.exhausted}
@@ -0,0 +1,335 @@
+"""Incremental geo-temporal price rollups over the RideHistory time series
+
+Node writes every BPP quote to the `ridehistories` time-series collection.
+PriceRollups folds quotes newer than a watermark into one document per
+geohash cell x 15-minute slot of the week x provider x vehicle type, holding
+count, min/max, a log-binned price histogram (for median/p90) and an EWMA.
+Batches are aggregated with pandas, and each rollup document records how far
+it has been folded, so a batch replayed after a crash is not counted twice.
+"Typical price here at this hour" is then a lookup on the rollup index.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, ReplaceOne
+
+from response_cache import GEOHASH_ALPHABET
+
+logger = logging.getLogger(__name__)
+
+RIDE_HISTORY_COLLECTION = "ridehistories"
+ROLLUP_COLLECTION = "price_rollups"
+STATE_COLLECTION = "rollup_state"
+STATE_ID = "ride_history_prices"
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+SLOTS_PER_WEEK = 7 * SLOTS_PER_DAY
+
+# Log-spaced price bin edges in rupees; each bin is ~7.5% wide, which bounds
+# the error of quantiles read off the histogram
+PRICE_BIN_EDGES = np.geomspace(10, 10000, 97)
+
+ROLLUP_KEYS = ["cell", "slot", "providerId", "vehicleType"]
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def geohash_encode_many(lat, lng, precision: int = 6) -> np.ndarray:
+    """Vectorized geohash_encode: same bisection, one NumPy pass per bit"""
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    lat_lo, lat_hi = np.full(lat.shape, -90.0), np.full(lat.shape, 90.0)
+    lng_lo, lng_hi = np.full(lng.shape, -180.0), np.full(lng.shape, 180.0)
+    alphabet = np.array(list(GEOHASH_ALPHABET))
+    chars = []
+    for _ in range(precision):
+        code = np.zeros(lat.shape, dtype=np.int64)
+        for bit in range(5):
+            # Even bits (counted across the whole hash) split longitude
+            if (len(chars) * 5 + bit) % 2 == 0:
+                values, lo, hi = lng, lng_lo, lng_hi
+            else:
+                values, lo, hi = lat, lat_lo, lat_hi
+            mid = (lo + hi) / 2
+            upper = values >= mid
+            np.copyto(lo, mid, where=upper)
+            np.copyto(hi, mid, where=~upper)
+            code = (code << 1) | upper
+        chars.append(alphabet[code])
+    if not chars:
+        return np.full(lat.shape, "", dtype=object)
+    cells = chars[0].astype(object)
+    for column in chars[1:]:
+        cells = cells + column
+    return cells
+
+
+def slot_of_week(timestamps: pd.Series, tz: str) -> np.ndarray:
+    """15-minute slot of the local week, Monday 00:00 being slot 0"""
+    local = timestamps.dt.tz_convert(tz)
+    return (
+        local.dt.dayofweek * SLOTS_PER_DAY
+        + local.dt.hour * (60 // SLOT_MINUTES)
+        + local.dt.minute // SLOT_MINUTES
+    ).to_numpy()
+
+
+def histogram_quantiles(hist: np.ndarray, quantiles) -> List[Optional[float]]:
+    """Quantiles of a binned price distribution, interpolated within bins"""
+    hist = np.asarray(hist, dtype=np.float64)
+    total = hist.sum()
+    if total <= 0:
+        return [None for _ in quantiles]
+    cumulative = np.cumsum(hist)
+    values = []
+    for q in quantiles:
+        target = q * total
+        i = int(np.searchsorted(cumulative, target, side="left"))
+        i = min(i, len(hist) - 1)
+        before = cumulative[i - 1] if i > 0 else 0.0
+        fraction = (target - before) / hist[i] if hist[i] else 0.0
+        lo, hi = PRICE_BIN_EDGES[i], PRICE_BIN_EDGES[i + 1]
+        # Geometric interpolation matches the log spacing of the bins
+        values.append(round(float(lo * (hi / lo) ** fraction), 2))
+    return values
+
+
+def price_stats(count: int, price_min: float, price_max: float, hist, ewma: Optional[float]) -> Dict:
+    median, p90 = histogram_quantiles(hist, (0.5, 0.9))
+    # Bin interpolation can step outside the observed range
+    clamp = lambda value: None if value is None else min(max(value, price_min), price_max)
+    return {
+        "count": int(count),
+        "min": price_min,
+        "median": clamp(median),
+        "p90": clamp(p90),
+        "max": price_max,
+        "ewma": round(ewma, 2) if ewma is not None else None,
+    }
+
+
+class PriceRollups:
+    """Watermarked batch folding of RideHistory quotes into rollup documents"""
+
+    def __init__(self, db=None, precision: int = 6, tz: str = "Asia/Kolkata",
+                 ewma_alpha: float = 0.2, batch_size: int = 20000,
+                 settle_seconds: float = 5.0, interval: float = 60.0):
+        self.precision = precision
+        self.tz = tz
+        self.ewma_alpha = ewma_alpha
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self.interval = interval
+        self.watermark: Optional[datetime] = None
+        self.processed = 0
+        self.last_run: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        if db is not None:
+            self.bind(db)
+
+    def bind(self, db):
+        self.history = db[RIDE_HISTORY_COLLECTION]
+        self.rollups = db[ROLLUP_COLLECTION]
+        self.state = db[STATE_COLLECTION]
+
+    async def ensure_indexes(self):
+        await self.rollups.create_index(
+            [(key, ASCENDING) for key in ROLLUP_KEYS], name="rollup_key", unique=True
+        )
+
+    async def load_watermark(self) -> datetime:
+        state = await self.state.find_one({"_id": STATE_ID})
+        return state["watermark"] if state else EPOCH
+
+    async def run_once(self) -> int:
+        """Fold all settled quotes past the watermark; returns how many"""
+        watermark = await self.load_watermark()
+        # Quotes are stamped by Node just before insert; leaving the newest
+        # seconds alone lets in-flight inserts land before their window closes
+        upper = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=self.settle_seconds)
+        processed = 0
+        while watermark < upper:
+            docs = await self._next_batch(watermark, upper)
+            if not docs:
+                break
+            batch_end = docs[-1]["timestamp"]
+            await self._fold(docs, batch_end)
+            watermark = batch_end
+            await self.state.update_one(
+                {"_id": STATE_ID}, {"$set": {"watermark": watermark}}, upsert=True
+            )
+            processed += len(docs)
+        self.watermark = watermark
+        self.processed += processed
+        self.last_run = datetime.utcnow()
+        return processed
+
+    async def _next_batch(self, watermark: datetime, upper: datetime) -> List[Dict]:
+        projection = {"_id": 0, "timestamp": 1, "location": 1, "providerId": 1, "vehicleType": 1, "price": 1}
+        cursor = self.history.find(
+            {"timestamp": {"$gt": watermark, "$lte": upper}}, projection
+        ).sort("timestamp", ASCENDING).limit(self.batch_size)
+        docs = await cursor.to_list(length=self.batch_size)
+        if len(docs) < self.batch_size:
+            return docs
+        # Quotes of one search share a timestamp; a batch must not end in the
+        # middle of them or the watermark would skip the rest
+        last = docs[-1]["timestamp"]
+        docs = [doc for doc in docs if doc["timestamp"] < last]
+        if docs:
+            return docs
+        return await self.history.find({"timestamp": last}, projection).to_list(length=None)
+
+    def aggregate(self, docs: List[Dict]) -> pd.DataFrame:
+        """Per-key count, min, max, histogram and EWMA terms of a batch"""
+        df = pd.DataFrame(docs)
+        df = df[pd.to_numeric(df["price"], errors="coerce").notna()]
+        if df.empty:
+            # No quote in the batch had a usable price
+            return pd.DataFrame(columns=ROLLUP_KEYS + ["count", "min", "max", "first", "ewma_terms", "hist"])
+        coordinates = np.array([doc["coordinates"] for doc in df["location"]], dtype=np.float64)
+        df = df.assign(
+            price=df["price"].astype(np.float64),
+            cell=geohash_encode_many(coordinates[:, 1], coordinates[:, 0], self.precision),
+            slot=slot_of_week(pd.to_datetime(df["timestamp"], utc=True), self.tz),
+            vehicleType=df.get("vehicleType", pd.Series(index=df.index, dtype=object)).fillna(""),
+        ).sort_values("timestamp", kind="stable")
+        bins = np.clip(np.searchsorted(PRICE_BIN_EDGES, df["price"].to_numpy(), side="right") - 1,
+                       0, len(PRICE_BIN_EDGES) - 2)
+        grouped = df.groupby(ROLLUP_KEYS, sort=False)
+        # EWMA over n new prices x_1..x_n from a prior s_0:
+        # s_n = (1-a)^n s_0 + sum_i a (1-a)^(n-i) x_i
+        from_end = grouped.cumcount(ascending=False).to_numpy()
+        weighted = df["price"].to_numpy() * self.ewma_alpha * (1 - self.ewma_alpha) ** from_end
+        df = df.assign(weighted=weighted, bin=bins)
+        grouped = df.groupby(ROLLUP_KEYS, sort=False)
+        result = grouped["price"].agg(["count", "min", "max", "first"])
+        result["ewma_terms"] = grouped["weighted"].sum()
+        result["hist"] = list(
+            df.groupby(ROLLUP_KEYS + ["bin"], sort=False).size()
+            .unstack("bin", fill_value=0)
+            .reindex(columns=range(len(PRICE_BIN_EDGES) - 1), fill_value=0)
+            .reindex(result.index)
+            .to_numpy(dtype=np.int64)
+        )
+        return result.reset_index()
+
+    async def _fold(self, docs: List[Dict], batch_end: datetime):
+        batch = self.aggregate(docs)
+        if batch.empty:
+            return
+        ids = [
+            f"{row.cell}|{row.slot}|{row.providerId}|{row.vehicleType}"
+            for row in batch.itertuples(index=False)
+        ]
+        existing = {
+            doc["_id"]: doc async for doc in self.rollups.find({"_id": {"$in": ids}})
+        }
+        decay = (1 - self.ewma_alpha) ** batch["count"].to_numpy()
+        now = datetime.utcnow()
+        writes = []
+        for rollup_id, row, row_decay in zip(ids, batch.itertuples(index=False), decay):
+            previous = existing.get(rollup_id)
+            if previous is not None and previous["through"] >= batch_end:
+                # Already folded before a crash lost the watermark update
+                continue
+            if previous is None:
+                count, price_min, price_max = int(row.count), float(row.min), float(row.max)
+                hist = row.hist
+                prior = float(row.first)
+            else:
+                count = previous["count"] + int(row.count)
+                price_min = min(previous["min"], float(row.min))
+                price_max = max(previous["max"], float(row.max))
+                hist = np.asarray(previous["hist"], dtype=np.int64) + row.hist
+                prior = previous["ewma"]
+            ewma = row_decay * prior + row.ewma_terms
+            writes.append(ReplaceOne({"_id": rollup_id}, {
+                "cell": row.cell,
+                "slot": int(row.slot),
+                "providerId": row.providerId,
+                "vehicleType": row.vehicleType,
+                **price_stats(count, price_min, price_max, hist, float(ewma)),
+                "hist": hist.tolist(),
+                "through": batch_end,
+                "updatedAt": now,
+            }, upsert=True))
+        if writes:
+            await self.rollups.bulk_write(writes, ordered=False)
+
+    async def lookup(self, lat: float, lng: float, at: datetime, window: int = 2,
+                     provider_id: Optional[str] = None, vehicle_type: Optional[str] = None) -> Dict:
+        """Price statistics for a location within window slots of a time"""
+        cell = geohash_encode_many([lat], [lng], self.precision)[0]
+        at = pd.Timestamp(at)
+        at = at.tz_localize("UTC") if at.tzinfo is None else at
+        slot = int(slot_of_week(pd.Series([at]), self.tz)[0])
+        slots = sorted({(slot + offset) % SLOTS_PER_WEEK for offset in range(-window, window + 1)})
+        query = {"cell": cell, "slot": {"$in": slots}}
+        if provider_id is not None:
+            query["providerId"] = provider_id
+        if vehicle_type is not None:
+            query["vehicleType"] = vehicle_type
+        docs = await self.rollups.find(query, {"_id": 0, "updatedAt": 0, "through": 0}).to_list(length=None)
+
+        # Merge the matching slots per provider and vehicle type, and overall
+        groups: Dict[tuple, List[Dict]] = {}
+        for doc in docs:
+            groups.setdefault((doc["providerId"], doc["vehicleType"]), []).append(doc)
+        providers = [
+            {"providerId": provider, "vehicleType": vehicle, **self._merge(group)}
+            for (provider, vehicle), group in groups.items()
+        ]
+        providers.sort(key=lambda item: -item["count"])
+        return {
+            "cell": cell,
+            "slot": slot,
+            "slots": slots,
+            "overall": self._merge(docs) if docs else None,
+            "providers": providers,
+        }
+
+    @staticmethod
+    def _merge(docs: List[Dict]) -> Dict:
+        count = sum(doc["count"] for doc in docs)
+        hist = np.sum([doc["hist"] for doc in docs], axis=0)
+        # Weight each slot's EWMA by how many quotes it has seen
+        ewma = sum(doc["ewma"] * doc["count"] for doc in docs) / count
+        return price_stats(
+            count, min(doc["min"] for doc in docs), max(doc["max"] for doc in docs), hist, ewma
+        )
+
+    async def _run_forever(self):
+        while True:
+            try:
+                processed = await self.run_once()
+                if processed:
+                    logger.info(f"Folded {processed} ride history quotes into price rollups")
+            except Exception as e:
+                logger.warning(f"Price rollup run failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            "watermark": self.watermark,
+            "processed": self.processed,
+            "last_run": self.last_run,
+        }
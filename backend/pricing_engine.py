@@ -0,0 +1,124 @@
+"""Vectorized fare and surge engine mirroring the Node.js pricing formulas
+
+Every function takes NumPy arrays (or scalars) and broadcasts, so thousands of
+origin/destination pairs, or one pair across many departure times, are priced
+in a single call. Rounding follows JavaScript's Math.round.
+"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+# routes/pricing.js /pricing/estimate
+ESTIMATE_BASE_FARE = 40
+ESTIMATE_PER_KM = 12
+ESTIMATE_PER_MIN = 2
+
+# uberService.generateMumbaiPricing
+MUMBAI_BASE_FARE = 30
+MUMBAI_PER_KM = 12
+MUMBAI_PEAK_MULTIPLIER = 1.3
+
+# uberService.getEstimate assumes ~24 km/h average Mumbai speed
+MUMBAI_KM_PER_MIN = 0.4
+
+# Outputs of price_batch that are not rounded to whole rupees
+FRACTIONAL_FIELDS = ("distanceKm", "durationMin", "surgeMultiplier")
+
+
+def js_round(values):
+    """Math.round: halves round towards positive infinity"""
+    # Not floor(x + 0.5): that addition itself rounds up just below a half
+    values = np.asarray(values, dtype=np.float64)
+    floor = np.floor(values)
+    return floor + (values - floor >= 0.5)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """uberService.calculateDistance over arrays of coordinates"""
+    # Same operation order as the JS; results still differ from V8 by an ulp
+    # or so where the platform libm and V8's fdlibm disagree
+    lat1, lng1, lat2, lng2 = (np.asarray(v, dtype=np.float64) for v in (lat1, lng1, lat2, lng2))
+    half_dlat = np.sin((lat2 - lat1) * np.pi / 180 / 2)
+    half_dlng = np.sin((lng2 - lng1) * np.pi / 180 / 2)
+    a = (half_dlat * half_dlat
+         + np.cos(lat1 * np.pi / 180) * np.cos(lat2 * np.pi / 180) * half_dlng * half_dlng)
+    return EARTH_RADIUS_KM * (2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)))
+
+
+def travel_minutes(distance_km):
+    """uberService mock ETA without its random jitter"""
+    return js_round(np.asarray(distance_km, dtype=np.float64) / MUMBAI_KM_PER_MIN)
+
+
+def surge_multiplier_for_hour(hours):
+    """routes/surge.js /current multiplier by local hour"""
+    hours = np.asarray(hours)
+    return np.select(
+        [(hours >= 8) & (hours < 10), (hours >= 17) & (hours < 20), (hours >= 12) & (hours < 14)],
+        [1.3, 1.4, 1.1],
+        default=1.0,
+    )
+
+
+def estimate_breakdown(distance_km, duration_min, surge_multiplier):
+    """routes/pricing.js /pricing/estimate breakdown as arrays"""
+    distance_km, duration_min, surge_multiplier = np.broadcast_arrays(
+        *(np.asarray(v, dtype=np.float64) for v in (distance_km, duration_min, surge_multiplier))
+    )
+    distance_charge = distance_km * ESTIMATE_PER_KM
+    time_charge = duration_min * ESTIMATE_PER_MIN
+    subtotal = ESTIMATE_BASE_FARE + distance_charge + time_charge
+    surge_charge = subtotal * (surge_multiplier - 1)
+    total = subtotal + surge_charge
+    return {
+        "baseFare": np.full(total.shape, ESTIMATE_BASE_FARE, dtype=np.float64),
+        "distanceCharge": js_round(distance_charge),
+        "timeCharge": js_round(time_charge),
+        "surgeCharge": js_round(surge_charge),
+        "subtotal": js_round(subtotal),
+        "total": js_round(total),
+        "estimatedMin": js_round(total * 0.9),
+        "estimatedMax": js_round(total * 1.1),
+    }
+
+
+def mumbai_price_range(distance_km, hours, surge_multiplier=1.0):
+    """uberService.generateMumbaiPricing with an explicit surge multiplier"""
+    distance_km = np.asarray(distance_km, dtype=np.float64)
+    hours = np.asarray(hours)
+    # JS uses inclusive upper bounds here, unlike routes/surge.js
+    is_peak = ((hours >= 8) & (hours <= 10)) | ((hours >= 17) & (hours <= 20))
+    peak_multiplier = np.where(is_peak, MUMBAI_PEAK_MULTIPLIER, 1.0)
+    distance_fare = distance_km * MUMBAI_PER_KM * peak_multiplier * np.asarray(surge_multiplier)
+    return {
+        "priceMin": js_round(MUMBAI_BASE_FARE + distance_fare * 0.9),
+        "priceMax": js_round(MUMBAI_BASE_FARE + distance_fare * 1.1),
+    }
+
+
+def price_batch(origin_lat, origin_lng, dest_lat, dest_lng, hours,
+                duration_min=None, surge_multiplier=None):
+    """Price every O/D pair and departure hour, broadcasting length-1 inputs
+
+    Without an explicit surge multiplier the estimate uses the hourly surge
+    curve and the Mumbai range uses its non-surge branch.
+    """
+    distance_km = haversine_km(origin_lat, origin_lng, dest_lat, dest_lng)
+    distance_km, hours = np.broadcast_arrays(distance_km, np.asarray(hours))
+    if duration_min is None:
+        duration_min = travel_minutes(distance_km)
+    if surge_multiplier is None:
+        estimate_surge = surge_multiplier_for_hour(hours)
+        mumbai_surge = 1.0
+    else:
+        estimate_surge = mumbai_surge = surge_multiplier
+    duration_min = np.broadcast_to(np.asarray(duration_min, dtype=np.float64), distance_km.shape)
+    estimate_surge = np.broadcast_to(np.asarray(estimate_surge, dtype=np.float64), distance_km.shape)
+    result = {
+        "distanceKm": distance_km,
+        "durationMin": duration_min,
+        "surgeMultiplier": estimate_surge,
+    }
+    result.update(estimate_breakdown(distance_km, duration_min, estimate_surge))
+    result.update(mumbai_price_range(distance_km, hours, mumbai_surge))
+    return result
@@ -0,0 +1,332 @@
+"""Looking inside a running gateway
+
+SamplingProfiler samples the stacks of the process's threads for a while and
+returns them in the collapsed format flame graph tools read. LoopStallMonitor
+catches code holding the event loop: a watchdog thread notices the event loop
+lag monitor's heartbeat running late and takes the loop thread's stack while it
+is still stuck. SlowRequestLog keeps the slowest recent requests with the spans they
+ended, sampled or not, as per-stage timings, and task_stacks lists every
+asyncio task with the coroutines it is suspended in.
+
+Nothing walks a stack until asked to or until the loop stalls. The watchdog
+only runs while the debug endpoints are enabled; what runs all the time is a
+clock read and comparison per request.
+"""
+import asyncio
+import collections
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Leaf frames of threads waiting for work rather than doing it, by file name
+_IDLE_LEAVES = {
+    "selectors.py": {"select"},
+    "threading.py": {"wait"},
+    "queue.py": {"get"},
+    "thread.py": {"_worker"},
+    "periodic_executor.py": {"_run"},
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    """filename relative to the sys.path entry it was imported from"""
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry.rstrip(os.sep) + os.sep) and len(entry) > len(best):
+            best = entry.rstrip(os.sep) + os.sep
+    return filename[len(best):]
+
+
+def _function(frame) -> str:
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({_short_path(code.co_filename)})"
+
+
+def _location(frame) -> str:
+    code = frame.f_code
+    return f"{_short_path(code.co_filename)}:{frame.f_lineno} in {getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _idle(frame) -> bool:
+    return frame.f_code.co_name in _IDLE_LEAVES.get(os.path.basename(frame.f_code.co_filename), ())
+
+
+def _collapsed(frame) -> str:
+    functions = []
+    while frame is not None:
+        functions.append(_function(frame))
+        frame = frame.f_back
+    return ";".join(reversed(functions))
+
+
+def _frames(frame) -> List[str]:
+    """Outermost first, like a traceback"""
+    locations = []
+    while frame is not None:
+        locations.append(_location(frame))
+        frame = frame.f_back
+    return locations[::-1]
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is asked for while one is being taken"""
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampling of the running process, one profile at a time
+
+    A thread reads every other thread's current frame hz times a second, so
+    the loop keeps serving (and is profiled doing so) while it runs. Samples
+    of threads waiting for work, the loop in select() among them, are left
+    out unless idle is asked for.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profiles = 0
+
+    async def profile(self, seconds: float, hz: int = 100, loop_only: bool = False,
+                      idle: bool = False) -> Tuple[str, int]:
+        """Collapsed stacks ("thread;outer;...;inner count" lines) and the number of samples"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        self.profiles += 1
+        stop = threading.Event()
+        only = threading.get_ident() if loop_only else None
+        try:
+            # The sampling thread releases the lock when it is done, so a
+            # profile abandoned by its client still runs alone
+            return await asyncio.to_thread(self._sample, seconds, hz, only, idle, stop)
+        finally:
+            stop.set()
+
+    def _sample(self, seconds: float, hz: int, only: Optional[int], idle: bool,
+                stop: threading.Event) -> Tuple[str, int]:
+        try:
+            me = threading.get_ident()
+            counts: Dict[Tuple[int, str], int] = collections.Counter()
+            samples = 0
+            interval = 1 / hz
+            next_sample = time.monotonic()
+            deadline = next_sample + seconds
+            while next_sample < deadline and not stop.is_set():
+                for ident, frame in sys._current_frames().items():
+                    if ident == me or (only is not None and ident != only):
+                        continue
+                    if not idle and _idle(frame):
+                        continue
+                    counts[(ident, _collapsed(frame))] += 1
+                samples += 1
+                next_sample += interval
+                stop.wait(max(0.0, next_sample - time.monotonic()))
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            lines = [
+                f"{names.get(ident, ident)};{stack} {count}"
+                for (ident, stack), count in sorted(counts.items(), key=lambda item: item[0][1])
+            ]
+            return "\n".join(lines) + "\n" if lines else "", samples
+        finally:
+            self._lock.release()
+
+
+def _await_chain(coro) -> List:
+    """Frames of coro and the coroutines it awaits, outermost first"""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+def task_stacks() -> str:
+    """Every task on the running loop with where it is suspended
+
+    Tasks suspended at the same place are listed once, with how many there
+    are and a few of their names.
+    """
+    groups: Dict[Tuple[str, ...], List[str]] = collections.defaultdict(list)
+    for task in asyncio.all_tasks():
+        frames = _await_chain(task.get_coro())
+        stack = tuple(_location(frame) for frame in frames) or (repr(task.get_coro()),)
+        state = " (cancelling)" if task.cancelling() else ""
+        groups[stack].append(task.get_name() + state)
+    lines = [f"{sum(len(names) for names in groups.values())} tasks, {len(groups)} distinct stacks", ""]
+    for stack, names in sorted(groups.items(), key=lambda group: -len(group[1])):
+        shown = ", ".join(sorted(names)[:5]) + (", ..." if len(names) > 5 else "")
+        lines.append(f"{len(names)} x {shown}")
+        lines.extend(f"    {location}" for location in stack)
+        lines.append("")
+    return "\n".join(lines)
+
+
+class LoopStallMonitor:
+    """Captures what holds the event loop for longer than threshold seconds
+
+    A watchdog thread checks the event loop lag monitor's heartbeat, which
+    start makes beat at least every threshold / 2, as often as it beats. When
+    the heartbeat is more than threshold late, the watchdog takes the loop
+    thread's stack and the task running, once per stall; the stall's full
+    length is filled in when the heartbeat gets through again. The last size
+    stalls are kept.
+    """
+
+    def __init__(self, heartbeat, threshold: float = 0.1, size: int = 50):
+        self.heartbeat = heartbeat
+        self.threshold = threshold
+        self._stalls: Deque[Dict] = collections.deque(maxlen=size)
+        self.stalls = 0
+        self._beat = 0.0
+        self._captured_beat = None
+        self._pending: Optional[Dict] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._watchdog is not None or self.threshold <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.heartbeat.interval = min(self.heartbeat.interval, self.threshold / 2)
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self.heartbeat.listeners.append(self._on_beat)
+        self._watchdog = threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def _on_beat(self, now: float, lag: float):
+        self._beat = now
+        stall, self._pending = self._pending, None
+        if stall is not None:
+            stall["stalledMs"] = round(lag * 1000, 1)
+
+    def _watch(self):
+        while not self._stop.wait(self.heartbeat.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.heartbeat.interval
+            if blocked < self.threshold or beat == self._captured_beat:
+                continue
+            self._captured_beat = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            task = asyncio.current_task(self._loop)
+            stack = _frames(frame) if frame is not None else []
+            stall = {
+                "at": round(time.time() - blocked, 3),
+                "blockedMs": round(blocked * 1000, 1),
+                "stalledMs": None,
+                "task": task.get_name() if task is not None else None,
+                "stack": stack,
+            }
+            self._pending = stall
+            self._stalls.append(stall)
+            self.stalls += 1
+            logger.warning(f"Event loop blocked for {blocked * 1000:.0f} ms at {stack[-1] if stack else '?'}")
+
+    async def stop(self):
+        if self._watchdog is None:
+            return
+        self._stop.set()
+        self.heartbeat.listeners.remove(self._on_beat)
+        self._watchdog.join()
+        self._watchdog = None
+
+    def recent(self) -> List[Dict]:
+        """Captured stalls, newest first"""
+        return list(reversed(self._stalls))
+
+    def stats(self) -> Dict:
+        return {"threshold_ms": self.threshold * 1000, "running": self._watchdog is not None, "stalls": self.stalls}
+
+
+class SlowRequestLog:
+    """The last size requests that took at least threshold seconds"""
+
+    def __init__(self, threshold: float = 1.0, size: int = 100):
+        self.threshold = threshold
+        self._requests: Deque[Dict] = collections.deque(maxlen=size)
+        self.recorded = 0
+
+    def record(self, request: Dict):
+        self._requests.append(request)
+        self.recorded += 1
+
+    def slowest(self, limit: int) -> List[Dict]:
+        return sorted(self._requests, key=lambda request: -request["durationMs"])[:limit]
+
+    def stats(self) -> Dict:
+        return {"threshold_ms": self.threshold * 1000, "size": self._requests.maxlen, "recorded": self.recorded}
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware adding requests slower than the log's threshold to it
+
+    Runs inside TracingMiddleware and collects every span the request ends,
+    so a slow request shows where its time went even when its trace was not
+    sampled. Event streams stay open by design and are not timed, nor are
+    paths under exclude_prefixes.
+    """
+
+    def __init__(self, app, log: SlowRequestLog, tracer, route_label, exclude_prefixes: Tuple[str, ...] = ()):
+        self.app = app
+        self.log = log
+        self.tracer = tracer
+        self.route_label = route_label
+        self.exclude_prefixes = exclude_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        streaming = False
+
+        async def send_with_status(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name == b"content-type" and value.startswith(b"text/event-stream"):
+                        streaming = True
+            await send(message)
+
+        spans = []
+        token = self.tracer.collect_spans(spans)
+        span = self.tracer.current()
+        start_ns = time.time_ns()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.tracer.stop_collecting(token)
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.log.threshold and not streaming and not scope["path"].startswith(self.exclude_prefixes):
+                self.log.record({
+                    "at": round(start_ns / 1e9, 3),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": self.route_label(scope),
+                    "status": status,
+                    "durationMs": round(elapsed * 1000, 1),
+                    "traceId": span.context.trace_id if span is not None else None,
+                    "sampled": span is not None and span.recording,
+                    "stages": [
+                        {
+                            "name": stage.name,
+                            "startMs": round((stage.start_ns - start_ns) / 1e6, 1),
+                            "durationMs": round((stage.end_ns - stage.start_ns) / 1e6, 1),
+                            "error": stage.error,
+                        }
+                        for stage in sorted(spans, key=lambda stage: stage.start_ns)
+                    ],
+                })
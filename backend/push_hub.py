@@ -0,0 +1,190 @@
+"""Per-transaction push hub for ONDC updates
+
+The gateway reads one Server-Sent Events feed of transaction events from each
+Node.js upstream and delivers every event only to the WebSocket and SSE
+clients subscribed to that transaction. Each event is encoded once and shared
+by its subscribers, so fan-out costs one buffer append per subscriber of the
+transaction, however many clients are connected overall.
+"""
+import asyncio
+import collections
+import json
+import logging
+from typing import Deque, Dict, Optional, Set
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+FEED_PATH = "/internal/events"
+
+
+class PushEvent:
+    """One transaction event, encoded for both transports"""
+
+    __slots__ = ("name", "transaction_id", "json", "sse")
+
+    def __init__(self, name: str, transaction_id: str, raw: str):
+        self.name = name
+        self.transaction_id = transaction_id
+        # WebSocket clients get the feed's JSON as is
+        self.json = raw
+        self.sse = f"event: {name}\ndata: {raw}\n\n".encode()
+
+
+class Subscriber:
+    """A client's bounded send buffer; overflowing it evicts the client"""
+
+    def __init__(self, transaction_id: str, max_buffer: int):
+        self.transaction_id = transaction_id
+        self.max_buffer = max_buffer
+        self.evicted = False
+        self.closed = False
+        self._buffer: Deque[PushEvent] = collections.deque()
+        self._ready = asyncio.Event()
+
+    def offer(self, event: PushEvent) -> bool:
+        if self.closed:
+            return True
+        if len(self._buffer) >= self.max_buffer:
+            self.evicted = True
+            self.close()
+            return False
+        self._buffer.append(event)
+        self._ready.set()
+        return True
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def next(self, timeout: float) -> Optional[PushEvent]:
+        """Next buffered event, or None on timeout or once closed"""
+        if not self._buffer and not self.closed:
+            self._ready.clear()
+            # A timer sets the event rather than wrapping the wait in
+            # wait_for, which can swallow the cancellation of a disconnect
+            timer = asyncio.get_running_loop().call_later(timeout, self._ready.set)
+            try:
+                await self._ready.wait()
+            finally:
+                timer.cancel()
+        if self._buffer and not self.evicted:
+            return self._buffer.popleft()
+        return None
+
+
+class PushHub:
+    """Subscribers by transaction ID, fed by one event stream per Node upstream"""
+
+    def __init__(self, max_buffer: int = 64, feed_token: Optional[str] = None,
+                 reconnect_delay: float = 1.0, max_reconnect_delay: float = 30.0):
+        self.max_buffer = max_buffer
+        self.feed_token = feed_token
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        self._feeds: Dict[str, asyncio.Task] = {}
+        self.connected_feeds = 0
+        self.events = 0
+        self.delivered = 0
+        self.evictions = 0
+
+    def subscribe(self, transaction_id: str) -> Subscriber:
+        subscriber = Subscriber(transaction_id, self.max_buffer)
+        self._subscribers.setdefault(transaction_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscriber.close()
+        subscribers = self._subscribers.get(subscriber.transaction_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.transaction_id]
+
+    def publish(self, event: PushEvent):
+        self.events += 1
+        subscribers = self._subscribers.get(event.transaction_id)
+        if not subscribers:
+            return
+        for subscriber in list(subscribers):
+            if subscriber.offer(event):
+                self.delivered += 1
+            else:
+                self.evictions += 1
+                logger.warning(f"Evicted slow push subscriber for {event.transaction_id}")
+                self.unsubscribe(subscriber)
+
+    def publish_raw(self, raw: str):
+        """Publish one JSON event line from a Node feed"""
+        try:
+            message = json.loads(raw)
+            event = PushEvent(str(message["event"]), str(message["transactionId"]), raw)
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed push event: {raw[:200]}")
+            return
+        self.publish(event)
+
+    async def _read_feed(self, client: httpx.AsyncClient, url: str):
+        headers = {"accept": "text/event-stream"}
+        if self.feed_token:
+            headers["x-event-feed-token"] = self.feed_token
+        # Node sends a heartbeat every 15 s, so a silent minute is a dead feed
+        timeout = httpx.Timeout(10.0, read=60.0)
+        async with client.stream("GET", url, headers=headers, timeout=timeout) as response:
+            response.raise_for_status()
+            self.connected_feeds += 1
+            try:
+                data = []
+                async for line in response.aiter_lines():
+                    if line.startswith("data:"):
+                        data.append(line[5:].lstrip())
+                    elif not line and data:
+                        self.publish_raw("\n".join(data))
+                        data = []
+            finally:
+                self.connected_feeds -= 1
+
+    async def _follow_feed(self, client: httpx.AsyncClient, url: str):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                await self._read_feed(client, url)
+                delay = self.reconnect_delay
+            except Exception as e:
+                logger.warning(f"Push feed {url} failed: {e!r}; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+            await asyncio.sleep(delay)
+
+    def start(self, client: httpx.AsyncClient, base_urls):
+        for base_url in base_urls:
+            if base_url not in self._feeds:
+                url = f"{base_url}{FEED_PATH}"
+                self._feeds[base_url] = asyncio.create_task(self._follow_feed(client, url))
+
+    async def stop(self):
+        for task in self._feeds.values():
+            task.cancel()
+        for task in self._feeds.values():
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._feeds.clear()
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in list(subscribers):
+                self.unsubscribe(subscriber)
+
+    def stats(self) -> Dict:
+        return {
+            "feeds": len(self._feeds),
+            "connected_feeds": self.connected_feeds,
+            "transactions": len(self._subscribers),
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "events": self.events,
+            "delivered": self.delivered,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,132 @@
+"""Per-caller admission control at the gateway
+
+Each caller (a verified JWT user or a client IP) gets a token bucket, and a
+request spends its route's cost in tokens: a search that fans out to Uber and
+the ONDC network costs more than a health check. A caller whose bucket is
+short is answered 429 with the time until it refills. The buckets live in a
+bounded table, so a flood of distinct callers cannot grow memory.
+"""
+import collections
+import time
+from typing import Dict, List
+
+
+class RateLimited(Exception):
+    """Raised when a caller has spent its tokens"""
+
+    def __init__(self, caller: str, retry_after: float):
+        super().__init__(caller)
+        self.caller = caller
+        self.retry_after = retry_after
+
+
+def parse_costs(spec: str) -> Dict[str, float]:
+    """Route costs from "commute/search=10,health=0.1"; routes are path prefixes"""
+    costs = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        route, _, cost = entry.partition("=")
+        costs[route.strip().strip("/")] = float(cost)
+    return costs
+
+
+class RouteCosts:
+    """Token cost of a path, from its longest configured prefix"""
+
+    def __init__(self, costs: Dict[str, float], default: float = 1.0):
+        self.default = default
+        self._costs = {tuple(route.split("/")): cost for route, cost in costs.items()}
+        self._depth = max((len(route) for route in self._costs), default=0)
+
+    def cost(self, path: str) -> float:
+        segments = tuple(path.strip("/").split("/", self._depth)[:self._depth])
+        for depth in range(len(segments), 0, -1):
+            cost = self._costs.get(segments[:depth])
+            if cost is not None:
+                return cost
+        return self.default
+
+    def snapshot(self) -> Dict[str, float]:
+        return {"/".join(route): cost for route, cost in self._costs.items()}
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class TokenBuckets:
+    """Token buckets per caller, in a sharded table of bounded size
+
+    Callers are spread over shards by hash, each an LRU of at most
+    max_callers / shards buckets, so evictions and sweeps only ever touch one
+    small shard. A bucket left alone long enough to refill is no different
+    from a new one, so up to SWEEP of those are dropped from the cold end of
+    the shard on every take. When a shard is full its least recently used
+    caller is evicted; that caller starts again with a full bucket, which
+    errs towards admitting.
+    """
+
+    SWEEP = 4
+
+    def __init__(self, rate: float = 20.0, burst: float = 60.0,
+                 max_callers: int = 100000, shards: int = 16):
+        self.rate = rate
+        self.burst = burst
+        self.shard_size = max(1, max_callers // shards)
+        # Seconds an untouched bucket takes to refill from empty
+        self.idle_after = burst / rate
+        self._shards: List[collections.OrderedDict] = [collections.OrderedDict() for _ in range(shards)]
+        self.admitted = 0
+        self.limited = 0
+        self.evicted = {"idle": 0, "capacity": 0}
+
+    def take(self, caller: str, cost: float = 1.0):
+        """Spend cost tokens of caller's bucket or raise RateLimited"""
+        now = time.monotonic()
+        shard = self._shards[hash(caller) % len(self._shards)]
+        self._sweep(shard, now)
+        bucket = shard.get(caller)
+        if bucket is None:
+            if len(shard) >= self.shard_size:
+                shard.popitem(last=False)
+                self.evicted["capacity"] += 1
+            bucket = shard[caller] = _Bucket(self.burst, now)
+        else:
+            shard.move_to_end(caller)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        # A route costing more than the burst would otherwise never pass
+        cost = min(cost, self.burst)
+        if bucket.tokens < cost:
+            self.limited += 1
+            raise RateLimited(caller, (cost - bucket.tokens) / self.rate)
+        bucket.tokens -= cost
+        self.admitted += 1
+
+    def _sweep(self, shard: collections.OrderedDict, now: float):
+        for _ in range(self.SWEEP):
+            if not shard:
+                return
+            caller, bucket = next(iter(shard.items()))
+            if now - bucket.updated < self.idle_after:
+                return
+            del shard[caller]
+            self.evicted["idle"] += 1
+
+    def callers(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    def stats(self) -> Dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "callers": self.callers(),
+            "admitted": self.admitted,
+            "limited": self.limited,
+            "evicted": dict(self.evicted),
+        }
@@ -0,0 +1,229 @@
+"""Bounded TTL response cache with stale-while-revalidate and single-flight"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat: float, lng: float, precision: int = 6) -> str:
+    """Encode a coordinate as a geohash cell of the given length"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if lng >= mid:
+                bits = (bits << 1) | 1
+                lng_range[0] = mid
+            else:
+                bits <<= 1
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+class CachedResponse:
+    """A fully read upstream response that can be replayed to clients"""
+
+    __slots__ = ("key", "status_code", "body", "media_type", "fresh_until", "stale_until", "encoded")
+
+    def __init__(self, status_code: int, body: bytes, media_type: str):
+        self.key: Optional[str] = None
+        self.status_code = status_code
+        self.body = body
+        self.media_type = media_type
+        self.fresh_until = 0.0
+        self.stale_until = 0.0
+        # Content-encoding -> compressed body, filled in on first use
+        self.encoded: Dict[str, bytes] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(body) for body in self.encoded.values())
+
+
+Loader = Callable[[], Awaitable[CachedResponse]]
+
+
+class ResponseCache:
+    """LRU of cached responses bounded by entry count and total body bytes
+
+    Fresh entries are served directly. Entries past their TTL but inside the
+    stale window are served immediately while one background refresh runs.
+    Concurrent misses for the same key share a single upstream load.
+
+    With a SharedCache (multi-worker mode) entries are also looked up in and
+    published to the host-wide table, and a load is left to the worker that
+    leases the key first, so each response is fetched from Node once per host.
+    """
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 32 * 1024 * 1024,
+                 shared=None, lease_seconds: float = 5.0, lease_poll: float = 0.01):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.lease_seconds = lease_seconds
+        self.lease_poll = lease_poll
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.load_errors = 0
+
+    async def get_or_load(self, key: str, loader: Loader, ttl: float,
+                          stale_ttl: float) -> Tuple[CachedResponse, str]:
+        """Return the response for key and whether it was a HIT, STALE or MISS"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and now < entry.fresh_until:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry, "HIT"
+        if self.shared is not None:
+            shared = self.shared.get(key)
+            # Another worker loaded or refreshed it
+            if shared is not None and (entry is None or shared.fresh_until > entry.fresh_until):
+                self._store(key, shared)
+                entry = shared
+                if now < entry.fresh_until:
+                    self.shared_hits += 1
+                    return entry, "HIT"
+        if entry is not None:
+            if now < entry.stale_until:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._inflight:
+                    self._start_load(key, loader, ttl, stale_ttl)
+                return entry, "STALE"
+            self._remove(key)
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._start_load(key, loader, ttl, stale_ttl)
+        else:
+            self.coalesced += 1
+        # Shielded so a disconnecting client does not cancel the shared load
+        return await asyncio.shield(task), "MISS"
+
+    def _start_load(self, key: str, loader: Loader, ttl: float,
+                    stale_ttl: float) -> asyncio.Task:
+        task = asyncio.ensure_future(self._load(key, loader, ttl, stale_ttl))
+        self._inflight[key] = task
+        task.add_done_callback(self._log_background_error)
+        return task
+
+    async def _load(self, key: str, loader: Loader, ttl: float,
+                    stale_ttl: float) -> CachedResponse:
+        try:
+            response = await self._loaded_elsewhere(key) if self.shared is not None else None
+            if response is None:
+                response = await loader()
+                if response.status_code == 200:
+                    now = time.monotonic()
+                    response.fresh_until = now + ttl
+                    response.stale_until = now + ttl + stale_ttl
+                    if self.shared is not None:
+                        self.shared.put(key, response)
+        except Exception:
+            self.load_errors += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            if self.shared is not None:
+                self.shared.release(key)
+        if response.status_code == 200:
+            self._store(key, response)
+        return response
+
+    async def _loaded_elsewhere(self, key: str) -> Optional[CachedResponse]:
+        """Another worker's fresh load of key, or None once this worker holds the lease"""
+        deadline = time.monotonic() + self.lease_seconds
+        while not self.shared.claim(key, self.lease_seconds) and time.monotonic() < deadline:
+            await asyncio.sleep(self.lease_poll)
+            response = self.shared.get(key)
+            if response is not None and time.monotonic() < response.fresh_until:
+                return response
+        return None
+
+    def _log_background_error(self, task: asyncio.Task):
+        # Retrieve the exception so revalidations nobody awaits do not warn
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Cache load failed: {task.exception()}")
+
+    def encoded_body(self, entry: CachedResponse, encoding: str,
+                     encode: Callable[[bytes, str], bytes]) -> bytes:
+        """Compressed form of an entry's body, computed once and kept with it"""
+        body = entry.encoded.get(encoding)
+        if body is None:
+            body = entry.encoded[encoding] = encode(entry.body, encoding)
+            if entry.key is not None and self._entries.get(entry.key) is entry:
+                self._bytes += len(body)
+                self._evict()
+        return body
+
+    def _store(self, key: str, response: CachedResponse):
+        if response.size > self.max_bytes:
+            return
+        self._remove(key)
+        response.key = key
+        self._entries[key] = response
+        self._bytes += response.size
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest, _ = next(iter(self._entries.items()))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.shared_hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "load_errors": self.load_errors,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
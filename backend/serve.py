@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Multi-process gateway server
+Forks --workers uvicorn workers of server:app and restarts any that die. With
+SO_REUSEPORT (Linux) every worker binds its own listening socket on the port
+and the kernel spreads new connections across them; without it one socket is
+bound here and the workers accept from it in turn.
+
+server is imported once before forking, so the workers share its pages
+copy-on-write; Mongo and HTTP clients are only opened in each worker's
+lifespan. GATEWAY_WORKERS is set for the workers so per-worker pool sizes
+default to a share of the single-process ones, and GATEWAY_SHARED_DIR (tmpfs)
+holds what they share: the response cache table, the traced ONDC searches
+their callbacks link to, the fitted surge model and the lock electing the
+worker that runs the once-per-host background work.
+
+`uvicorn server:app` still runs a single process, as before.
+
+Usage:
+    python serve.py --workers 4 --port 8001
+    GATEWAY_WORKERS=8 GATEWAY_PORT=8001 python serve.py
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger("serve")
+
+SHARED_FILES = ("responses", "leader.lock", "surge_model.npz", "trace_links")
+
+# Workers exiting this soon after starting, this many times in a row, mean the
+# gateway cannot start (bad config, port taken); stop instead of respawning
+MIN_UPTIME = 5.0
+MAX_QUICK_EXITS = 5
+
+
+def default_shared_dir(port):
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"hailo-gateway-{port}")
+
+
+def clear_shared_dir(path):
+    """Remove what an earlier run left; only the gateway's own files"""
+    for name in os.listdir(path):
+        if name in SHARED_FILES or name.endswith(".tmp"):
+            os.unlink(os.path.join(path, name))
+
+
+def bind_socket(host, port, reuse_port):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, args):
+    import uvicorn
+
+    # Ctrl-C reaches the supervisor only; it stops the workers with one SIGTERM
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if sock is None:
+        sock = bind_socket(args.host, args.port, reuse_port=True)
+    sock.listen(args.backlog)
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        log_level=args.log_level,
+        access_log=args.access_log,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+    )
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0 if server.started else 3
+
+
+class Supervisor:
+    def __init__(self, app, sock, args):
+        self.app = app
+        self.sock = sock
+        self.args = args
+        # pid -> (worker index, started at)
+        self.workers = {}
+        self.stopping = False
+        self.quick_exits = 0
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            os.environ["GATEWAY_WORKER_INDEX"] = str(index)
+            code = 1
+            try:
+                code = run_worker(self.app, self.sock, self.args)
+            except BaseException:
+                logger.exception(f"Worker {index} failed")
+            finally:
+                os._exit(code)
+        self.workers[pid] = (index, time.monotonic())
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def reap(self):
+        """Collect one exited worker, or None when none has exited"""
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return None
+        if pid == 0:
+            return None
+        index, started = self.workers.pop(pid)
+        return pid, index, started, os.waitstatus_to_exitcode(status)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.args.workers):
+            self.spawn(index)
+        logger.info(f"Serving on {self.args.host}:{self.args.port} with {self.args.workers} workers")
+        failed = False
+        while not self.stopping:
+            exited = self.reap()
+            if exited is None:
+                time.sleep(0.2)
+                continue
+            pid, index, started, code = exited
+            self.quick_exits = self.quick_exits + 1 if time.monotonic() - started < MIN_UPTIME else 0
+            if self.quick_exits >= MAX_QUICK_EXITS:
+                logger.error("Workers keep exiting right after starting; stopping")
+                failed = True
+                break
+            logger.warning(f"Worker {index} (pid {pid}) exited with {code}; restarting it")
+            self.spawn(index)
+        self.shutdown()
+        return 1 if failed else 0
+
+    def shutdown(self):
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            if self.reap() is None:
+                time.sleep(0.1)
+        for pid in list(self.workers):
+            logger.warning(f"Worker pid {pid} did not stop in time; killing it")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.workers.pop(pid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.environ.get("GATEWAY_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("GATEWAY_PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("GATEWAY_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--shared-dir", default=os.environ.get("GATEWAY_SHARED_DIR"),
+                        help="Directory for the files workers share (default /dev/shm/hailo-gateway-<port>)")
+    parser.add_argument("--no-reuse-port", dest="reuse_port", action="store_false",
+                        help="Accept from one inherited socket instead of one SO_REUSEPORT socket per worker")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5, help="Seconds an idle client connection is kept")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+    args.reuse_port = args.reuse_port and hasattr(socket, "SO_REUSEPORT")
+    # Only this logger; the workers' root logger is left as plain uvicorn leaves it
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(levelname)s:     [supervisor] %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(args.log_level.upper())
+    logger.propagate = False
+
+    shared_dir = args.shared_dir or default_shared_dir(args.port)
+    os.makedirs(shared_dir, mode=0o700, exist_ok=True)
+    clear_shared_dir(shared_dir)
+    # Read by server at import
+    os.environ["GATEWAY_WORKERS"] = str(args.workers)
+    os.environ["GATEWAY_SHARED_DIR"] = shared_dir
+
+    # Binding here first reports a taken port once instead of from every worker
+    sock = bind_socket(args.host, args.port, args.reuse_port)
+    if args.reuse_port:
+        sock.close()
+        sock = None
+
+    from server import app
+
+    code = Supervisor(app, sock, args).run()
+    clear_shared_dir(shared_dir)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,231 @@
-from fastapi import FastAPI, APIRouter, Request, Response
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response, WebSocket
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
+from starlette.background import BackgroundTask
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
+import base64
+import functools
+import hmac
+import json
 import logging
+import math
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Any, Callable, List, Optional, Tuple
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import httpx
+import jwt
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
+from upstreams import UpstreamPool, NoHealthyUpstream
+from overload import AdaptiveLimiter, CircuitBreaker, RetryBudget, UpstreamOverloaded
+from rate_limit import RateLimited, RouteCosts, TokenBuckets, parse_costs
+from write_behind import WriteBehindQueue, WriteQueueFull
+from response_cache import ResponseCache, CachedResponse, geohash_encode
+from push_hub import PushHub
+from price_rollups import PriceRollups
+from surge_forecast import SurgeForecaster
+from beckn_auth import BecknVerifier, SignatureError, SubscriberKeyStore
+from user_insights import UserInsights, insights_recommendations, insights_summary, smart_recommendation
+from settlement_recon import CHECKS as RECON_CHECKS, SettlementRecon
+from shared_cache import SharedCache
+from leader import LeaderElection
+from profiling import LoopStallMonitor, ProfilerBusy, SamplingProfiler, SlowRequestLog, SlowRequestMiddleware, task_stacks
+from tracing import (
+    CLIENT, TRACEPARENT, FileExporter, HttpxTrace, MongoTraceListener, OtlpHttpExporter,
+    TraceLinks, Tracer, TracingMiddleware,
+)
+from compression import MIN_COMPRESS_SIZE, compress, compress_stream, is_compressible, negotiate_encoding
+from metrics import (
+    Registry, RequestMetricsMiddleware, MongoCommandListener, EventLoopLagMonitor,
+    httpx_pool_connections,
+)
+import pricing_engine
+import numpy as np
+import pandas as pd
+import time
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'hailo')]
+# Metrics served at /api/metrics
+metrics = Registry()
+http_requests = metrics.counter(
+    "hailo_http_requests_total", "Requests handled by the gateway", ["route", "method", "status"])
+http_request_duration = metrics.histogram(
+    "hailo_http_request_duration_seconds", "Time to fully answer a request", ["route", "method"])
+http_requests_in_flight = metrics.gauge(
+    "hailo_http_requests_in_flight", "Requests currently being handled")
+upstream_response_duration = metrics.histogram(
+    "hailo_upstream_response_seconds", "Time until Node.js returned response headers", ["upstream", "route"])
+upstream_errors = metrics.counter(
+    "hailo_upstream_errors_total", "Failed requests to Node.js", ["upstream", "error"])
+upstream_retries = metrics.counter(
+    "hailo_upstream_retries_total", "Idempotent requests retried against Node.js", ["reason"])
+upstream_shed = metrics.counter(
+    "hailo_upstream_shed_total", "Requests answered 503 without reaching Node.js", ["reason"])
+rate_limited = metrics.counter(
+    "hailo_rate_limited_total", "Requests answered 429 because the caller ran out of tokens", ["route"])
+mongo_command_duration = metrics.histogram(
+    "hailo_mongo_command_seconds", "Mongo command latency", ["command"])
+mongo_command_failures = metrics.counter(
+    "hailo_mongo_command_failures_total", "Failed Mongo commands", ["command"])
+event_loop_lag = metrics.histogram(
+    "hailo_event_loop_lag_seconds", "How late the event loop runs a scheduled wakeup")
+event_loop_lag_current = metrics.gauge(
+    "hailo_event_loop_lag_current_seconds", "Most recently measured event loop lag")
+loop_lag_monitor = EventLoopLagMonitor(event_loop_lag, event_loop_lag_current)
+
+# Worker processes serving this host (see serve.py). Connection pools and the
+# Node concurrency cap are per worker, so their defaults are split between them
+GATEWAY_WORKERS = max(1, int(os.environ.get('GATEWAY_WORKERS', '1')))
+
+def per_worker(total: int, minimum: int = 1) -> str:
+    return str(max(minimum, total // GATEWAY_WORKERS))
+
+# Workers started together share cached responses, the fitted surge model and
+# a leader lock through files in this directory (tmpfs); unset, this process
+# works alone
+GATEWAY_SHARED_DIR = os.environ.get('GATEWAY_SHARED_DIR')
+
+def shared_path(name: str) -> Optional[str]:
+    return os.path.join(GATEWAY_SHARED_DIR, name) if GATEWAY_SHARED_DIR else None
+
+leader = LeaderElection(
+    shared_path('leader.lock'), retry_interval=float(os.environ.get('GATEWAY_LEADER_RETRY', '5'))
+)
+
+# POST /api/v1/batch runs up to BATCH_MAX_ITEMS /api/v1 sub-requests at once,
+# each answered 504 after its own timeout of at most BATCH_ITEM_TIMEOUT seconds
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '20'))
+BATCH_ITEM_TIMEOUT = float(os.environ.get('BATCH_ITEM_TIMEOUT', '10'))
+BATCH_METHODS = {"GET", "POST", "PUT", "DELETE", "PATCH"}
+# Batch headers not passed to sub-requests: each has its own body, and the
+# sub-responses are compressed together in the batch response
+BATCH_DROP_HEADERS = {b"content-length", b"content-type", b"transfer-encoding", b"accept-encoding", b"expect"}
+# Sub-response headers returned with each item
+BATCH_ITEM_HEADERS = {"x-cache", "retry-after", "cache-control", "etag"}
+
+# Tracing: a client's W3C traceparent is continued (or a trace started here)
+# and passed on to Node. Spans of sampled traces are exported in batches as
+# OTLP JSON, to TRACE_OTLP_ENDPOINT (e.g. http://localhost:4318/v1/traces)
+# or appended to TRACE_EXPORT_FILE; with neither, nothing is recorded
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT')
+TRACE_EXPORT_FILE = os.environ.get('TRACE_EXPORT_FILE')
+if TRACE_OTLP_ENDPOINT:
+    trace_exporter = OtlpHttpExporter(TRACE_OTLP_ENDPOINT)
+elif TRACE_EXPORT_FILE:
+    trace_exporter = FileExporter(TRACE_EXPORT_FILE)
+else:
+    trace_exporter = None
+tracer = Tracer(
+    service_name=os.environ.get('TRACE_SERVICE_NAME', 'hailo-gateway'),
+    exporter=trace_exporter,
+    sample_ratio=float(os.environ.get('TRACE_SAMPLE_RATIO', '0.05')),
+    max_queue=int(os.environ.get('TRACE_MAX_QUEUE', '10000')),
+    interval=float(os.environ.get('TRACE_EXPORT_INTERVAL', '2')),
+)
+# Sampled ONDC searches by transaction_id, so their callbacks can link to them
+trace_links = TraceLinks(
+    SharedCache(shared_path('trace_links'), slots=int(os.environ.get('TRACE_LINK_SLOTS', '8192')), slot_size=256)
+    if GATEWAY_SHARED_DIR and trace_exporter else None,
+    ttl=float(os.environ.get('TRACE_LINK_TTL', '600')),
+)
+
+# Debug endpoints under /api/debug, for looking inside a worker while it is
+# slow: a sampled profile, its asyncio tasks, loop stalls and slow requests.
+# Answered only with X-Debug-Token: DEBUG_TOKEN (404 while it is unset), each
+# by whichever worker got the request. Loop stalls over LOOP_STALL_MS are
+# recorded while DEBUG_TOKEN is set, by a watchdog on the loop lag monitor's
+# heartbeat, which then beats every LOOP_STALL_MS / 2. Requests slower than
+# SLOW_REQUEST_MS are recorded all the time. 0 turns either off
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN')
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '60'))
+profiler = SamplingProfiler()
+loop_stalls = LoopStallMonitor(
+    loop_lag_monitor,
+    threshold=float(os.environ.get('LOOP_STALL_MS', '100')) / 1000,
+    size=int(os.environ.get('LOOP_STALL_LOG_SIZE', '50')),
+)
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+slow_requests = SlowRequestLog(
+    threshold=SLOW_REQUEST_MS / 1000,
+    size=int(os.environ.get('SLOW_REQUEST_LOG_SIZE', '100')),
+)
+
+# MongoDB connection, opened by each worker on startup: a client created
+# before the workers fork would share its sockets and monitor threads
+DB_NAME = os.environ.get('DB_NAME', 'hailo')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', per_worker(100, minimum=10)))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
 # Node.js backend URL
-NODE_BACKEND_URL = "http://localhost:8002"
+NODE_BACKEND_URL = os.environ.get('NODE_BACKEND_URL', "http://localhost:8002")
+
+# Node.js upstreams: comma-separated http:// URLs and/or unix:/path/to.sock
+# entries, balanced by fewest outstanding requests
+node_pool = UpstreamPool.from_env(
+    os.environ.get('NODE_UPSTREAMS', NODE_BACKEND_URL),
+    check_interval=float(os.environ.get('NODE_HEALTH_INTERVAL', '5')),
+    failure_threshold=int(os.environ.get('NODE_HEALTH_FAILURES', '2')),
+)
+
+# Overload protection in front of Node: an adaptive cap on requests waiting
+# for response headers with a short deadline queue, a circuit breaker, and a
+# retry budget for idempotent requests
+node_limiter = AdaptiveLimiter(
+    initial_limit=int(os.environ.get('NODE_LIMIT_INITIAL', per_worker(20, minimum=2))),
+    min_limit=int(os.environ.get('NODE_LIMIT_MIN', '2')),
+    max_limit=int(os.environ.get('NODE_LIMIT_MAX', per_worker(200, minimum=2))),
+    tolerance=float(os.environ.get('NODE_LATENCY_TOLERANCE', '2.0')),
+    max_queue=int(os.environ.get('NODE_QUEUE_MAX', per_worker(100))),
+    queue_timeout=float(os.environ.get('NODE_QUEUE_TIMEOUT', '1.0')),
+)
+node_breaker = CircuitBreaker(
+    failure_ratio=float(os.environ.get('NODE_BREAKER_FAILURE_RATIO', '0.5')),
+    min_requests=int(os.environ.get('NODE_BREAKER_MIN_REQUESTS', '20')),
+    open_seconds=float(os.environ.get('NODE_BREAKER_OPEN_SECONDS', '5')),
+)
+node_retry_budget = RetryBudget(ratio=float(os.environ.get('NODE_RETRY_RATIO', '0.1')))
+NODE_MAX_ATTEMPTS = int(os.environ.get('NODE_MAX_ATTEMPTS', '2'))
+NODE_TIMEOUT = float(os.environ.get('NODE_TIMEOUT', '30'))
+# Connections each worker keeps to Node; idle ones are kept alive for reuse
+NODE_MAX_CONNECTIONS = int(os.environ.get('NODE_MAX_CONNECTIONS', per_worker(200, minimum=10)))
+# Methods that may be sent again after Node has possibly seen them
+RETRYABLE_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Statuses that mean Node or its proxy is overloaded or down
+UPSTREAM_FAILURE_STATUSES = {502, 503, 504}
+
+# Per-caller admission for /api/v1/* and the app's /ondc/* actions. A caller
+# is the user of a verified JWT, else the client IP. Each request spends its
+# route's cost from the caller's token bucket and is answered 429 when that
+# runs short; while Node is saturated, callers also queue fairly by the same
+# costs. Buckets are per worker, and a client's connection stays on one worker.
+# Off by default: uvicorn only takes the client IP from X-Forwarded-For of the
+# proxies in FORWARDED_ALLOW_IPS (127.0.0.1 unless set), so behind an ingress
+# every anonymous client would share the ingress's bucket. Set
+# FORWARDED_ALLOW_IPS to the ingress addresses before enabling
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'false').lower() == 'true'
+rate_limiter = TokenBuckets(
+    rate=float(os.environ.get('RATE_LIMIT_RATE', '20')),
+    burst=float(os.environ.get('RATE_LIMIT_BURST', '60')),
+    max_callers=int(os.environ.get('RATE_LIMIT_MAX_CALLERS', '100000')),
+)
+# Route prefixes and their costs in tokens; the searches fan out to Uber and
+# the ONDC network. RATE_LIMIT_ROUTE_COSTS adds to or overrides these
+RATE_LIMIT_DEFAULT_COSTS = "commute/search=10,ondc/search=10,commute/surge-radar=5,pricing/estimate=2,health=0.1"
+route_costs = RouteCosts(
+    {**parse_costs(RATE_LIMIT_DEFAULT_COSTS), **parse_costs(os.environ.get('RATE_LIMIT_ROUTE_COSTS', ''))},
+    default=float(os.environ.get('RATE_LIMIT_DEFAULT_COST', '1')),
+)
 
 # Create the main app
 app = FastAPI()
@@ -29,8 +233,162 @@ app = FastAPI()
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# HTTPX client for proxying
-http_client = httpx.AsyncClient(timeout=30.0)
+# HTTPX client for proxying, opened by each worker on startup
+http_client: Optional[httpx.AsyncClient] = None
+
+# Stream request and response bodies through the proxy in chunks instead of
+# buffering them whole, so memory per request stays bounded
+PROXY_STREAMING = os.environ.get('PROXY_STREAMING', 'true').lower() == 'true'
+
+# Hop-by-hop headers (RFC 9110 7.6.1) apply to a single connection and are
+# never forwarded; headers named in Connection are treated the same way
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-connection", "te", "trailer",
+    "transfer-encoding", "upgrade", "proxy-authenticate", "proxy-authorization",
+}
+
+# Request headers the gateway sets or negotiates itself. Compression is
+# negotiated with the client here, so Node is asked for identity bodies, and
+# Node's traceparent names the gateway's span rather than the client's
+PROXY_REQUEST_DROP_HEADERS = {"host", "accept-encoding", TRACEPARENT}
+
+# Response headers the gateway recomputes; the ASGI server adds date/server
+PROXY_RESPONSE_DROP_HEADERS = {"content-type", "date", "server"}
+
+# Compress proxied responses of compressible types above this many bytes
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', str(MIN_COMPRESS_SIZE)))
+
+# Gateway cache for idempotent surge/pricing GETs whose output depends only on
+# the hour and coarse coordinates
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+CACHE_GEOHASH_PRECISION = int(os.environ.get('CACHE_GEOHASH_PRECISION', '6'))
+# With workers, entries are also kept in a table all of them map, so each
+# response is loaded from Node once per host rather than once per worker
+shared_cache = SharedCache(
+    shared_path('responses'),
+    slots=int(os.environ.get('SHARED_CACHE_SLOTS', '2048')),
+    slot_size=int(os.environ.get('SHARED_CACHE_SLOT_KB', '32')) * 1024,
+) if GATEWAY_SHARED_DIR else None
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '2048')),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    shared=shared_cache,
+    # A worker waits this long for another's load of the same key before loading it itself
+    lease_seconds=float(os.environ.get('SHARED_CACHE_LEASE_SECONDS', '5')),
+)
+
+class CacheRule(BaseModel):
+    # Pairs of query parameters quantized to geohash cells
+    coordinates: List[tuple] = []
+    # Seconds an entry is served without revalidation
+    ttl: float
+    # Further seconds an expired entry is served while it is refreshed
+    stale_ttl: float
+    # Width of the time bucket in the key; 15 minutes keeps buckets inside
+    # local hours for both whole-hour and half-hour UTC offsets
+    bucket_seconds: int = 900
+
+CACHE_RULES = {
+    "surge/forecast": CacheRule(
+        coordinates=[("originLat", "originLng"), ("destLat", "destLng")],
+        ttl=60, stale_ttl=60,
+    ),
+    "surge/current": CacheRule(coordinates=[("lat", "lng")], ttl=60, stale_ttl=60),
+    "pricing/factors": CacheRule(ttl=120, stale_ttl=60),
+}
+
+# Push delivery of ONDC transaction updates from Node's event feed to the
+# WebSocket/SSE clients of each transaction. Node only serves the feed to
+# callers presenting its EVENT_FEED_TOKEN, so both must be started with the
+# same value; without one the feed is not read
+PUSH_BUFFER = int(os.environ.get('PUSH_BUFFER', '64'))
+PUSH_HEARTBEAT = float(os.environ.get('PUSH_HEARTBEAT', '15'))
+EVENT_FEED_TOKEN = os.environ.get('EVENT_FEED_TOKEN')
+push_hub = PushHub(max_buffer=PUSH_BUFFER, feed_token=EVENT_FEED_TOKEN)
+
+# In-process fare engine; hours are taken in the timezone Node prices in
+PRICING_TIMEZONE = os.environ.get('PRICING_TIMEZONE', 'Asia/Kolkata')
+PRICING_BATCH_MAX = int(os.environ.get('PRICING_BATCH_MAX', '20000'))
+
+# Rollups of RideHistory quotes per geohash cell, 15-minute slot of the week,
+# provider and vehicle type, folded in incrementally in the background
+PRICE_ROLLUPS_ENABLED = os.environ.get('PRICE_ROLLUPS_ENABLED', 'true').lower() == 'true'
+price_rollups = PriceRollups(
+    precision=int(os.environ.get('PRICE_ROLLUP_GEOHASH_PRECISION', '6')),
+    tz=PRICING_TIMEZONE,
+    interval=float(os.environ.get('PRICE_ROLLUP_INTERVAL', '60')),
+)
+
+# Hour-of-week surge curves per geohash cell, refitted in the background from
+# RideHistory quotes and, when its SQLite file is reachable, CommuteLog surge.
+# Once fitted, GET /api/v1/surge/forecast is answered here instead of by Node
+SURGE_FORECAST_ENABLED = os.environ.get('SURGE_FORECAST_ENABLED', 'true').lower() == 'true'
+SURGE_FORECAST_HORIZONS = [0, 15, 30, 45, 60]
+SURGE_FORECAST_BATCH_MAX = int(os.environ.get('SURGE_FORECAST_BATCH_MAX', '100000'))
+surge_forecaster = SurgeForecaster(
+    precision=int(os.environ.get('SURGE_FORECAST_GEOHASH_PRECISION', '5')),
+    tz=PRICING_TIMEZONE,
+    lookback_days=float(os.environ.get('SURGE_FORECAST_LOOKBACK_DAYS', '28')),
+    commute_db_path=os.environ.get('COMMUTE_DB_PATH'),
+    interval=float(os.environ.get('SURGE_FORECAST_INTERVAL', '900')),
+    model_path=shared_path('surge_model.npz'),
+)
+
+# Signature checks on inbound ONDC callbacks, with registry keys cached here.
+# Callbacks that verify are tagged for Node with ONDC_GATEWAY_TOKEN so it can
+# skip its own check; ones that fail are refused unless Node's ondcAuth would
+# have let them through unverified (ONDC_MOCK, Pramaan test senders)
+BECKN_VERIFY_ENABLED = os.environ.get('BECKN_VERIFY_ENABLED', 'true').lower() == 'true'
+BECKN_VERIFIED_HEADER = "x-beckn-verified"
+ONDC_GATEWAY_TOKEN = os.environ.get('ONDC_GATEWAY_TOKEN')
+ONDC_MOCK = os.environ.get('ONDC_MOCK', 'false').lower() == 'true'
+beckn_keys = SubscriberKeyStore(
+    registry_url=os.environ.get('ONDC_REGISTRY_URL', 'https://preprod.registry.ondc.org/lookup'),
+    domain=os.environ.get('ONDC_DOMAIN', 'ONDC:TRV10'),
+    country=os.environ.get('ONDC_COUNTRY_CODE', 'IND'),
+    city=os.environ.get('ONDC_CITY_CODE', 'std:080'),
+    ttl=float(os.environ.get('ONDC_KEY_TTL', '3600')),
+    negative_ttl=float(os.environ.get('ONDC_KEY_NEGATIVE_TTL', '60')),
+)
+beckn_verifier = BecknVerifier(beckn_keys)
+
+# Per-user ride and commute search aggregates, folded in as rides complete and
+# searches are logged. Once caught up, GET /api/v1/insights/summary,
+# /insights/recommendations and /recommendations/smart are answered here for
+# tokens signed with Node's JWT_SECRET. Hours are this process's local time, as
+# in Node, so both should run with the same TZ
+USER_INSIGHTS_ENABLED = os.environ.get('USER_INSIGHTS_ENABLED', 'true').lower() == 'true'
+JWT_SECRET = os.environ.get('JWT_SECRET')
+user_insights = UserInsights(
+    commute_db_path=os.environ.get('COMMUTE_DB_PATH'),
+    hot_size=int(os.environ.get('USER_INSIGHTS_HOT_SIZE', '10000')),
+    hot_ttl=float(os.environ.get('USER_INSIGHTS_HOT_TTL', '30')),
+)
+
+# Settlement reconciliation: on_receiver_recon orderbooks are upserted here in
+# one bulk write rather than one round trip per order in Node, then checked
+# against confirmed transactions in the background. Only callbacks whose
+# signature the gateway verified are handled here. The report endpoints answer
+# 404 until RECON_REPORT_TOKEN is set
+RECON_ENABLED = os.environ.get('RECON_ENABLED', 'true').lower() == 'true'
+RECON_REPORT_TOKEN = os.environ.get('RECON_REPORT_TOKEN')
+ONDC_SUBSCRIBER_ID = os.environ.get('ONDC_SUBSCRIBER_ID')
+settlement_recon = SettlementRecon(tolerance=float(os.environ.get('RECON_AMOUNT_TOLERANCE', '0.01')))
+
+# Keyset pagination over status checks
+STATUS_PAGE_DEFAULT = 100
+STATUS_PAGE_MAX = 1000
+STATUS_SORT = [("timestamp", 1), ("id", 1)]
+STATUS_PROJECTION = {"_id": 0, "id": 1, "client_name": 1, "timestamp": 1}
+
+# Optional write-behind batching of POST /api/status inserts
+STATUS_WRITE_BEHIND = os.environ.get('STATUS_WRITE_BEHIND', 'false').lower() == 'true'
+status_writer = WriteBehindQueue(
+    max_batch=int(os.environ.get('STATUS_WRITE_BEHIND_BATCH', '500')),
+    flush_interval=float(os.environ.get('STATUS_WRITE_BEHIND_INTERVAL_MS', '50')) / 1000,
+    max_queue=int(os.environ.get('STATUS_WRITE_BEHIND_QUEUE', '10000')),
+    enqueue_timeout=float(os.environ.get('STATUS_WRITE_BEHIND_WAIT_MS', '100')) / 1000,
+)
 
 # Define Models
 class StatusCheck(BaseModel):
@@ -41,74 +399,1128 @@ class StatusCheck(BaseModel):
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+class FareBatchRequest(BaseModel):
+    # Columns of O/D pairs; length-1 columns are broadcast against the rest
+    originLat: List[float]
+    originLng: List[float]
+    destLat: List[float]
+    destLng: List[float]
+    # ISO-8601 departure times, defaults to now
+    departureTimes: List[str] = []
+    # Trip minutes, defaults to the ~24 km/h Mumbai estimate
+    duration: Optional[List[float]] = None
+    # Overrides the hourly surge curve
+    surgeMultiplier: Optional[List[float]] = None
+
+class SurgeForecastBatchRequest(BaseModel):
+    # Columns of locations, scored at every horizon
+    lat: List[float]
+    lng: List[float]
+    # Minutes after `at` (default now)
+    horizons: List[float] = SURGE_FORECAST_HORIZONS
+    at: Optional[datetime] = None
+
+class BatchItem(BaseModel):
+    # Echoed back with the result
+    id: Optional[str] = None
+    method: str = "GET"
+    # Under /api/v1, with any query string, e.g. "surge/forecast?originLat=19.07&originLng=72.87"
+    path: str
+    # JSON request body
+    body: Optional[Any] = None
+    # Seconds before the item is answered 504, at most BATCH_ITEM_TIMEOUT
+    timeout: Optional[float] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+    # Send each result as an NDJSON line as soon as it is ready, in completion order
+    stream: bool = False
+
 # Root route
 @api_router.get("/")
 async def root():
-    return {"message": "HailO API Gateway", "node_backend": NODE_BACKEND_URL}
+    return {
+        "message": "HailO API Gateway",
+        "node_backend": NODE_BACKEND_URL,
+        "node_upstreams": node_pool.snapshot(),
+        "node_overload": {
+            "limiter": node_limiter.snapshot(),
+            "circuit": node_breaker.snapshot(),
+            "retry_budget": node_retry_budget.snapshot(),
+        },
+        "tracing": tracer.stats(),
+        "rate_limit": {
+            "enabled": RATE_LIMIT_ENABLED,
+            **rate_limiter.stats(),
+            "route_costs": route_costs.snapshot(),
+        },
+    }
 
 # Status check routes
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    stats = {"enabled": RESPONSE_CACHE_ENABLED, **response_cache.stats()}
+    if shared_cache is not None:
+        stats["shared"] = shared_cache.stats()
+    return stats
+
+# Fare estimates for many O/D pairs and departure times in one call
+@api_router.post("/pricing/batch")
+async def price_fare_batch(input: FareBatchRequest):
+    try:
+        departure_times = pd.to_datetime(input.departureTimes, utc=True, format="ISO8601")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid departure time: {e}")
+    if departure_times.empty:
+        departure_times = pd.DatetimeIndex([pd.Timestamp.now(tz="UTC")])
+    hours = departure_times.tz_convert(PRICING_TIMEZONE).hour.to_numpy()
+    columns = [input.originLat, input.originLng, input.destLat, input.destLng,
+               input.duration or [], input.surgeMultiplier or [], hours]
+    if max(len(column) for column in columns) > PRICING_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {PRICING_BATCH_MAX} estimates")
+    try:
+        result = pricing_engine.price_batch(
+            input.originLat, input.originLng, input.destLat, input.destLng, hours,
+            duration_min=input.duration, surge_multiplier=input.surgeMultiplier,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Batch columns do not broadcast: {e}")
+    return {
+        "count": result["total"].size,
+        "departureHours": np.broadcast_to(hours, result["total"].shape).tolist(),
+        **{
+            name: values.tolist() if name in pricing_engine.FRACTIONAL_FIELDS
+            else values.astype(np.int64).tolist()
+            for name, values in result.items()
+        },
+    }
+
+# Live updates for one ONDC transaction (search results, quotes, ride status)
+@api_router.get("/push/transactions/{transaction_id}/events")
+async def stream_transaction_events(transaction_id: str):
+    """Server-Sent Events for one transaction"""
+    async def events():
+        subscriber = push_hub.subscribe(transaction_id)
+        try:
+            yield b": subscribed\n\n"
+            while not subscriber.closed:
+                event = await subscriber.next(PUSH_HEARTBEAT)
+                # Comment lines keep idle connections open through proxies
+                yield event.sse if event is not None else b": ping\n\n"
+        finally:
+            push_hub.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
+
+@api_router.websocket("/push/transactions/{transaction_id}/ws")
+async def transaction_events_socket(websocket: WebSocket, transaction_id: str):
+    """WebSocket messages for one transaction"""
+    await websocket.accept()
+    subscriber = push_hub.subscribe(transaction_id)
+    
+    async def send_events():
+        while not subscriber.closed:
+            event = await subscriber.next(PUSH_HEARTBEAT)
+            if event is not None:
+                await websocket.send_text(event.json)
+    
+    async def receive_until_disconnect():
+        # Clients only listen; reading notices a disconnect while no events flow
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    
+    sender = asyncio.create_task(send_events())
+    receiver = asyncio.create_task(receive_until_disconnect())
+    try:
+        done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
+        push_hub.unsubscribe(subscriber)
+    if sender in done and sender.exception() is None:
+        # Evicted for falling behind (try again later) or the gateway is stopping
+        await websocket.close(code=1013 if subscriber.evicted else 1001)
+
+# Typical quoted prices near a point around a time of the week
+@api_router.get("/prices/typical")
+async def get_typical_prices(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    at: Optional[datetime] = None,
+    # Neighbouring 15-minute slots merged on each side of the one for `at`
+    window: int = Query(2, ge=0, le=8),
+    providerId: Optional[str] = None,
+    vehicleType: Optional[str] = None,
+):
+    return await price_rollups.lookup(
+        lat, lng, at or datetime.utcnow(), window,
+        provider_id=providerId, vehicle_type=vehicleType,
+    )
+
+# Surge multipliers for the next hour from the fitted model, in the shape of
+# Node's /api/v1/surge/forecast
+def surge_forecast_payload(origin_lat: Optional[float], origin_lng: Optional[float],
+                           dest_lat: Optional[float], dest_lng: Optional[float]):
+    now = datetime.now(timezone.utc)
+    model = surge_forecaster.model
+    multipliers = model.forecast(origin_lat, origin_lng, now, SURGE_FORECAST_HORIZONS)[0]
+    return {
+        "forecast": [
+            {
+                "multiplier": round(float(multiplier), 2),
+                "time": "Now" if minutes == 0 else f"{minutes}m",
+                "timestamp": (now + timedelta(minutes=minutes)).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            }
+            for minutes, multiplier in zip(SURGE_FORECAST_HORIZONS, multipliers)
+        ],
+        "location": {
+            "origin": {"lat": origin_lat, "lng": origin_lng},
+            "destination": {"lat": dest_lat, "lng": dest_lng},
+        },
+        "model": model.info(),
+    }
+
+@api_router.get("/surge/forecast")
+async def get_surge_forecast(
+    originLat: Optional[float] = Query(None, ge=-90, le=90),
+    originLng: Optional[float] = Query(None, ge=-180, le=180),
+    destLat: Optional[float] = Query(None, ge=-90, le=90),
+    destLng: Optional[float] = Query(None, ge=-180, le=180),
+):
+    return surge_forecast_payload(originLat, originLng, destLat, destLng)
+
+# Surge multipliers for many locations x horizons in one call
+@api_router.post("/surge/forecast/batch")
+async def forecast_surge_batch(input: SurgeForecastBatchRequest):
+    if len(input.lat) != len(input.lng):
+        raise HTTPException(status_code=400, detail="lat and lng must have the same length")
+    if len(input.lat) * len(input.horizons) > SURGE_FORECAST_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {SURGE_FORECAST_BATCH_MAX} forecasts")
+    at = input.at or datetime.now(timezone.utc)
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    multipliers = surge_forecaster.model.forecast(input.lat, input.lng, at, input.horizons)
+    return {
+        "at": at,
+        "horizons": input.horizons,
+        # One row per location, one column per horizon
+        "multipliers": np.round(multipliers, 3).tolist(),
+        "model": surge_forecaster.model.info(),
+    }
+
+def optional_float(value: Optional[str]) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"Not a finite number: {value}")
+    return number
+
+# Settlement reconciliation reports, newest first
+def check_recon_token(request: Request):
+    if not RECON_REPORT_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("x-recon-token", "").encode(), RECON_REPORT_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@api_router.get("/recon/reports")
+async def get_recon_reports(request: Request, limit: int = Query(10, ge=1, le=100)):
+    check_recon_token(request)
+    return {"reports": await settlement_recon.latest_reports(limit)}
+
+# Reconcile every settlement and list confirmed orders that were never settled
+@api_router.post("/recon/run")
+async def run_recon(request: Request):
+    check_recon_token(request)
+    return await settlement_recon.reconcile()
+
+def check_debug_token(request: Request):
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("x-debug-token", "").encode(), DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+# Collapsed stacks of this worker's threads over the next seconds, for
+# flamegraph.pl or speedscope; the loop keeps serving while it is sampled
+@api_router.get("/debug/profile")
+async def debug_profile(
+    request: Request,
+    seconds: float = Query(10, gt=0),
+    hz: int = Query(100, ge=1, le=1000),
+    thread: str = Query("all", pattern="^(all|loop)$"),
+    idle: bool = False,
+):
+    check_debug_token(request)
+    if seconds > PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"Profiles are at most {PROFILE_MAX_SECONDS:g} seconds")
+    try:
+        collapsed, samples = await profiler.profile(seconds, hz, loop_only=thread == "loop", idle=idle)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already being taken")
+    filename = f"gateway-{os.getpid()}-{datetime.utcnow():%Y%m%dT%H%M%S}.folded"
+    return PlainTextResponse(collapsed, headers={
+        "content-disposition": f'attachment; filename="{filename}"',
+        "x-profile-samples": str(samples),
+    })
+
+@api_router.get("/debug/tasks")
+async def debug_tasks(request: Request):
+    check_debug_token(request)
+    return PlainTextResponse(f"pid {os.getpid()}\n" + task_stacks())
+
+@api_router.get("/debug/loop-stalls")
+async def debug_loop_stalls(request: Request):
+    check_debug_token(request)
+    return {"pid": os.getpid(), **loop_stalls.stats(), "recent": loop_stalls.recent()}
+
+@api_router.get("/debug/slow-requests")
+async def debug_slow_requests(request: Request, limit: int = Query(20, ge=1, le=1000)):
+    check_debug_token(request)
+    return {"pid": os.getpid(), **slow_requests.stats(), "requests": slow_requests.slowest(limit)}
+
+@api_router.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
+    if STATUS_WRITE_BEHIND:
+        try:
+            await status_writer.put(status_obj.dict())
+        except WriteQueueFull:
+            raise HTTPException(status_code=503, detail="Status write queue is full", headers={"Retry-After": "1"})
+        return status_obj
     _ = await db.status_checks.insert_one(status_obj.dict())
     return status_obj
 
+def encode_status_cursor(doc: dict) -> str:
+    token = f"{doc['timestamp'].isoformat()}|{doc['id']}"
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+def decode_status_cursor(cursor: str):
+    try:
+        timestamp, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(timestamp), last_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def encode_status_check(doc: dict) -> bytes:
+    # Documents are written by create_status_check, so they are encoded as
+    # stored instead of being validated through StatusCheck again
+    return json.dumps({
+        "id": doc["id"],
+        "client_name": doc["client_name"],
+        "timestamp": doc["timestamp"].isoformat(),
+    }).encode()
+
+async def stream_status_checks(cursor):
+    async for doc in cursor:
+        yield encode_status_check(doc) + b"\n"
+
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=STATUS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    format: Optional[str] = None,
+):
+    """Status checks in (timestamp, id) order, one keyset page at a time
+    
+    Pass the x-next-cursor header of a page as ?cursor= to fetch the next
+    one. With ?format=ndjson (or Accept: application/x-ndjson) documents are
+    streamed straight from the Mongo cursor, unbounded unless limit is set.
+    """
+    query = {}
+    if cursor:
+        timestamp, last_id = decode_status_cursor(cursor)
+        query = {"$or": [
+            {"timestamp": {"$gt": timestamp}},
+            {"timestamp": timestamp, "id": {"$gt": last_id}},
+        ]}
+    docs = db.status_checks.find(query, STATUS_PROJECTION).sort(STATUS_SORT)
+    
+    ndjson = format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", "")
+    if ndjson:
+        if limit:
+            docs = docs.limit(limit)
+        return StreamingResponse(
+            stream_status_checks(docs.batch_size(STATUS_PAGE_MAX)),
+            media_type="application/x-ndjson",
+        )
+    
+    page = await docs.limit(limit or STATUS_PAGE_DEFAULT).to_list(None)
+    headers = {}
+    if len(page) == (limit or STATUS_PAGE_DEFAULT):
+        headers["x-next-cursor"] = encode_status_cursor(page[-1])
+    return Response(
+        content=b"[" + b",".join(encode_status_check(doc) for doc in page) + b"]",
+        media_type="application/json",
+        headers=headers,
+    )
+
+def end_to_end_headers(items, drop=frozenset()) -> list:
+    """Header pairs without hop-by-hop headers, keeping repeated names"""
+    items = list(items)
+    connection_tokens = {
+        token.strip().lower()
+        for name, value in items if name.lower() == "connection"
+        for token in value.split(",")
+    }
+    return [
+        (name, value) for name, value in items
+        if name.lower() not in HOP_BY_HOP_HEADERS
+        and name.lower() not in connection_tokens
+        and name.lower() not in drop
+    ]
+
+def response_encoding(request: Request, status_code: int, content_type: Optional[str],
+                      content_length: Optional[int]) -> Optional[str]:
+    """Encoding to compress a response with, or None to send it as is"""
+    if request.method == "HEAD" or status_code < 200 or status_code in (204, 304):
+        return None
+    if content_length is not None and content_length < COMPRESS_MIN_SIZE:
+        return None
+    if not is_compressible(content_type):
+        return None
+    return negotiate_encoding(request.headers.get("accept-encoding"))
+
+def with_headers(response: Response, headers: list) -> Response:
+    """Append header pairs, which may repeat a name (e.g. set-cookie)"""
+    response.raw_headers.extend(
+        (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers
+    )
+    return response
+
+def request_has_body(request: Request) -> bool:
+    """Whether the client announced a request body"""
+    if "transfer-encoding" in request.headers:
+        return True
+    return request.headers.get("content-length", "0") not in ("", "0")
+
+# Node.js route prefixes reported as their own metrics label
+NODE_ROUTE_GROUPS = {
+    "auth", "locations", "rides", "insights", "commute", "surge", "pricing",
+    "recommendations", "igm", "ondc", "health",
+}
+
+def route_group(path: str) -> str:
+    """First segment of a proxied path, e.g. /api/v1/surge for surge/forecast"""
+    group = path.split("/", 1)[0]
+    return f"/api/v1/{group}" if group in NODE_ROUTE_GROUPS else "/api/v1/other"
+
+def upstream_route(target_path: str) -> str:
+    if target_path.startswith("/api/v1/"):
+        return route_group(target_path[len("/api/v1/"):])
+    return "/" + target_path.lstrip("/").split("/", 1)[0].split("?", 1)[0]
+
+def route_label(scope: dict) -> str:
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    if route.path == "/api/v1/{path:path}":
+        return route_group(scope["path_params"]["path"])
+    return route.path
+
+def pick_upstream(tried: set, avoid=None):
+    """Least busy upstream not yet refused, preferring one other than avoid"""
+    if avoid is not None:
+        try:
+            return node_pool.acquire(exclude=tried | {avoid})
+        except NoHealthyUpstream:
+            pass
+    return node_pool.acquire(exclude=tried)
+
+async def send_to_node(method: str, target_path: str, headers: list, content, stream: bool = False,
+                       flow: str = "", cost: float = 1.0):
+    """Send a request to the least busy healthy Node.js upstream
+    
+    The request passes the circuit breaker and the adaptive concurrency limit
+    first, and UpstreamOverloaded is raised when it is shed. While the limit
+    is reached it queues fairly against other flows (callers), weighted by
+    cost. The limiter slot is held until response headers arrive. The caller
+    owns the returned upstream slot and must release it once the response
+    has been consumed.
+    """
+    node_breaker.allow()
+    with tracer.span("node.queue"):
+        await node_limiter.acquire(flow, cost)
+    node_retry_budget.record_request()
+    route = upstream_route(target_path)
+    # A streamed request body cannot be sent twice
+    retryable = method in RETRYABLE_METHODS and (content is None or isinstance(content, bytes))
+    attempts = 0
+    tried = set()
+    previous = None
+    try:
+        while True:
+            upstream = pick_upstream(tried, previous)
+            span = tracer.start_span("node.request", kind=CLIENT, attributes={
+                "http.request.method": method,
+                "server.address": upstream.address,
+                "url.path": target_path.split("?", 1)[0],
+                "hailo.attempt": attempts + 1,
+            })
+            start = time.perf_counter()
+            try:
+                upstream_request = http_client.build_request(
+                    method=method,
+                    url=f"{upstream.base_url}{target_path}",
+                    headers=headers + [(TRACEPARENT, span.context.traceparent())],
+                    content=content,
+                    extensions={"trace": HttpxTrace(tracer, span, "node")} if span.recording else None,
+                )
+                response = await http_client.send(upstream_request, stream=stream)
+            except httpx.ConnectError:
+                span.end(error="connect")
+                # A refused connection means nothing was sent, so the request
+                # can move on to the next upstream while this one leaves rotation
+                upstream_errors.inc(upstream.address, "connect")
+                node_pool.release(upstream)
+                node_pool.mark_failed(upstream)
+                tried.add(upstream)
+                continue
+            except asyncio.CancelledError:
+                # The request timed out in a batch or its client went away
+                span.end(error="cancelled")
+                node_pool.release(upstream)
+                raise
+            except httpx.TransportError as e:
+                span.end(error=type(e).__name__)
+                upstream_errors.inc(upstream.address, type(e).__name__)
+                node_pool.release(upstream)
+                node_breaker.record(False)
+                node_limiter.observe(time.perf_counter() - start, ok=False, route=route)
+                attempts += 1
+                if retryable and attempts < NODE_MAX_ATTEMPTS and node_retry_budget.try_retry():
+                    upstream_retries.inc(type(e).__name__)
+                    previous = upstream
+                    continue
+                raise
+            except Exception as e:
+                span.end(error=type(e).__name__)
+                upstream_errors.inc(upstream.address, type(e).__name__)
+                node_pool.release(upstream)
+                raise
+            
+            elapsed = time.perf_counter() - start
+            upstream_response_duration.observe(elapsed, upstream.address, route)
+            ok = response.status_code not in UPSTREAM_FAILURE_STATUSES
+            span.set_attribute("http.response.status_code", response.status_code)
+            span.end(error=None if ok else f"HTTP {response.status_code}")
+            node_breaker.record(ok)
+            node_limiter.observe(elapsed, ok, route=route)
+            attempts += 1
+            if not ok and retryable and attempts < NODE_MAX_ATTEMPTS and node_retry_budget.try_retry():
+                upstream_retries.inc(str(response.status_code))
+                await response.aclose()
+                node_pool.release(upstream)
+                previous = upstream
+                continue
+            return upstream, response
+    finally:
+        node_limiter.release()
+
+async def release_upstream_response(response: httpx.Response, upstream):
+    """Close a streamed upstream response and free its upstream slot"""
+    try:
+        await response.aclose()
+    finally:
+        node_pool.release(upstream)
+
+def node_unavailable_response() -> Response:
+    return Response(
+        content='{"error": "Node.js backend not available", "hint": "Please ensure a Node.js server from NODE_UPSTREAMS is running"}',
+        status_code=503,
+        media_type="application/json"
+    )
+
+def upstream_overloaded_response(e: UpstreamOverloaded) -> Response:
+    upstream_shed.inc(e.reason)
+    return Response(
+        content=f'{{"error": "Node.js backend overloaded", "reason": "{e.reason}"}}',
+        status_code=503,
+        media_type="application/json",
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
+
+def rate_limited_response(e: RateLimited, route: str) -> Response:
+    rate_limited.inc(route)
+    retry_after = max(1, math.ceil(e.retry_after))
+    return Response(
+        content=f'{{"error": "Too many requests", "retryAfter": {retry_after}}}',
+        status_code=429,
+        media_type="application/json",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+def upstream_timeout_response() -> Response:
+    return Response(
+        content='{"error": "Node.js backend timed out"}',
+        status_code=504,
+        media_type="application/json"
+    )
+
+def proxy_error_response(e: Exception) -> Response:
+    logging.error(f"Proxy error: {e}")
+    return Response(
+        content=f'{{"error": "Proxy error", "details": "{str(e)}"}}',
+        status_code=500,
+        media_type="application/json"
+    )
+
+def cache_key(path: str, request: Request, rule: CacheRule) -> str:
+    """Key a cacheable GET on geohash cells, other params and a time bucket"""
+    params = dict(request.query_params)
+    parts = [path, str(int(time.time() // rule.bucket_seconds))]
+    for lat_param, lng_param in rule.coordinates:
+        lat, lng = params.pop(lat_param, None), params.pop(lng_param, None)
+        try:
+            cell = geohash_encode(float(lat), float(lng), CACHE_GEOHASH_PRECISION)
+        except (TypeError, ValueError):
+            cell = f"{lat},{lng}"
+        parts.append(f"{lat_param}:{cell}")
+    parts.extend(f"{name}={value}" for name, value in sorted(params.items()))
+    return "|".join(parts)
+
+async def cached_proxy(request: Request, path: str, target_path: str,
+                       rule: CacheRule, headers: list, flow: str, cost: float) -> Response:
+    """Serve a cacheable GET from the gateway cache, loading it from Node once"""
+    async def load() -> CachedResponse:
+        upstream, response = await send_to_node("GET", target_path, headers, None, flow=flow, cost=cost)
+        node_pool.release(upstream)
+        return CachedResponse(
+            response.status_code,
+            response.content,
+            response.headers.get("content-type", "application/json"),
+        )
+    
+    cached, state = await response_cache.get_or_load(
+        cache_key(path, request, rule), load, rule.ttl, rule.stale_ttl
+    )
+    headers = {"x-cache": state}
+    body = cached.body
+    encoding = response_encoding(request, cached.status_code, cached.media_type, len(body))
+    if encoding:
+        # Repeated hits reuse the compressed bytes kept with the entry
+        body = response_cache.encoded_body(cached, encoding, compress)
+        headers.update({"content-encoding": encoding, "vary": "Accept-Encoding"})
+    return Response(
+        content=body,
+        status_code=cached.status_code,
+        media_type=cached.media_type,
+        headers=headers,
+    )
+
+@functools.lru_cache(maxsize=int(os.environ.get('JWT_CACHE_SIZE', '10000')))
+def verified_token(token: str) -> Optional[Tuple[str, Optional[float]]]:
+    """userId and expiry of a token signed with JWT_SECRET
+
+    Cached: checking the signature takes ~80 us, and every request of an app
+    carries the same token.
+    """
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    except jwt.PyJWTError:
+        return None
+    user_id = claims.get("userId")
+    return (str(user_id), claims.get("exp")) if user_id else None
+
+def authenticated_user_id(request: Request) -> Optional[str]:
+    """userId of a Bearer token Node would accept, if the gateway can verify it"""
+    authorization = request.headers.get("authorization", "")
+    if not JWT_SECRET or not authorization.startswith("Bearer "):
+        return None
+    verified = verified_token(authorization[7:])
+    if verified is None:
+        return None
+    user_id, expires = verified
+    if expires is not None and expires <= time.time():
+        return None
+    return user_id
+
+def caller_id(request: Request) -> str:
+    """Who a request is rate limited and queued as"""
+    user_id = authenticated_user_id(request)
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def admit(request: Request, path: str, limit: bool = True) -> Tuple[str, float]:
+    """Caller and cost of a request, spent from the caller's bucket when limit is set
+
+    Raises RateLimited when the caller cannot afford it.
+    """
+    caller = caller_id(request)
+    cost = route_costs.cost(path)
+    if limit and RATE_LIMIT_ENABLED:
+        rate_limiter.take(caller, cost)
+    return caller, cost
+
+# Node routes the gateway answers from its own data once that is ready;
+# whatever it cannot answer goes to Node as before
+async def answer_locally(request: Request, path: str):
+    if request.method != "GET":
+        return None
+    if path == "surge/forecast" and surge_forecaster.ready:
+        params = request.query_params
+        try:
+            return surge_forecast_payload(*(
+                optional_float(params.get(name)) for name in ("originLat", "originLng", "destLat", "destLng")
+            ))
+        except ValueError:
+            return None
+    if path in ("insights/summary", "insights/recommendations", "recommendations/smart") and user_insights.ready:
+        user_id = authenticated_user_id(request)
+        if user_id is None:
+            return None
+        try:
+            aggregate, user = await user_insights.get(user_id)
+        except (InvalidId, PyMongoError) as e:
+            logger.warning(f"Insights for {user_id} left to Node: {e}")
+            return None
+        if path == "insights/recommendations":
+            return insights_recommendations(aggregate)
+        if path == "recommendations/smart":
+            return smart_recommendation(aggregate, datetime.now().hour)
+        if user is None:
+            return Response(content='{"error": "User not found"}', status_code=404, media_type="application/json")
+        return insights_summary(aggregate, user)
+    return None
+
+def batch_target(item: BatchItem) -> Tuple[str, str]:
+    """Path under /api/v1 and query string of a batch item"""
+    path, _, query = item.path.partition("?")
+    path = path.strip("/")
+    if path.startswith("api/v1/"):
+        path = path[len("api/v1/"):]
+    return path, query
+
+def batch_path_safe(path: str) -> bool:
+    """No empty, dot or percent-encoded dot segments, which would resolve outside /api/v1"""
+    if "%2e" in path.lower():
+        return False
+    return all(segment not in ("", ".", "..") for segment in path.split("/"))
+
+def batch_sub_request(request: Request, item: BatchItem, path: str, query: str) -> Request:
+    """One item of a batch as a request of its own, with the batch's credentials"""
+    body = json.dumps(item.body).encode() if item.body is not None else b""
+    headers = [(name, value) for name, value in request.scope["headers"] if name not in BATCH_DROP_HEADERS]
+    if body:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    scope = {
+        **request.scope,
+        "method": item.method,
+        "path": f"/api/v1/{path}",
+        "raw_path": f"/api/v1/{path}".encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+        "path_params": {"path": path},
+        "state": {},
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
+
+def batch_item_json(index: int, item: BatchItem, response: Response, elapsed: float) -> bytes:
+    """A sub-response as one JSON object; JSON bodies are embedded as they are"""
+    headers = {}
+    for name, value in response.raw_headers:
+        name = name.decode("latin-1")
+        if name in BATCH_ITEM_HEADERS:
+            headers[name] = value.decode("latin-1")
+    media_type = (response.media_type or "").split(";", 1)[0].strip()
+    body = response.body
+    if not body.strip():
+        body = b"null"
+    elif not (media_type == "application/json" or media_type.endswith("+json")):
+        body = json.dumps(body.decode("utf-8", "replace")).encode()
+    head = json.dumps({
+        "index": index,
+        "id": item.id,
+        "status": response.status_code,
+        "headers": headers,
+        "durationMs": round(elapsed * 1000, 1),
+    })
+    return head[:-1].encode() + b', "body": ' + body + b"}"
+
+async def run_batch_item(request: Request, index: int, item: BatchItem, caller: str, cost: float) -> bytes:
+    path, query = batch_target(item)
+    timeout = min(item.timeout or BATCH_ITEM_TIMEOUT, BATCH_ITEM_TIMEOUT)
+    start = time.perf_counter()
+    with tracer.span("batch.item", attributes={"url.path": path, "hailo.batch.index": index}):
+        try:
+            response = await asyncio.wait_for(
+                proxy_admitted(batch_sub_request(request, item, path, query), path, caller, cost, stream=False),
+                timeout,
+            )
+            outcome = None
+        except asyncio.TimeoutError:
+            response = Response(
+                content='{"error": "Sub-request timed out"}', status_code=504, media_type="application/json"
+            )
+            outcome = "timeout"
+        except Exception as e:
+            # Upstream failures are answered by the proxy; this is anything else
+            response = proxy_error_response(e)
+            outcome = None
+    if not isinstance(response, Response):
+        response = JSONResponse(jsonable_encoder(response))
+    batch_items.inc(outcome or f"{response.status_code // 100}xx")
+    return batch_item_json(index, item, response, time.perf_counter() - start)
+
+async def stream_batch(runs: list):
+    tasks = [asyncio.ensure_future(run) for run in runs]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished + b"\n"
+    finally:
+        # The client went away mid-stream
+        for task in tasks:
+            task.cancel()
+
+# Several /api/v1 calls in one round trip, run concurrently through the same
+# local, cache and proxy paths as if sent separately. Declared before the
+# catch-all so it is not forwarded to Node
+@app.post("/api/v1/batch")
+async def batch_requests(request: Request, batch: BatchRequest):
+    if not batch.requests:
+        raise HTTPException(status_code=400, detail="No requests")
+    if len(batch.requests) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_ITEMS} requests")
+    costs = []
+    for index, item in enumerate(batch.requests):
+        path, _ = batch_target(item)
+        if (item.method not in BATCH_METHODS or not path or not batch_path_safe(path)
+                or path.split("/", 1)[0] == "batch"):
+            raise HTTPException(status_code=400, detail=f"requests[{index}] is not a batchable request")
+        costs.append(route_costs.cost(path))
+    
+    # Authorized once for all items: a token Node would refuse fails the batch
+    authorization = request.headers.get("authorization", "")
+    if JWT_SECRET and authorization.startswith("Bearer ") and authenticated_user_id(request) is None:
+        return Response(content='{"error": "Invalid token"}', status_code=401, media_type="application/json")
+    caller = caller_id(request)
+    if RATE_LIMIT_ENABLED:
+        try:
+            rate_limiter.take(caller, sum(costs))
+        except RateLimited as e:
+            return rate_limited_response(e, "/api/v1/batch")
+    
+    runs = [run_batch_item(request, index, item, caller, cost)
+            for index, (item, cost) in enumerate(zip(batch.requests, costs))]
+    if batch.stream:
+        body = stream_batch(runs)
+        headers = {}
+        encoding = response_encoding(request, 200, "application/x-ndjson", None)
+        if encoding:
+            body = compress_stream(body, encoding, flush=True)
+            headers = {"content-encoding": encoding, "vary": "Accept-Encoding"}
+        return StreamingResponse(body, media_type="application/x-ndjson", headers=headers)
+    
+    body = b'{"responses": [' + b", ".join(await asyncio.gather(*runs)) + b"]}"
+    headers = {}
+    encoding = response_encoding(request, 200, "application/json", len(body))
+    if encoding:
+        body = compress(body, encoding)
+        headers = {"content-encoding": encoding, "vary": "Accept-Encoding"}
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # Proxy all /api/v1/* requests to Node.js backend
 @app.api_route("/api/v1/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
 async def proxy_to_node(request: Request, path: str):
     """Proxy requests to Node.js backend"""
-    target_url = f"{NODE_BACKEND_URL}/api/v1/{path}"
+    try:
+        caller, cost = admit(request, path)
+    except RateLimited as e:
+        return rate_limited_response(e, route_group(path))
+    return await proxy_admitted(request, path, caller, cost, stream=PROXY_STREAMING)
+
+async def proxy_admitted(request: Request, path: str, caller: str, cost: float, stream: bool):
+    """Answer an admitted /api/v1 request locally, from the cache or from Node"""
+    target_path = f"/api/v1/{path}"
     
     # Get query parameters
     query_string = str(request.query_params)
     if query_string:
-        target_url += f"?{query_string}"
+        target_path += f"?{query_string}"
+    
+    local = await answer_locally(request, path)
+    if local is not None:
+        return local
+    
+    # Get end-to-end headers (exclude host)
+    headers = end_to_end_headers(request.headers.items(), drop=PROXY_REQUEST_DROP_HEADERS)
     
-    # Get headers (exclude host)
-    headers = dict(request.headers)
-    headers.pop("host", None)
+    rule = CACHE_RULES.get(path) if RESPONSE_CACHE_ENABLED else None
+    if rule is not None and request.method == "GET" and not request_has_body(request):
+        try:
+            return await cached_proxy(request, path, target_path, rule, headers, caller, cost)
+        except NoHealthyUpstream:
+            return node_unavailable_response()
+        except UpstreamOverloaded as e:
+            return upstream_overloaded_response(e)
+        except httpx.TimeoutException:
+            return upstream_timeout_response()
+        except Exception as e:
+            return proxy_error_response(e)
     
     # Get body if present
-    body = await request.body()
+    if stream:
+        content = request.stream() if request_has_body(request) else None
+    else:
+        body = await request.body()
+        content = body if body else None
     
+    return await forward_to_node(
+        request, target_path, headers, content, stream=stream, flow=caller, cost=cost
+    )
+
+def beckn_exempt(body: bytes) -> bool:
+    """Callbacks Node's ondcAuth middleware accepts without a valid signature"""
+    if ONDC_MOCK:
+        return True
     try:
-        response = await http_client.request(
-            method=request.method,
-            url=target_url,
-            headers=headers,
-            content=body if body else None,
-        )
-        
-        # Return response
-        return Response(
-            content=response.content,
-            status_code=response.status_code,
-            headers=dict(response.headers),
-            media_type=response.headers.get("content-type", "application/json")
-        )
-    except httpx.ConnectError:
-        return Response(
-            content='{"error": "Node.js backend not available", "hint": "Please ensure the Node.js server is running on port 8002"}',
-            status_code=503,
-            media_type="application/json"
+        context = json.loads(body).get("context") or {}
+    except (ValueError, AttributeError):
+        return False
+    sender = context.get("bpp_uri") or context.get("bap_uri") or ""
+    return "pramaan.ondc.org" in sender or "mock" in sender
+
+def remember_ondc_search(body: bytes):
+    """Note a sampled search's span under the transaction id Node answered with"""
+    span = tracer.current()
+    try:
+        transaction_id = json.loads(body).get("transactionId")
+    except (ValueError, AttributeError):
+        return
+    if span is not None and transaction_id:
+        span.set_attribute("ondc.transaction_id", transaction_id)
+        trace_links.remember(str(transaction_id), span.context)
+
+def link_ondc_callback(body: bytes):
+    """Link a callback's span to the sampled search of its transaction, and sample it too"""
+    span = tracer.current()
+    try:
+        transaction_id = (json.loads(body).get("context") or {}).get("transaction_id")
+    except (ValueError, AttributeError):
+        return
+    origin = trace_links.get(str(transaction_id)) if span is not None and transaction_id else None
+    if origin is None:
+        return
+    span.sample()
+    span.set_attribute("ondc.transaction_id", transaction_id)
+    span.add_link(origin, {"ondc.link": "search"})
+
+# Proxy Beckn/ONDC traffic to Node.js; callbacks are signature-checked first
+@app.api_route("/ondc/{path:path}", methods=["GET", "POST"])
+async def proxy_ondc(request: Request, path: str):
+    target_path = f"/ondc/{path}"
+    query_string = str(request.query_params)
+    if query_string:
+        target_path += f"?{query_string}"
+    # Signed callbacks from the network are queued but never rate limited
+    callback = path.startswith("on_")
+    try:
+        caller, cost = admit(request, f"ondc/{path}", limit=not callback)
+    except RateLimited as e:
+        return rate_limited_response(e, "/ondc")
+    headers = end_to_end_headers(
+        request.headers.items(), drop=PROXY_REQUEST_DROP_HEADERS | {BECKN_VERIFIED_HEADER}
+    )
+    body = await request.body()
+    if callback and tracer.exporter is not None:
+        link_ondc_callback(body)
+    verified = False
+    if BECKN_VERIFY_ENABLED and request.method == "POST" and callback:
+        try:
+            with tracer.span("beckn.verify"):
+                subscriber_id = await beckn_verifier.verify(request.headers.get("authorization"), body)
+        except SignatureError as e:
+            if not beckn_exempt(body):
+                logger.warning(f"Rejected /ondc/{path} callback: {e}")
+                return Response(
+                    content=json.dumps({
+                        "message": {"ack": {"status": "NACK"}},
+                        "error": {"code": "30000", "message": "Invalid Signature", "path": str(e)},
+                    }),
+                    status_code=401,
+                    media_type="application/json",
+                )
+        else:
+            verified = True
+            if ONDC_GATEWAY_TOKEN:
+                headers.append((BECKN_VERIFIED_HEADER, ONDC_GATEWAY_TOKEN))
+            logger.debug(f"Verified /ondc/{path} callback from {subscriber_id}")
+    # Settlements are only taken from signed callbacks; exempt or unchecked
+    # ones go to Node, whose middleware decides
+    if RECON_ENABLED and verified and path == "on_receiver_recon":
+        return await receive_recon(request, body)
+    span = tracer.current()
+    on_body = remember_ondc_search if path == "search" and span is not None and span.recording else None
+    return await forward_to_node(
+        request, target_path, headers, body or None, stream=False, flow=caller, cost=cost, on_body=on_body
+    )
+
+def ondc_ack(status: str, status_code: int = 200) -> Response:
+    return Response(
+        content=json.dumps({"message": {"ack": {"status": status}}}),
+        status_code=status_code,
+        media_type="application/json",
+    )
+
+async def receive_recon(request: Request, body: bytes) -> Response:
+    """on_receiver_recon in place of Node's reconService, audited as Node would"""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return ondc_ack("NACK", 400)
+    try:
+        result = await settlement_recon.handle(payload)
+        logger.info(f"Upserted {result['orders']} settlements from on_receiver_recon")
+        response = ondc_ack("ACK")
+    except PyMongoError as e:
+        logger.error(f"Error handling on_receiver_recon: {e!r}")
+        response = ondc_ack("NACK", 500)
+    response.background = BackgroundTask(
+        audit_inbound, request, payload, "on_receiver_recon", response.status_code == 200
+    )
+    return response
+
+async def audit_inbound(request: Request, payload: dict, action: str, acked: bool):
+    """The two AuditLog entries Node's auditIncomingMiddleware writes"""
+    context = payload.get("context") or {}
+    sender = context.get("bap_id") or context.get("bpp_id")
+    entry = {
+        "transactionId": context.get("transaction_id"),
+        "messageId": context.get("message_id"),
+        "action": context.get("action") or action,
+        "timestamp": datetime.utcnow(),
+    }
+    received = {
+        **entry,
+        "direction": "INBOUND",
+        "source": sender or "UNKNOWN_NETWORK_PARTICIPANT",
+        "destination": ONDC_SUBSCRIBER_ID,
+        "payload": payload,
+        "headers": dict(request.headers),
+        "status": "PROCESSING",
+    }
+    answered = {
+        **entry,
+        "direction": "OUTBOUND",
+        "source": ONDC_SUBSCRIBER_ID,
+        "destination": sender,
+        "status": "SUCCESS" if acked else "ERROR",
+    }
+    try:
+        await db.auditlogs.insert_many([received, answered])
+    except PyMongoError as e:
+        logger.warning(f"Failed to write audit log for {action}: {e!r}")
+
+async def forward_to_node(request: Request, target_path: str, headers: list, content, stream: bool,
+                          flow: str = "", cost: float = 1.0, on_body: Optional[Callable[[bytes], None]] = None):
+    """Send the request to Node.js and relay its response
+
+    on_body, if given, is called with the body of a response that is not
+    streamed before it is relayed.
+    """
+    try:
+        upstream, response = await send_to_node(
+            request.method, target_path, headers, content, stream=stream, flow=flow, cost=cost
         )
+    except NoHealthyUpstream:
+        return node_unavailable_response()
+    except UpstreamOverloaded as e:
+        return upstream_overloaded_response(e)
+    except httpx.TimeoutException:
+        return upstream_timeout_response()
     except Exception as e:
-        logging.error(f"Proxy error: {e}")
-        return Response(
-            content=f'{{"error": "Proxy error", "details": "{str(e)}"}}',
-            status_code=500,
-            media_type="application/json"
-        )
+        return proxy_error_response(e)
+    
+    media_type = response.headers.get("content-type", "application/json")
+    response_headers = end_to_end_headers(
+        response.headers.multi_items(), drop=PROXY_RESPONSE_DROP_HEADERS
+    )
+    
+    if stream:
+        # Pass the upstream bytes through, compressing them on the fly when
+        # negotiated, and release the connection once the client has
+        # received the last chunk
+        content_length = response.headers.get("content-length")
+        encoding = None
+        if "content-encoding" not in response.headers:
+            encoding = response_encoding(
+                request, response.status_code, media_type,
+                int(content_length) if content_length and content_length.isdigit() else None,
+            )
+        body = response.aiter_raw()
+        if encoding:
+            body = compress_stream(body, encoding)
+            response_headers = [
+                (name, value) for name, value in response_headers if name.lower() != "content-length"
+            ] + [("content-encoding", encoding), ("vary", "Accept-Encoding")]
+        return with_headers(StreamingResponse(
+            body,
+            status_code=response.status_code,
+            media_type=media_type,
+            background=BackgroundTask(release_upstream_response, response, upstream),
+        ), response_headers)
+    
+    node_pool.release(upstream)
+    
+    # httpx has already decoded the body, so its length and encoding change
+    body = response.content
+    if on_body is not None:
+        on_body(body)
+    response_headers = [
+        (name, value) for name, value in response_headers
+        if name.lower() not in ("content-length", "content-encoding")
+    ]
+    encoding = response_encoding(request, response.status_code, media_type, len(body))
+    if encoding:
+        body = compress(body, encoding)
+        response_headers += [("content-encoding", encoding), ("vary", "Accept-Encoding")]
+    
+    # Return response
+    return with_headers(Response(
+        content=body,
+        status_code=response.status_code,
+        media_type=media_type,
+    ), response_headers)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(
+    RequestMetricsMiddleware,
+    requests=http_requests,
+    duration=http_request_duration,
+    in_flight=http_requests_in_flight,
+    route_label=route_label,
+)
+
+# Inside the tracing middleware, so the request's span is active. Profiles
+# take as long as they are asked to
+if SLOW_REQUEST_MS > 0:
+    app.add_middleware(
+        SlowRequestMiddleware,
+        log=slow_requests,
+        tracer=tracer,
+        route_label=route_label,
+        exclude_prefixes=("/api/debug/",),
+    )
+
+app.add_middleware(TracingMiddleware, tracer=tracer, route_label=route_label)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -124,7 +1536,243 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
-    await http_client.aclose()
+httpx_connections = metrics.gauge(
+    "hailo_httpx_connections", "Connections in the proxy client pools", ["state"])
+node_upstream_outstanding = metrics.gauge(
+    "hailo_node_upstream_outstanding", "Requests in flight per Node.js upstream", ["upstream"])
+node_upstream_healthy = metrics.gauge(
+    "hailo_node_upstream_healthy", "Whether a Node.js upstream is in rotation", ["upstream"])
+response_cache_requests = metrics.counter(
+    "hailo_response_cache_requests_total", "Response cache lookups by result", ["result"])
+response_cache_size = metrics.gauge(
+    "hailo_response_cache_size", "Response cache contents", ["unit"])
+shared_cache_operations = metrics.counter(
+    "hailo_shared_cache_operations_total", "Lookups and stores in the cache shared by workers", ["outcome"])
+shared_cache_entries = metrics.gauge(
+    "hailo_shared_cache_entries", "Servable entries in the cache shared by workers")
+gateway_leader = metrics.gauge(
+    "hailo_gateway_leader", "1 on the worker running the once-per-host background work")
+status_write_behind_documents = metrics.counter(
+    "hailo_status_write_behind_documents_total", "Write-behind status documents by outcome", ["outcome"])
+status_write_behind_queued = metrics.gauge(
+    "hailo_status_write_behind_queued", "Status documents waiting to be flushed")
+push_subscribers = metrics.gauge(
+    "hailo_push_subscribers", "WebSocket and SSE clients subscribed to transactions")
+push_feeds_connected = metrics.gauge(
+    "hailo_push_feeds_connected", "Node.js event feeds currently connected")
+push_events = metrics.counter(
+    "hailo_push_events_total", "Transaction events from Node.js and deliveries to clients", ["stage"])
+push_evictions = metrics.counter(
+    "hailo_push_evictions_total", "Push clients dropped for falling behind")
+price_rollup_quotes = metrics.counter(
+    "hailo_price_rollup_quotes_total", "RideHistory quotes folded into price rollups")
+price_rollup_lag = metrics.gauge(
+    "hailo_price_rollup_lag_seconds", "Age of the newest quote folded into price rollups")
+beckn_signatures = metrics.counter(
+    "hailo_beckn_signatures_total", "ONDC callback signatures checked at the gateway", ["result"])
+beckn_key_lookups = metrics.counter(
+    "hailo_beckn_key_lookups_total", "Subscriber key reads by source", ["source"])
+user_insights_updates = metrics.counter(
+    "hailo_user_insights_updates_total", "Rides and commute searches folded into user insights", ["source"])
+user_insights_reads = metrics.counter(
+    "hailo_user_insights_reads_total", "User insights reads by hot set result", ["result"])
+user_insights_hot_entries = metrics.gauge(
+    "hailo_user_insights_hot_entries", "Users whose insights are held in memory")
+surge_model_observations = metrics.gauge(
+    "hailo_surge_model_observations", "Observations the current surge model was fitted on")
+surge_model_age = metrics.gauge(
+    "hailo_surge_model_age_seconds", "Time since the surge model was last fitted")
+recon_orders = metrics.counter(
+    "hailo_recon_orders_total", "Settlement orders from on_receiver_recon by outcome", ["outcome"])
+recon_flags = metrics.counter(
+    "hailo_recon_flags_total", "Settlements flagged by reconciliation check", ["check"])
+node_concurrency_limit = metrics.gauge(
+    "hailo_node_concurrency_limit", "Adaptive limit on requests waiting for Node.js")
+node_requests_queued = metrics.gauge(
+    "hailo_node_requests_queued", "Requests waiting for a Node.js concurrency slot")
+node_queued_flows = metrics.gauge(
+    "hailo_node_queued_flows", "Callers with requests waiting for a Node.js concurrency slot")
+trace_spans = metrics.counter(
+    "hailo_trace_spans_total", "Finished spans of sampled traces by outcome", ["outcome"])
+event_loop_stalls = metrics.counter(
+    "hailo_event_loop_stalls_total", "Times the event loop was held for longer than LOOP_STALL_MS")
+slow_requests_recorded = metrics.counter(
+    "hailo_slow_requests_total", "Requests that took longer than SLOW_REQUEST_MS")
+batch_items = metrics.counter(
+    "hailo_batch_items_total", "Sub-requests of /api/v1/batch by status class", ["status"])
+rate_limit_callers = metrics.gauge(
+    "hailo_rate_limit_callers", "Callers with a token bucket in this worker")
+rate_limit_evictions = metrics.counter(
+    "hailo_rate_limit_evictions_total", "Token buckets dropped from the caller table", ["reason"])
+node_circuit_open = metrics.gauge(
+    "hailo_node_circuit_open", "Whether the Node.js circuit breaker is shedding requests")
+
+def collect_gateway_metrics():
+    if http_client is not None:
+        for state, count in httpx_pool_connections(http_client).items():
+            httpx_connections.set(count, state)
+    gateway_leader.set(int(leader.is_leader))
+    for upstream in node_pool.upstreams:
+        node_upstream_outstanding.set(upstream.outstanding, upstream.address)
+        node_upstream_healthy.set(int(upstream.healthy), upstream.address)
+    cache_stats = response_cache.stats()
+    for result in ("hits", "shared_hits", "stale_hits", "misses", "coalesced"):
+        response_cache_requests.set(cache_stats[result], result)
+    response_cache_size.set(cache_stats["entries"], "entries")
+    response_cache_size.set(cache_stats["bytes"], "bytes")
+    if shared_cache is not None:
+        shared_stats = shared_cache.stats()
+        for outcome in ("hits", "misses", "stores", "oversize", "lease_conflicts"):
+            shared_cache_operations.set(shared_stats[outcome], outcome)
+        shared_cache_entries.set(shared_stats["entries"])
+    writer_stats = status_writer.stats()
+    for outcome in ("flushed", "rejected", "dropped"):
+        status_write_behind_documents.set(writer_stats[outcome], outcome)
+    status_write_behind_queued.set(writer_stats["queued"])
+    rollup_stats = price_rollups.stats()
+    price_rollup_quotes.set(rollup_stats["processed"])
+    if rollup_stats["watermark"] is not None:
+        price_rollup_lag.set((datetime.utcnow() - rollup_stats["watermark"]).total_seconds())
+    beckn_signatures.set(beckn_verifier.verified, "verified")
+    beckn_signatures.set(beckn_verifier.rejected, "rejected")
+    key_stats = beckn_keys.stats()
+    beckn_key_lookups.set(key_stats["hits"], "cache")
+    beckn_key_lookups.set(key_stats["lookups"], "registry")
+    beckn_key_lookups.set(key_stats["lookup_failures"], "registry_error")
+    insights_stats = user_insights.stats()
+    user_insights_updates.set(insights_stats["rides_applied"], "ride")
+    user_insights_updates.set(insights_stats["searches_applied"], "commute_search")
+    user_insights_reads.set(insights_stats["hits"], "hit")
+    user_insights_reads.set(insights_stats["misses"], "miss")
+    user_insights_hot_entries.set(insights_stats["hot_entries"])
+    recon_stats = settlement_recon.stats()
+    recon_orders.set(recon_stats["orders_ingested"], "upserted")
+    recon_orders.set(recon_stats["orders_rejected"], "rejected")
+    for check in RECON_CHECKS:
+        recon_flags.set(recon_stats["flagged"][check], check)
+    surge_stats = surge_forecaster.stats()
+    surge_model_observations.set(surge_stats["observations"])
+    if surge_stats["fittedAt"] is not None:
+        surge_model_age.set((datetime.now(timezone.utc) - surge_stats["fittedAt"]).total_seconds())
+    push_stats = push_hub.stats()
+    push_subscribers.set(push_stats["subscribers"])
+    push_feeds_connected.set(push_stats["connected_feeds"])
+    push_events.set(push_stats["events"], "received")
+    push_events.set(push_stats["delivered"], "delivered")
+    push_evictions.set(push_stats["evictions"])
+    limiter_stats = node_limiter.snapshot()
+    node_concurrency_limit.set(limiter_stats["limit"])
+    node_requests_queued.set(limiter_stats["queued"])
+    node_queued_flows.set(limiter_stats["queued_flows"])
+    trace_stats = tracer.stats()
+    for outcome in ("exported", "dropped", "failed"):
+        trace_spans.set(trace_stats[outcome], outcome)
+    rate_stats = rate_limiter.stats()
+    rate_limit_callers.set(rate_stats["callers"])
+    for reason, count in rate_stats["evicted"].items():
+        rate_limit_evictions.set(count, reason)
+    node_circuit_open.set(int(node_breaker.state != CircuitBreaker.CLOSED))
+    event_loop_stalls.set(loop_stalls.stalls)
+    slow_requests_recorded.set(slow_requests.recorded)
+
+metrics.add_collector(collect_gateway_metrics)
+
+async def ensure_indexes():
+    try:
+        await db.status_checks.create_index(STATUS_SORT)
+    except Exception as e:
+        logger.warning(f"Could not create status_checks index: {e}")
+    try:
+        await price_rollups.ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create price_rollups index: {e}")
+    if RECON_ENABLED:
+        try:
+            await settlement_recon.ensure_indexes()
+        except Exception as e:
+            logger.warning(f"Could not create settlement reconciliation indexes: {e}")
+
+def start_leader_work():
+    """Work done once per host, by whichever worker holds the leader lock"""
+    # In the background so the proxy starts even while Mongo is unreachable
+    app.state.index_task = asyncio.create_task(ensure_indexes())
+    if PRICE_ROLLUPS_ENABLED:
+        price_rollups.start()
+    if SURGE_FORECAST_ENABLED:
+        surge_forecaster.start()
+    if USER_INSIGHTS_ENABLED:
+        user_insights.start()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open this worker's clients and start its background work"""
+    global client, db, http_client
+    if RATE_LIMIT_ENABLED and 'FORWARDED_ALLOW_IPS' not in os.environ:
+        logger.warning("Rate limiting without FORWARDED_ALLOW_IPS: clients behind a proxy share its IP's bucket")
+    client = AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        event_listeners=[
+            MongoCommandListener(mongo_command_duration, mongo_command_failures),
+            MongoTraceListener(tracer),
+        ],
+    )
+    db = client[DB_NAME]
+    http_client = httpx.AsyncClient(
+        timeout=NODE_TIMEOUT,
+        limits=httpx.Limits(max_connections=NODE_MAX_CONNECTIONS, max_keepalive_connections=NODE_MAX_CONNECTIONS),
+        mounts=node_pool.mounts(),
+    )
+    for component in (price_rollups, surge_forecaster, user_insights, settlement_recon):
+        component.bind(db)
+    beckn_keys.bind(http_client)
+    if shared_cache is not None:
+        shared_cache.open()
+    if trace_links.shared is not None:
+        trace_links.shared.open()
+    await tracer.start()
+
+    loop_lag_monitor.start()
+    if DEBUG_TOKEN:
+        loop_stalls.start()
+    node_pool.start(http_client)
+    if EVENT_FEED_TOKEN:
+        push_hub.start(http_client, [upstream.base_url for upstream in node_pool.upstreams])
+    else:
+        logger.warning("EVENT_FEED_TOKEN is unset; transaction updates are not pushed")
+    if BECKN_VERIFY_ENABLED:
+        beckn_keys.start()
+    if STATUS_WRITE_BEHIND:
+        status_writer.start(db.status_checks)
+    if not leader.start(start_leader_work):
+        # Until this worker takes over, it serves what the leader produces
+        if SURGE_FORECAST_ENABLED:
+            surge_forecaster.follow()
+        if USER_INSIGHTS_ENABLED:
+            user_insights.follow_leader()
+    try:
+        yield
+    finally:
+        await leader.stop()
+        await node_pool.stop()
+        await push_hub.stop()
+        await price_rollups.stop()
+        await surge_forecaster.stop()
+        await user_insights.stop()
+        await beckn_keys.stop()
+        await settlement_recon.stop()
+        await loop_stalls.stop()
+        await loop_lag_monitor.stop()
+        # Everything acknowledged to a client must reach Mongo before closing
+        await status_writer.stop()
+        await tracer.stop()
+        if shared_cache is not None:
+            shared_cache.close()
+        if trace_links.shared is not None:
+            trace_links.shared.close()
+        client.close()
+        await http_client.aclose()
+
+# Set here rather than in FastAPI() so it can use everything defined above
+app.router.lifespan_context = lifespan
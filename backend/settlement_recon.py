@@ -0,0 +1,258 @@
+"""Bulk settlement reconciliation against confirmed ONDC orders
+
+An on_receiver_recon callback carries an orderbook of settled orders. The
+whole orderbook is upserted into Node's `settlements` collection in one
+unordered bulk_write, keyed on orderId as reconService does, and the batch is
+then joined with pandas against the transactions whose confirmedOrder has the
+same id. Each settlement is checked for:
+
+- amount_mismatch: settled amount differs from the confirmed quote
+- missing_utr: no UTR (payment URN) to trace the transfer by
+- orphan: no confirmed transaction with that order id
+
+A full run also lists confirmed orders that have no settlement (unsettled).
+Summaries are kept in `settlement_recon_reports`.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+SETTLEMENT_COLLECTION = "settlements"
+TRANSACTION_COLLECTION = "transactions"
+REPORT_COLLECTION = "settlement_recon_reports"
+
+CHECKS = ["amount_mismatch", "missing_utr", "orphan"]
+
+# Order ids listed per check in a report; the counts are always complete
+SAMPLE_SIZE = 100
+
+# $in lists are kept well under the 16 MB query limit
+LOOKUP_CHUNK = 20000
+
+
+def settlement_frame(orders: List[Dict]) -> Tuple[pd.DataFrame, int]:
+    """Orderbook orders as columns, last one per order id; also how many were unusable"""
+    payments = [order.get("payment") or {} for order in orders]
+    params = [payment.get("params") or {} for payment in payments]
+    frame = pd.DataFrame({
+        "orderId": [order.get("id") for order in orders],
+        "settlementId": [order.get("settlement_id") for order in orders],
+        # Node's parseFloat(amount || 0)
+        "amount": pd.to_numeric(pd.Series([p.get("amount") or 0 for p in params], dtype=object), errors="coerce"),
+        "currency": [p.get("currency") or "INR" for p in params],
+        "settlementType": [payment.get("type") for payment in payments],
+        "urn": [payment.get("urn") for payment in payments],
+        "details": orders,
+    })
+    usable = frame["orderId"].notna() & frame["amount"].notna()
+    frame = frame[usable].drop_duplicates("orderId", keep="last").reset_index(drop=True)
+    return frame, int((~usable).sum())
+
+
+def settlement_writes(frame: pd.DataFrame, transaction_id: Optional[str], now: datetime) -> List[UpdateOne]:
+    """One upsert per order, setting what reconService sets"""
+    writes = []
+    columns = ["orderId", "settlementId", "amount", "currency", "settlementType", "urn", "details"]
+    for order_id, settlement_id, amount, currency, settlement_type, urn, details in zip(
+        *(frame[column].tolist() for column in columns)
+    ):
+        fields = {
+            "transactionId": transaction_id,
+            "orderId": order_id,
+            "settlementId": settlement_id,
+            "amount": amount,
+            "currency": currency,
+            "status": "SETTLED",
+            "settlementType": settlement_type,
+            "urn": urn,
+            "timestamp": now,
+            "details": details,
+        }
+        # Mongoose leaves undefined fields out of the update
+        writes.append(UpdateOne(
+            {"orderId": order_id},
+            {"$set": {key: value for key, value in fields.items() if value is not None}},
+            upsert=True,
+        ))
+    return writes
+
+
+def confirmed_frame(transactions: Iterable[Dict]) -> pd.DataFrame:
+    """Confirmed orders as orderId, transactionId, expectedAmount, expectedCurrency"""
+    rows = []
+    for transaction in transactions:
+        order = transaction.get("confirmedOrder") or {}
+        price = (order.get("quote") or {}).get("price") or {}
+        rows.append((order.get("id"), transaction.get("transactionId"), price.get("value"), price.get("currency")))
+    frame = pd.DataFrame(rows, columns=["orderId", "transactionId", "expectedAmount", "expectedCurrency"])
+    frame["expectedAmount"] = pd.to_numeric(frame["expectedAmount"], errors="coerce")
+    return frame[frame["orderId"].notna()].drop_duplicates("orderId", keep="last")
+
+
+def reconcile_frames(settlements: pd.DataFrame, confirmed: pd.DataFrame,
+                     tolerance: float = 0.01) -> pd.DataFrame:
+    """Settlements joined with their confirmed orders, one boolean column per check"""
+    # Both sides are already unique by orderId, so the join needs no validation pass
+    joined = settlements[["orderId", "amount", "currency", "urn"]].merge(confirmed, on="orderId", how="left")
+    orphan = joined["transactionId"].isna().to_numpy()
+    amount = joined["amount"].to_numpy(dtype=np.float64)
+    expected = joined["expectedAmount"].to_numpy(dtype=np.float64)
+    # A confirmed order without a quoted price cannot be matched either
+    matches = np.isclose(amount, expected, rtol=0, atol=tolerance)
+    currency = joined["expectedCurrency"].isna() | (joined["expectedCurrency"] == joined["currency"])
+    urn = joined["urn"]
+    return joined.assign(
+        difference=amount - expected,
+        amount_mismatch=~orphan & ~(matches & currency.to_numpy()),
+        missing_utr=(urn.isna() | (urn.astype(str).str.strip() == "")).to_numpy(),
+        orphan=orphan,
+    )
+
+
+def summarize(checked: pd.DataFrame, unsettled: Optional[pd.DataFrame] = None) -> Dict:
+    matched = checked[~checked["orphan"]]
+    mismatched = checked[checked["amount_mismatch"]]
+    summary = {
+        "orders": len(checked),
+        "matched": len(matched),
+        "clean": int((~checked[CHECKS].any(axis=1)).sum()),
+        "counts": {check: int(checked[check].sum()) for check in CHECKS},
+        "settledAmount": round(float(checked["amount"].sum()), 2),
+        "expectedAmount": round(float(matched["expectedAmount"].sum()), 2),
+        "mismatchAmount": round(float(mismatched["difference"].abs().sum()), 2),
+        "samples": {
+            check: checked.loc[checked[check], "orderId"].head(SAMPLE_SIZE).tolist() for check in CHECKS
+        },
+    }
+    if unsettled is not None:
+        summary["counts"]["unsettled"] = len(unsettled)
+        summary["unsettledAmount"] = round(float(unsettled["expectedAmount"].sum()), 2)
+        summary["samples"]["unsettled"] = unsettled["orderId"].head(SAMPLE_SIZE).tolist()
+    return summary
+
+
+class SettlementRecon:
+    """Ingests orderbooks in bulk and reconciles them against confirmed transactions"""
+
+    def __init__(self, db=None, tolerance: float = 0.01):
+        self.tolerance = tolerance
+        self.orders_ingested = 0
+        self.orders_rejected = 0
+        self.reports_written = 0
+        self.flagged = {check: 0 for check in CHECKS}
+        self._tasks = set()
+        if db is not None:
+            self.bind(db)
+
+    def bind(self, db):
+        self.settlements = db[SETTLEMENT_COLLECTION]
+        self.transactions = db[TRANSACTION_COLLECTION]
+        self.reports = db[REPORT_COLLECTION]
+
+    async def ensure_indexes(self):
+        # The upsert key; without it every order of a batch scans the collection
+        await self.settlements.create_index([("orderId", ASCENDING)], name="orderId")
+        await self.transactions.create_index(
+            [("confirmedOrder.id", ASCENDING)], name="confirmedOrderId", sparse=True
+        )
+        await self.reports.create_index([("createdAt", DESCENDING)])
+
+    async def ingest(self, body: Dict) -> pd.DataFrame:
+        """Upsert an on_receiver_recon orderbook; returns the settlements written"""
+        context = body.get("context") or {}
+        orders = ((body.get("message") or {}).get("orderbook") or {}).get("orders") or []
+        frame, rejected = await asyncio.to_thread(settlement_frame, orders)
+        writes = await asyncio.to_thread(settlement_writes, frame, context.get("transaction_id"), datetime.utcnow())
+        if writes:
+            await self.settlements.bulk_write(writes, ordered=False)
+        self.orders_ingested += len(writes)
+        self.orders_rejected += rejected
+        if rejected:
+            logger.warning(f"Skipped {rejected} recon orders without an id or a numeric amount")
+        return frame
+
+    async def load_confirmed(self, order_ids: Optional[List[str]] = None) -> pd.DataFrame:
+        projection = {"_id": 0, "transactionId": 1, "confirmedOrder.id": 1, "confirmedOrder.quote.price": 1}
+        if order_ids is None:
+            queries = [{"confirmedOrder.id": {"$exists": True}}]
+        else:
+            queries = [
+                {"confirmedOrder.id": {"$in": order_ids[start:start + LOOKUP_CHUNK]}}
+                for start in range(0, len(order_ids), LOOKUP_CHUNK)
+            ]
+        transactions = []
+        for query in queries:
+            transactions.extend(await self.transactions.find(query, projection).to_list(length=None))
+        return await asyncio.to_thread(confirmed_frame, transactions)
+
+    async def load_settlements(self) -> pd.DataFrame:
+        projection = {"_id": 0, "orderId": 1, "amount": 1, "currency": 1, "urn": 1}
+        docs = await self.settlements.find({}, projection).to_list(length=None)
+        frame = pd.DataFrame(docs, columns=["orderId", "amount", "currency", "urn"])
+        frame["amount"] = pd.to_numeric(frame["amount"], errors="coerce")
+        return frame.drop_duplicates("orderId", keep="last")
+
+    async def reconcile(self, settlements: Optional[pd.DataFrame] = None,
+                        source: Optional[str] = None) -> Dict:
+        """Check a batch of settlements, or every settlement when none is given"""
+        full = settlements is None
+        if full:
+            settlements = await self.load_settlements()
+            confirmed = await self.load_confirmed()
+        else:
+            confirmed = await self.load_confirmed(settlements["orderId"].tolist())
+        checked = await asyncio.to_thread(reconcile_frames, settlements, confirmed, self.tolerance)
+        unsettled = confirmed[~confirmed["orderId"].isin(settlements["orderId"])] if full else None
+        summary = summarize(checked, unsettled)
+        for check in CHECKS:
+            self.flagged[check] += summary["counts"][check]
+        report = {
+            "_id": str(uuid.uuid4()),
+            "createdAt": datetime.utcnow(),
+            "scope": "all" if full else "batch",
+            "source": source,
+            **summary,
+        }
+        await self.reports.insert_one(report)
+        self.reports_written += 1
+        return report
+
+    async def handle(self, body: Dict) -> Dict:
+        """Ingest now, reconcile in the background; the BPP only waits for the upsert"""
+        frame = await self.ingest(body)
+        source = (body.get("context") or {}).get("transaction_id")
+        task = asyncio.create_task(self._reconcile_quietly(frame, source))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return {"orders": len(frame)}
+
+    async def _reconcile_quietly(self, frame: pd.DataFrame, source: Optional[str]):
+        try:
+            report = await self.reconcile(frame, source)
+            logger.info(f"Reconciled {report['orders']} settlements: {report['counts']}")
+        except Exception as e:
+            logger.warning(f"Settlement reconciliation failed: {e!r}")
+
+    async def latest_reports(self, limit: int) -> List[Dict]:
+        cursor = self.reports.find({}).sort("createdAt", DESCENDING).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "orders_ingested": self.orders_ingested,
+            "orders_rejected": self.orders_rejected,
+            "reports": self.reports_written,
+            "flagged": dict(self.flagged),
+        }
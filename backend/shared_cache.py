@@ -0,0 +1,250 @@
+"""Response cache entries shared by the gateway's worker processes
+
+Every worker maps the same file in a shared-memory directory (tmpfs) and the
+file is split into fixed-size slots, grouped by key hash into buckets of WAYS
+slots. Readers copy a slot without locking and discard the copy when its
+sequence number moved or its checksum does not match; writers take a
+byte-range lock on the bucket. A worker about to load a missing key from Node
+first leases its slot, so the other workers wait for that result instead of
+each loading the same key.
+
+CLOCK_MONOTONIC is system-wide on Linux, so time.monotonic() deadlines mean
+the same thing in every worker.
+"""
+import contextlib
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Dict, Iterator, Optional, Tuple
+
+from response_cache import CachedResponse
+
+logger = logging.getLogger(__name__)
+
+# Slots per bucket; a key may live in any slot of its bucket
+WAYS = 4
+
+# seq, key hash, fresh_until, stale_until, lease_until, lease pid, checksum,
+# body length, status, key length, media type length
+SLOT_HEADER = struct.Struct("<QQdddIIIHHH6x")
+
+# Reads retried while a writer is busy with the slot
+READ_ATTEMPTS = 3
+
+
+class SharedCache:
+    """Fixed-geometry table of cached responses in a memory-mapped file
+
+    Responses whose key, media type and body do not fit in one slot are not
+    shared; the worker that loaded them keeps them in its own cache.
+    """
+
+    def __init__(self, path: str, slots: int = 2048, slot_size: int = 32 * 1024):
+        self.path = path
+        self.buckets = max(1, slots // WAYS)
+        self.slot_size = slot_size
+        self.max_payload = slot_size - SLOT_HEADER.size
+        self.size = self.buckets * WAYS * slot_size
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        self._pid = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.oversize = 0
+        self.torn_reads = 0
+        self.leases = 0
+        self.lease_conflicts = 0
+
+    def open(self):
+        """Map the file, creating it on first use; call in each worker after fork"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            current = os.fstat(fd).st_size
+            if current == 0:
+                os.ftruncate(fd, self.size)
+            elif current != self.size:
+                raise ValueError(
+                    f"{self.path} is {current} bytes, expected {self.size}; "
+                    "workers must share the slot settings"
+                )
+            self._map = mmap.mmap(fd, self.size)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._pid = os.getpid()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @staticmethod
+    def _hash(key: str) -> Tuple[int, bytes]:
+        encoded = key.encode()
+        digest = int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "little")
+        # 0 marks an empty slot
+        return digest or 1, encoded
+
+    def _bucket(self, key_hash: int) -> int:
+        return (key_hash % self.buckets) * WAYS * self.slot_size
+
+    def _slots(self, bucket: int) -> Iterator[int]:
+        return range(bucket, bucket + WAYS * self.slot_size, self.slot_size)
+
+    @contextlib.contextmanager
+    def _locked(self, bucket: int):
+        length = WAYS * self.slot_size
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, length, bucket)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, length, bucket)
+
+    def _read(self, offset: int) -> Optional[Tuple[tuple, bytes]]:
+        """Consistent copy of a slot's header and payload, or None"""
+        for _ in range(READ_ATTEMPTS):
+            header = SLOT_HEADER.unpack_from(self._map, offset)
+            seq = header[0]
+            if seq & 1:
+                continue
+            length = header[9] + header[10] + header[7]
+            if length > self.max_payload:
+                continue
+            start = offset + SLOT_HEADER.size
+            payload = self._map[start:start + length]
+            if SLOT_HEADER.unpack_from(self._map, offset)[0] == seq:
+                return header, payload
+        self.torn_reads += 1
+        return None
+
+    def _write(self, offset: int, header: tuple, payload: bytes = b""):
+        """Write a slot with its sequence number odd until done; caller holds the lock"""
+        seq = SLOT_HEADER.unpack_from(self._map, offset)[0]
+        struct.pack_into("<Q", self._map, offset, seq + 1)
+        start = offset + SLOT_HEADER.size
+        self._map[start:start + len(payload)] = payload
+        SLOT_HEADER.pack_into(self._map, offset, seq + 1, *header)
+        struct.pack_into("<Q", self._map, offset, seq + 2)
+
+    def _find(self, bucket: int, key_hash: int) -> Optional[int]:
+        for offset in self._slots(bucket):
+            if SLOT_HEADER.unpack_from(self._map, offset)[1] == key_hash:
+                return offset
+        return None
+
+    def _victim(self, bucket: int, now: float) -> int:
+        """An empty slot, else the one expiring first that is not being loaded"""
+        best, best_until = None, None
+        for offset in self._slots(bucket):
+            header = SLOT_HEADER.unpack_from(self._map, offset)
+            if header[1] == 0:
+                return offset
+            until = header[3] if header[4] <= now else float("inf")
+            if best is None or until < best_until:
+                best, best_until = offset, until
+        return best
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """The shared response for key while it may still be served, or None"""
+        key_hash, encoded = self._hash(key)
+        offset = self._find(self._bucket(key_hash), key_hash)
+        read = self._read(offset) if offset is not None else None
+        if read is not None:
+            header, payload = read
+            (_, slot_hash, fresh_until, stale_until, _, _, checksum,
+             body_length, status, key_length, media_length) = header
+            if (slot_hash == key_hash and status and stale_until > time.monotonic()
+                    and payload[:key_length] == encoded and zlib.crc32(payload) == checksum):
+                media_end = key_length + media_length
+                response = CachedResponse(status, payload[media_end:], payload[key_length:media_end].decode())
+                response.fresh_until = fresh_until
+                response.stale_until = stale_until
+                self.hits += 1
+                return response
+        self.misses += 1
+        return None
+
+    def put(self, key: str, response: CachedResponse) -> bool:
+        """Share a loaded response with the other workers; ends any lease on key"""
+        key_hash, encoded = self._hash(key)
+        media = response.media_type.encode()
+        payload = encoded + media + response.body
+        if len(payload) > self.max_payload or len(encoded) > 0xFFFF or len(media) > 0xFFFF:
+            self.oversize += 1
+            return False
+        bucket = self._bucket(key_hash)
+        with self._locked(bucket):
+            offset = self._find(bucket, key_hash)
+            if offset is None:
+                offset = self._victim(bucket, time.monotonic())
+            self._write(offset, (
+                key_hash, response.fresh_until, response.stale_until, 0.0, 0,
+                zlib.crc32(payload), len(response.body), response.status_code, len(encoded), len(media),
+            ), payload)
+        self.stores += 1
+        return True
+
+    def claim(self, key: str, seconds: float) -> bool:
+        """Lease key for loading; False while another live lease holds it"""
+        key_hash, _ = self._hash(key)
+        bucket = self._bucket(key_hash)
+        now = time.monotonic()
+        with self._locked(bucket):
+            offset = self._find(bucket, key_hash)
+            if offset is None:
+                offset = self._victim(bucket, now)
+                header = (key_hash, 0.0, 0.0, now + seconds, self._pid, 0, 0, 0, 0, 0)
+            else:
+                header = SLOT_HEADER.unpack_from(self._map, offset)[1:]
+                if header[3] > now and header[4] != self._pid:
+                    self.lease_conflicts += 1
+                    return False
+                # A stale payload stays servable; only the lease changes
+                header = header[:3] + (now + seconds, self._pid) + header[5:]
+            self._write(offset, header)
+        self.leases += 1
+        return True
+
+    def release(self, key: str):
+        """Drop this worker's lease on key, if it still holds one"""
+        key_hash, _ = self._hash(key)
+        bucket = self._bucket(key_hash)
+        with self._locked(bucket):
+            offset = self._find(bucket, key_hash)
+            if offset is None:
+                return
+            header = SLOT_HEADER.unpack_from(self._map, offset)[1:]
+            if header[4] == self._pid and header[3] > 0:
+                self._write(offset, header[:3] + (0.0, 0) + header[5:])
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        entries = 0
+        if self._map is not None:
+            for offset in range(0, self.size, self.slot_size):
+                header = SLOT_HEADER.unpack_from(self._map, offset)
+                entries += bool(header[1] and header[8] and header[3] > now)
+        lookups = self.hits + self.misses
+        return {
+            "slots": self.buckets * WAYS,
+            "slot_bytes": self.slot_size,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "oversize": self.oversize,
+            "torn_reads": self.torn_reads,
+            "leases": self.leases,
+            "lease_conflicts": self.lease_conflicts,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,339 @@
+"""Surge forecaster fitted from observed quotes and commute searches
+
+Observations are (location, time, multiplier) triples: RideHistory quotes
+priced against the median quote of the same cell, provider and vehicle type,
+and CommuteLog searches with Uber's surgePercent. They are reduced to one
+hour-of-week curve per geohash cell, shrunk towards the all-cells curve where
+a cell has little data and weighted towards recent weeks. The fitted model is
+two arrays, so scoring any number of locations x horizons is a few NumPy
+gathers with linear interpolation between hours.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from price_rollups import RIDE_HISTORY_COLLECTION, geohash_encode_many
+from response_cache import geohash_encode
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_WEEK = 7 * 24
+
+# Multipliers outside this range are data errors rather than surge
+MIN_MULTIPLIER = 0.5
+MAX_MULTIPLIER = 3.0
+
+# Quotes of a cell/provider/vehicle type needed before their median is a
+# usable reference price
+MIN_REFERENCE_QUOTES = 5
+
+
+def hour_of_week(times: pd.DatetimeIndex, tz: str) -> np.ndarray:
+    """Fractional hours since local Monday 00:00"""
+    local = times.tz_convert(tz)
+    return (local.dayofweek * 24 + local.hour + local.minute / 60 + local.second / 3600).to_numpy()
+
+
+class SurgeModel:
+    """Hour-of-week surge curves, one float32 row per geohash cell
+
+    The last row is the all-cells curve, used for cells without data.
+    """
+
+    def __init__(self, cells: pd.Index, curves: np.ndarray, precision: int, tz: str,
+                 observations: int = 0, fitted_at: Optional[datetime] = None):
+        self.cells = cells
+        self.curves = curves
+        # Single-location requests skip the vectorised encode and indexer
+        self._row_of = {cell: row for row, cell in enumerate(cells)}
+        self.precision = precision
+        self.tz = tz
+        self.zone = ZoneInfo(tz)
+        self.observations = observations
+        self.fitted_at = fitted_at
+
+    @classmethod
+    def flat(cls, precision: int, tz: str) -> "SurgeModel":
+        """No surge anywhere; served until the first fit"""
+        return cls(pd.Index([]), np.ones((1, HOURS_PER_WEEK), dtype=np.float32), precision, tz)
+
+    def rows(self, lat, lng) -> np.ndarray:
+        """Curve rows for locations; None scores the all-cells curve"""
+        if lat is None or lng is None:
+            return np.array([len(self.curves) - 1])
+        if np.ndim(lat) == 0 and np.ndim(lng) == 0:
+            return np.array([self._row_of.get(geohash_encode(lat, lng, self.precision), len(self.curves) - 1)])
+        cells = geohash_encode_many(np.atleast_1d(lat), np.atleast_1d(lng), self.precision)
+        rows = self.cells.get_indexer(cells)
+        rows[rows < 0] = len(self.curves) - 1
+        return rows
+
+    def score(self, rows: np.ndarray, hours: np.ndarray) -> np.ndarray:
+        """Multipliers for rows (n,) at fractional hours of week (n, m)"""
+        hours = np.mod(hours, HOURS_PER_WEEK)
+        before = np.floor(hours).astype(np.int64)
+        after = (before + 1) % HOURS_PER_WEEK
+        fraction = hours - before
+        rows = rows[:, None]
+        return self.curves[rows, before] * (1 - fraction) + self.curves[rows, after] * fraction
+
+    def forecast(self, lat, lng, start: datetime, horizons_min) -> np.ndarray:
+        """Multipliers for each location (n,) at start + each horizon (m,)
+
+        Horizons are added in local hours, so a DST change inside the horizon
+        is not reflected; the default Asia/Kolkata has none.
+        """
+        local = start.astimezone(self.zone)
+        start_hour = local.weekday() * 24 + local.hour + local.minute / 60 + local.second / 3600
+        hours = start_hour + np.asarray(horizons_min, dtype=np.float64)[None, :] / 60
+        rows = self.rows(lat, lng)
+        return self.score(rows, np.broadcast_to(hours, (len(rows), hours.shape[1])))
+
+    def predict(self, lat, lng, times: pd.DatetimeIndex) -> np.ndarray:
+        """One multiplier per (lat, lng, time) row, as used for backtests"""
+        hours = hour_of_week(times, self.tz)
+        return self.score(self.rows(lat, lng), hours[:, None])[:, 0]
+
+    def info(self) -> Dict:
+        return {
+            "fittedAt": self.fitted_at,
+            "observations": self.observations,
+            "cells": len(self.cells),
+        }
+
+    def save(self, path: str):
+        """Write the model for other workers, replacing the previous one atomically"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                cells=np.asarray(self.cells, dtype=str),
+                curves=self.curves,
+                precision=self.precision,
+                tz=self.tz,
+                observations=self.observations,
+                fitted_at=self.fitted_at.isoformat() if self.fitted_at else "",
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SurgeModel":
+        with np.load(path, allow_pickle=False) as saved:
+            fitted_at = str(saved["fitted_at"])
+            return cls(
+                pd.Index(saved["cells"].tolist()),
+                saved["curves"],
+                int(saved["precision"]),
+                str(saved["tz"]),
+                observations=int(saved["observations"]),
+                fitted_at=datetime.fromisoformat(fitted_at) if fitted_at else None,
+            )
+
+
+def fit_surge_model(observations: pd.DataFrame, precision: int, tz: str,
+                    prior_strength: float = 5.0, half_life_days: float = 14.0,
+                    now: Optional[datetime] = None) -> SurgeModel:
+    """Fit curves from columns lat, lng, timestamp (UTC) and multiplier"""
+    now = now or datetime.now(timezone.utc)
+    if observations.empty:
+        model = SurgeModel.flat(precision, tz)
+        model.fitted_at = now
+        return model
+    timestamps = pd.DatetimeIndex(pd.to_datetime(observations["timestamp"], utc=True))
+    hours = np.floor(hour_of_week(timestamps, tz)).astype(np.int64) % HOURS_PER_WEEK
+    multipliers = np.clip(observations["multiplier"].to_numpy(dtype=np.float64), MIN_MULTIPLIER, MAX_MULTIPLIER)
+    age_days = (pd.Timestamp(now) - timestamps).total_seconds().to_numpy() / 86400
+    weights = 0.5 ** (np.maximum(age_days, 0) / half_life_days)
+
+    # All-cells curve, shrunk towards no surge
+    global_sums = np.bincount(hours, weights * multipliers, HOURS_PER_WEEK)
+    global_weights = np.bincount(hours, weights, HOURS_PER_WEEK)
+    global_curve = (global_sums + prior_strength) / (global_weights + prior_strength)
+
+    # Per-cell curves, shrunk towards the all-cells curve
+    codes, cells = pd.factorize(
+        geohash_encode_many(observations["lat"].to_numpy(), observations["lng"].to_numpy(), precision)
+    )
+    flat_index = codes * HOURS_PER_WEEK + hours
+    size = len(cells) * HOURS_PER_WEEK
+    sums = np.bincount(flat_index, weights * multipliers, size).reshape(len(cells), HOURS_PER_WEEK)
+    cell_weights = np.bincount(flat_index, weights, size).reshape(len(cells), HOURS_PER_WEEK)
+    curves = (sums + prior_strength * global_curve) / (cell_weights + prior_strength)
+
+    return SurgeModel(
+        pd.Index(cells),
+        np.vstack([curves, global_curve]).astype(np.float32),
+        precision,
+        tz,
+        observations=len(observations),
+        fitted_at=now,
+    )
+
+
+def quote_multipliers(quotes: pd.DataFrame, precision: int) -> pd.DataFrame:
+    """Price of each quote relative to the median of its cell/provider/vehicle"""
+    if quotes.empty:
+        return pd.DataFrame(columns=["lat", "lng", "timestamp", "multiplier"])
+    coordinates = np.array([location["coordinates"] for location in quotes["location"]], dtype=np.float64)
+    quotes = quotes.assign(
+        lng=coordinates[:, 0],
+        lat=coordinates[:, 1],
+        price=pd.to_numeric(quotes["price"], errors="coerce"),
+        vehicleType=quotes.get("vehicleType", pd.Series(index=quotes.index, dtype=object)).fillna(""),
+    )
+    quotes = quotes[quotes["price"] > 0]
+    quotes["cell"] = geohash_encode_many(quotes["lat"].to_numpy(), quotes["lng"].to_numpy(), precision)
+    grouped = quotes.groupby(["cell", "providerId", "vehicleType"])["price"]
+    reference = grouped.transform("median")
+    enough = grouped.transform("size") >= MIN_REFERENCE_QUOTES
+    quotes = quotes.assign(multiplier=quotes["price"] / reference)[enough]
+    return quotes[["lat", "lng", "timestamp", "multiplier"]]
+
+
+def read_commute_logs(path: str, limit: int) -> pd.DataFrame:
+    """Searches with Uber surge from the Node server's Prisma SQLite file"""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as connection:
+        logs = pd.read_sql_query(
+            "SELECT originLat AS lat, originLng AS lng, searchedAt AS timestamp, surgePercent "
+            "FROM CommuteLog WHERE surgePercent IS NOT NULL AND originLat IS NOT NULL "
+            "AND originLng IS NOT NULL ORDER BY rowid DESC LIMIT ?",
+            connection,
+            params=(limit,),
+        )
+    if logs.empty:
+        return pd.DataFrame(columns=["lat", "lng", "timestamp", "multiplier"])
+    # Prisma stores SQLite DateTime as epoch milliseconds
+    if pd.api.types.is_numeric_dtype(logs["timestamp"]):
+        logs["timestamp"] = pd.to_datetime(logs["timestamp"], unit="ms", utc=True)
+    else:
+        logs["timestamp"] = pd.to_datetime(logs["timestamp"], utc=True, format="ISO8601")
+    logs["multiplier"] = 1 + logs["surgePercent"] / 100
+    return logs[["lat", "lng", "timestamp", "multiplier"]]
+
+
+class SurgeForecaster:
+    """Keeps a SurgeModel fitted on recent data, refitting in the background
+
+    With a model_path, the process that fits (start) saves each model there
+    and the other workers load it from there (follow) instead of fitting it
+    themselves.
+    """
+
+    def __init__(self, db=None, precision: int = 5, tz: str = "Asia/Kolkata",
+                 lookback_days: float = 28.0, max_observations: int = 500000,
+                 commute_db_path: Optional[str] = None, interval: float = 900.0,
+                 model_path: Optional[str] = None, follow_interval: float = 5.0):
+        self.precision = precision
+        self.tz = tz
+        self.lookback_days = lookback_days
+        self.max_observations = max_observations
+        self.commute_db_path = commute_db_path
+        self.interval = interval
+        self.model_path = model_path
+        self.follow_interval = follow_interval
+        self.model = SurgeModel.flat(precision, tz)
+        self.refreshes = 0
+        self.loads = 0
+        self.failures = 0
+        self._model_version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._follower: Optional[asyncio.Task] = None
+        if db is not None:
+            self.bind(db)
+
+    def bind(self, db):
+        self.history = db[RIDE_HISTORY_COLLECTION]
+
+    @property
+    def ready(self) -> bool:
+        return self.model.observations > 0
+
+    async def load_observations(self, now: datetime) -> pd.DataFrame:
+        since = (now - timedelta(days=self.lookback_days)).replace(tzinfo=None)
+        cursor = self.history.find(
+            {"timestamp": {"$gte": since}},
+            {"_id": 0, "timestamp": 1, "location": 1, "providerId": 1, "vehicleType": 1, "price": 1},
+        ).sort("timestamp", -1).limit(self.max_observations)
+        quotes = pd.DataFrame(await cursor.to_list(length=self.max_observations))
+        frames = [quote_multipliers(quotes, self.precision)]
+        if self.commute_db_path:
+            logs = await asyncio.to_thread(read_commute_logs, self.commute_db_path, self.max_observations)
+            frames.append(logs[pd.to_datetime(logs["timestamp"], utc=True) >= pd.Timestamp(since, tz="UTC")])
+        frames = [frame for frame in frames if not frame.empty]
+        return pd.concat(frames, ignore_index=True) if frames else quote_multipliers(pd.DataFrame(), self.precision)
+
+    async def refresh(self) -> SurgeModel:
+        now = datetime.now(timezone.utc)
+        observations = await self.load_observations(now)
+        # Fitting is CPU-bound; keep it off the event loop
+        self.model = await asyncio.to_thread(fit_surge_model, observations, self.precision, self.tz, now=now)
+        self.refreshes += 1
+        if self.model_path:
+            await asyncio.to_thread(self.model.save, self.model_path)
+            self._model_version = os.stat(self.model_path).st_mtime_ns
+        return self.model
+
+    async def load_shared(self) -> bool:
+        """Load the model another worker saved, if it changed; True if loaded"""
+        try:
+            version = os.stat(self.model_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if version == self._model_version:
+            return False
+        self.model = await asyncio.to_thread(SurgeModel.load, self.model_path)
+        self._model_version = version
+        self.loads += 1
+        return True
+
+    async def _follow_forever(self):
+        while True:
+            try:
+                if await self.load_shared():
+                    logger.info(f"Loaded surge model fitted on {self.model.observations} observations")
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Loading the shared surge model failed: {e}")
+            await asyncio.sleep(self.follow_interval)
+
+    async def _refresh_forever(self):
+        while True:
+            try:
+                model = await self.refresh()
+                logger.info(f"Surge model fitted on {model.observations} observations, {len(model.cells)} cells")
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Surge model refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._follower is not None:
+            self._follower.cancel()
+            self._follower = None
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_forever())
+
+    def follow(self):
+        """Serve the models saved at model_path by the worker that fits them"""
+        if self._task is None and self._follower is None:
+            self._follower = asyncio.create_task(self._follow_forever())
+
+    async def stop(self):
+        for task in (self._task, self._follower):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._follower = None
+
+    def stats(self) -> Dict:
+        return {**self.model.info(), "refreshes": self.refreshes, "loads": self.loads, "failures": self.failures}
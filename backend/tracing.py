@@ -0,0 +1,549 @@
+"""Request tracing with W3C trace context
+
+A traceparent header from the client is continued, otherwise a trace is
+started here, and Node is sent a traceparent naming the gateway's span for
+each upstream attempt. Spans are kept only for sampled traces: the sampling
+decision is made once at the head, from the caller's flags or the trace id,
+and followed by every span of the trace, so the cost of tracing scales with
+the sample ratio. Finished spans are exported in batches as OTLP JSON, either
+appended to a file or posted to an OTLP/HTTP collector.
+
+ONDC callbacks arrive without the trace of the search that caused them, so
+the span context of each sampled search is remembered by transaction_id and
+added as a link to the spans of its callbacks.
+
+Whatever the sampling decision, the spans a request ends can be collected
+for it, which is how the slow request log (profiling.py) has stage timings.
+"""
+import asyncio
+import collections
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional, Union
+
+import httpx
+from pymongo import monitoring
+
+from response_cache import CachedResponse
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = "traceparent"
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+# Default for a span's parent: whatever span is active
+_ACTIVE = object()
+
+# Spans ended in this context, recorded or not, while something collects them
+_ended_spans: contextvars.ContextVar[Optional[List["Span"]]] = contextvars.ContextVar("ended_spans", default=None)
+MAX_COLLECTED_SPANS = 256
+
+
+class SpanContext:
+    """Trace id, span id and sampled flag, as carried in traceparent"""
+
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> Optional["SpanContext"]:
+        """A traceparent header's context, or None if it is missing or invalid"""
+        if not value:
+            return None
+        parts = value.strip().split("-")
+        if len(parts) < 4:
+            return None
+        version, trace_id, span_id, flags = parts[:4]
+        # Later versions may append fields, version 00 may not
+        if len(version) != 2 or version == "ff" or (version == "00" and len(parts) != 4):
+            return None
+        if len(trace_id) != 32 or len(span_id) != 16 or len(flags) != 2:
+            return None
+        try:
+            if int(trace_id, 16) == 0 or int(span_id, 16) == 0:
+                return None
+            sampled = bool(int(flags, 16) & 1)
+        except ValueError:
+            return None
+        return cls(trace_id.lower(), span_id.lower(), sampled)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+class Span:
+    """One timed operation; only spans of sampled traces are recorded"""
+
+    __slots__ = ("tracer", "name", "context", "parent_id", "kind", "start_ns", "end_ns",
+                 "attributes", "links", "error", "recording")
+
+    def __init__(self, tracer: "Tracer", name: str, context: SpanContext, parent_id: Optional[str],
+                 kind: int, start_ns: int, recording: bool):
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict = {}
+        self.links: List[tuple] = []
+        self.error: Optional[str] = None
+        self.recording = recording
+
+    def set_attribute(self, key: str, value):
+        if self.recording and value is not None:
+            self.attributes[key] = value
+
+    def add_link(self, context: SpanContext, attributes: Optional[Dict] = None):
+        if self.recording:
+            self.links.append((context, attributes or {}))
+
+    def sample(self):
+        """Record this span after all, when its trace turns out to matter
+
+        Spans started from it afterwards are sampled too; ones already
+        started are not.
+        """
+        if self.recording or self.tracer.exporter is None:
+            return
+        self.recording = True
+        self.context = SpanContext(self.context.trace_id, self.context.span_id, True)
+
+    def end(self, error: Optional[str] = None, end_ns: Optional[int] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if error is not None:
+            self.error = error
+        if self.recording:
+            self.tracer._finish(self)
+        collected = _ended_spans.get()
+        if collected is not None and len(collected) < MAX_COLLECTED_SPANS:
+            collected.append(self)
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict) -> List[Dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()]
+
+
+def otlp_payload(resource: Dict, spans: List[Span]) -> Dict:
+    """An OTLP ExportTraceServiceRequest in its JSON encoding"""
+    encoded = []
+    for span in spans:
+        item = {
+            "traceId": span.context.trace_id,
+            "spanId": span.context.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": _otlp_attributes(span.attributes),
+        }
+        if span.parent_id:
+            item["parentSpanId"] = span.parent_id
+        if span.links:
+            item["links"] = [
+                {"traceId": context.trace_id, "spanId": context.span_id, "attributes": _otlp_attributes(attributes)}
+                for context, attributes in span.links
+            ]
+        if span.error is not None:
+            item["status"] = {"code": 2, "message": span.error}
+        encoded.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes(resource)},
+        "scopeSpans": [{"scope": {"name": "hailo.gateway"}, "spans": encoded}],
+    }]}
+
+
+class FileExporter:
+    """Appends each batch as one line of OTLP JSON"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def start(self):
+        pass
+
+    async def export(self, payload: Dict):
+        line = (json.dumps(payload, separators=(",", ":")) + "\n").encode()
+        await asyncio.to_thread(self._append, line)
+
+    def _append(self, line: bytes):
+        # One write per batch, so batches of several workers do not interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    async def stop(self):
+        pass
+
+
+class OtlpHttpExporter:
+    """Posts each batch to an OTLP/HTTP collector, e.g. http://localhost:4318/v1/traces"""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=self.timeout)
+
+    async def export(self, payload: Dict):
+        response = await self._client.post(self.endpoint, json=payload)
+        response.raise_for_status()
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+Exporter = Union[FileExporter, OtlpHttpExporter]
+
+
+class Tracer:
+    """Starts spans and exports the sampled ones in batches
+
+    Traces started here are sampled when the low 56 bits of their random
+    trace id fall under sample_ratio, so every service applying the same
+    ratio to the same trace agrees; a continued trace keeps the caller's
+    decision. Without an exporter nothing is recorded, but trace context is
+    still propagated. Finished spans wait in a queue of at most max_queue,
+    beyond which they are dropped, and are sent every interval seconds in
+    batches of batch_size.
+    """
+
+    def __init__(self, service_name: str, exporter: Optional[Exporter] = None, sample_ratio: float = 0.05,
+                 max_queue: int = 10000, batch_size: int = 512, interval: float = 2.0):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.resource = {"service.name": service_name, "process.pid": os.getpid()}
+        # Appended to from pymongo's threads too; deque appends are atomic
+        self._queue: Deque[Span] = collections.deque()
+        self._task: Optional[asyncio.Task] = None
+        self.started_traces = 0
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _sampled(self, trace_id: str) -> bool:
+        return int(trace_id[18:], 16) < self.sample_ratio * (1 << 56)
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def start_span(self, name: str, parent=_ACTIVE, kind: int = INTERNAL,
+                   attributes: Optional[Dict] = None, start_ns: Optional[int] = None) -> Span:
+        """A span under parent (a Span or SpanContext), by default the active span"""
+        if parent is _ACTIVE:
+            parent = _current_span.get()
+        if isinstance(parent, Span):
+            parent = parent.context
+        if parent is None:
+            trace_id = _new_id(128)
+            sampled = self._sampled(trace_id)
+            parent_id = None
+            self.started_traces += 1
+        else:
+            trace_id, sampled, parent_id = parent.trace_id, parent.sampled, parent.span_id
+        span = Span(
+            self, name, SpanContext(trace_id, _new_id(64), sampled), parent_id, kind,
+            start_ns or time.time_ns(), sampled and self.exporter is not None,
+        )
+        if attributes and span.recording:
+            span.attributes.update(attributes)
+        return span
+
+    def activate(self, span: Span) -> contextvars.Token:
+        return _current_span.set(span)
+
+    def deactivate(self, token: contextvars.Token):
+        _current_span.reset(token)
+
+    def collect_spans(self, spans: List[Span]) -> contextvars.Token:
+        """Append spans ended from here on in this context to spans, sampled or not"""
+        return _ended_spans.set(spans)
+
+    def stop_collecting(self, token: contextvars.Token):
+        _ended_spans.reset(token)
+
+    def collecting(self) -> bool:
+        return _ended_spans.get() is not None
+
+    @contextmanager
+    def span(self, name: str, kind: int = INTERNAL, attributes: Optional[Dict] = None):
+        """Run the body in a span under the active one"""
+        span = self.start_span(name, kind=kind, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=type(e).__name__)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def _finish(self, span: Span):
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append(span)
+
+    async def start(self):
+        if self.exporter is None or self._task is not None:
+            return
+        await self.exporter.start()
+        self._task = asyncio.create_task(self._export_forever())
+
+    async def _export_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """Export everything queued so far"""
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                await self.exporter.export(otlp_payload(self.resource, batch))
+                self.exported += len(batch)
+            except Exception as e:
+                # The rest stays queued for the next interval
+                self.failed += len(batch)
+                logger.warning(f"Exporting {len(batch)} spans failed: {e!r}")
+                return
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        await self.exporter.stop()
+
+    def stats(self) -> Dict:
+        return {
+            "exporting": self.exporter is not None,
+            "sample_ratio": self.sample_ratio,
+            "traces_started": self.started_traces,
+            "queued": len(self._queue),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+class TracingMiddleware:
+    """ASGI middleware running each HTTP request in a server span
+
+    The span continues the request's traceparent, if any, and is named after
+    the matched route once the app has run.
+    """
+
+    def __init__(self, app, tracer: Tracer, route_label):
+        self.app = app
+        self.tracer = tracer
+        self.route_label = route_label
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        parent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                parent = SpanContext.parse(value.decode("latin-1"))
+                break
+        span = self.tracer.start_span(scope["method"], parent=parent, kind=SERVER)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = self.tracer.activate(span)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.tracer.deactivate(token)
+            route = self.route_label(scope)
+            span.name = f"{scope['method']} {route}"
+            # Set at the end, as the span may only have been sampled since
+            span.set_attribute("http.request.method", scope["method"])
+            span.set_attribute("url.path", scope["path"])
+            span.set_attribute("http.route", route)
+            span.set_attribute("http.response.status_code", status)
+            span.end(error=f"HTTP {status}" if status >= 500 else None)
+
+
+class HttpxTrace:
+    """httpx trace extension recording a request's transport stages as child spans
+
+    `connect` and `tls` when a new connection is opened, `first_byte` from
+    sending the request until the response headers are in, and `body` until
+    the response body has been read or closed, which for a streamed response
+    is long after the parent span has ended.
+    """
+
+    STAGES = {
+        "connect_tcp": "connect",
+        "connect_unix_socket": "connect",
+        "start_tls": "tls",
+    }
+
+    def __init__(self, tracer: Tracer, parent: Span, prefix: str):
+        self.tracer = tracer
+        self.parent = parent
+        self.prefix = prefix
+        self._open: Dict[str, Span] = {}
+
+    def _start(self, stage: str):
+        self._open[stage] = self.tracer.start_span(f"{self.prefix}.{stage}", parent=self.parent)
+
+    def _end(self, stage: str, error: Optional[str] = None):
+        span = self._open.pop(stage, None)
+        if span is not None:
+            span.end(error=error)
+
+    async def __call__(self, event: str, info: Dict):
+        step, _, phase = event.split(".", 1)[-1].rpartition(".")
+        error = type(info["exception"]).__name__ if phase == "failed" else None
+        if step in self.STAGES:
+            if phase == "started":
+                self._start(self.STAGES[step])
+            else:
+                self._end(self.STAGES[step], error)
+        elif step == "send_request_headers" and phase == "started":
+            self._start("first_byte")
+        elif step == "receive_response_headers" and phase != "started":
+            self._end("first_byte", error)
+        elif step == "receive_response_body":
+            if phase == "started":
+                self._start("body")
+            else:
+                self._end("body", error)
+        elif step == "response_closed":
+            # The client stopped reading before the end of the body
+            self._end("body")
+
+
+class MongoTraceListener(monitoring.CommandListener):
+    """A span per Mongo command issued within a sampled span, or while spans
+    are collected
+
+    pymongo calls this from Motor's worker threads, which run with a copy of
+    the calling task's context, so the active span is the caller's.
+    """
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._spans: Dict[tuple, Span] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        parent = self.tracer.current()
+        if parent is None or not (parent.recording or self.tracer.collecting()):
+            return
+        span = self.tracer.start_span(f"mongo.{event.command_name}", parent=parent, kind=CLIENT, attributes={
+            "db.system": "mongodb",
+            "db.operation.name": event.command_name,
+            "db.namespace": event.database_name,
+            "server.address": "%s:%s" % event.connection_id,
+        })
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            span.set_attribute("db.collection.name", collection)
+        with self._lock:
+            self._spans[(event.request_id, event.connection_id)] = span
+
+    def _end(self, event, error: Optional[str] = None):
+        with self._lock:
+            span = self._spans.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            span.end(error=error)
+
+    def succeeded(self, event):
+        self._end(event)
+
+    def failed(self, event):
+        self._end(event, str(event.failure.get("codeName") or event.failure.get("errmsg") or "failed"))
+
+
+class TraceLinks:
+    """Span context of the request that started each ONDC transaction
+
+    With workers, entries go to a table they all map, since a BPP's callback
+    may reach another worker than the search did; otherwise to a bounded
+    local LRU. Entries are dropped after ttl seconds.
+    """
+
+    def __init__(self, shared=None, ttl: float = 600.0, max_entries: int = 10000):
+        self.shared = shared
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local: "collections.OrderedDict[str, tuple]" = collections.OrderedDict()
+
+    def remember(self, transaction_id: str, context: SpanContext):
+        expires = time.monotonic() + self.ttl
+        if self.shared is not None:
+            entry = CachedResponse(200, context.traceparent().encode(), "text/plain")
+            entry.fresh_until = entry.stale_until = expires
+            self.shared.put(f"trace:{transaction_id}", entry)
+            return
+        self._local[transaction_id] = (context, expires)
+        self._local.move_to_end(transaction_id)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    def get(self, transaction_id: str) -> Optional[SpanContext]:
+        if self.shared is not None:
+            entry = self.shared.get(f"trace:{transaction_id}")
+            return SpanContext.parse(entry.body.decode()) if entry is not None else None
+        found = self._local.get(transaction_id)
+        if found is None or found[1] <= time.monotonic():
+            return None
+        return found[0]
@@ -0,0 +1,134 @@
+"""Pool of Node.js upstreams behind the gateway's shared HTTPX client"""
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PATH = "/api/v1/health"
+
+
+class NoHealthyUpstream(Exception):
+    """Raised when every Node.js upstream is out of rotation"""
+
+
+class Upstream:
+    """One Node.js process, reachable over TCP or a Unix domain socket"""
+
+    def __init__(self, index: int, address: str):
+        self.address = address
+        self.uds: Optional[str] = None
+        if address.startswith("unix:"):
+            # Requests are addressed to a synthetic host that the shared
+            # client routes to this socket through a mounted transport
+            self.uds = address[len("unix:"):]
+            self.base_url = f"http://node-uds-{index}"
+        else:
+            self.base_url = address.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.last_checked: Optional[float] = None
+
+    def snapshot(self) -> Dict:
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class UpstreamPool:
+    """Least-outstanding-requests balancing with active health checks"""
+
+    def __init__(self, addresses: List[str], check_interval: float = 5.0,
+                 check_timeout: float = 2.0, failure_threshold: int = 2):
+        if not addresses:
+            raise ValueError("At least one Node.js upstream is required")
+        self.upstreams = [Upstream(i, address) for i, address in enumerate(addresses)]
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.failure_threshold = failure_threshold
+        self._checker: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, value: str, **kwargs) -> "UpstreamPool":
+        """Build a pool from a comma-separated list of URLs and unix:/paths"""
+        addresses = [item.strip() for item in value.split(",") if item.strip()]
+        return cls(addresses, **kwargs)
+
+    def mounts(self) -> Dict[str, httpx.AsyncHTTPTransport]:
+        """Transports for Unix socket upstreams, for the shared client"""
+        return {
+            upstream.base_url: httpx.AsyncHTTPTransport(uds=upstream.uds)
+            for upstream in self.upstreams if upstream.uds
+        }
+
+    def acquire(self, exclude: Optional[set] = None) -> Upstream:
+        """Pick the healthy upstream with the fewest requests in flight"""
+        candidates = [
+            upstream for upstream in self.upstreams
+            if upstream.healthy and (not exclude or upstream not in exclude)
+        ]
+        if not candidates:
+            raise NoHealthyUpstream()
+        fewest = min(upstream.outstanding for upstream in candidates)
+        upstream = random.choice([u for u in candidates if u.outstanding == fewest])
+        upstream.outstanding += 1
+        return upstream
+
+    def release(self, upstream: Upstream):
+        upstream.outstanding -= 1
+
+    def mark_failed(self, upstream: Upstream):
+        """Take an upstream out of rotation until a health check passes"""
+        if upstream.healthy:
+            logger.warning(f"Node.js upstream {upstream.address} taken out of rotation")
+        upstream.healthy = False
+        upstream.consecutive_failures += 1
+
+    async def check(self, client: httpx.AsyncClient, upstream: Upstream):
+        try:
+            response = await client.get(
+                f"{upstream.base_url}{HEALTH_PATH}", timeout=self.check_timeout
+            )
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        upstream.last_checked = time.monotonic()
+        if ok:
+            if not upstream.healthy:
+                logger.info(f"Node.js upstream {upstream.address} back in rotation")
+            upstream.healthy = True
+            upstream.consecutive_failures = 0
+            return
+        upstream.consecutive_failures += 1
+        if upstream.healthy and upstream.consecutive_failures >= self.failure_threshold:
+            logger.warning(f"Node.js upstream {upstream.address} failed health checks")
+            upstream.healthy = False
+
+    async def _check_forever(self, client: httpx.AsyncClient):
+        while True:
+            await asyncio.gather(*(self.check(client, u) for u in self.upstreams))
+            await asyncio.sleep(self.check_interval)
+
+    def start(self, client: httpx.AsyncClient):
+        if self._checker is None:
+            self._checker = asyncio.create_task(self._check_forever(client))
+
+    async def stop(self):
+        if self._checker is not None:
+            self._checker.cancel()
+            try:
+                await self._checker
+            except asyncio.CancelledError:
+                pass
+            self._checker = None
+
+    def snapshot(self) -> List[Dict]:
+        return [upstream.snapshot() for upstream in self.upstreams]
@@ -0,0 +1,614 @@
+"""Per-user insights aggregates, maintained incrementally
+
+Node's insights routes load every completed Ride of a user and rebuild totals,
+hour histograms and route counts in JS on each request. UserInsights folds each
+completed ride and each logged commute search once into a per-user document of
+running totals, route counters, the last rides Node's recommendations look at
+and an hour-of-week histogram of searches. A read is then one document lookup,
+and the hottest users' documents stay in memory. Hours are the process's local
+time, as getHours() is in Node.
+
+Rides arrive through a change stream on the rides collection, after a one-off
+scan of existing rides, or by polling completedTime on a standalone server
+without change streams. Each ride ID is claimed in an applied-rides collection
+before it is folded in, so replays from the stream, the scan or the poll never
+count a ride twice. Commute searches live in Node's Prisma SQLite file and are
+read past a rowid watermark.
+"""
+import asyncio
+import collections
+import hashlib
+import logging
+import math
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+
+from price_rollups import STATE_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+RIDES_COLLECTION = "rides"
+USERS_COLLECTION = "users"
+AGGREGATE_COLLECTION = "user_insights"
+APPLIED_COLLECTION = "user_insight_rides"
+STATE_ID = "user_insights"
+# Node's recommendations look at a user's 50 most recently completed rides
+RECENT_RIDES = 50
+
+DUPLICATE_KEY = 11000
+# Change streams need a replica set
+CHANGE_STREAMS_UNSUPPORTED = 40573
+# The resume token fell off the oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+
+RIDE_PROJECTION = {
+    "_id": 1, "userId": 1, "type": 1, "from": 1, "to": 1, "scheduledTime": 1,
+    "completedTime": 1, "createdAt": 1, "price": 1, "distance": 1, "savedAmount": 1,
+}
+
+
+def number(value) -> float:
+    """Ride fields are optional in Node's schema; treat missing as 0"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return value if math.isfinite(value) else 0.0
+
+
+def route_key(origin: str, destination: str) -> str:
+    """Field-name-safe key for a route; labels may contain dots or dollars"""
+    return hashlib.sha1(f"{origin}\x00{destination}".encode()).hexdigest()[:16]
+
+
+def place_label(place: Optional[Dict]) -> str:
+    place = place or {}
+    return place.get("label") or place.get("address") or ""
+
+
+def js_round(value: float) -> int:
+    """Math.round: halves round towards positive infinity"""
+    # Not floor(value + 0.5): that addition itself rounds up just below a half
+    floor = math.floor(value)
+    return floor + (value - floor >= 0.5)
+
+
+def read_commute_logs_after(path: str, rowid: int, limit: int) -> List[Dict]:
+    """Commute searches logged after rowid, with their saved-location labels"""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as connection:
+        connection.row_factory = sqlite3.Row
+        rows = connection.execute(
+            "SELECT c.rowid AS rowid, c.userId, c.searchedAt, c.uberEstimateMin, "
+            "c.originLat, c.originLng, c.destLat, c.destLng, "
+            "o.id AS originId, o.label AS originLabel, o.address AS originAddress, "
+            "o.latitude AS originLatitude, o.longitude AS originLongitude, "
+            "d.id AS destId, d.label AS destLabel, d.address AS destAddress, "
+            "d.latitude AS destLatitude, d.longitude AS destLongitude "
+            "FROM CommuteLog c "
+            "LEFT JOIN Location o ON o.id = c.originLocationId "
+            "LEFT JOIN Location d ON d.id = c.destLocationId "
+            "WHERE c.rowid > ? ORDER BY c.rowid LIMIT ?",
+            (rowid, limit),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+
+def parse_searched_at(value) -> Optional[datetime]:
+    """Prisma stores SQLite DateTime as epoch milliseconds"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def coordinate_label(lat, lng) -> str:
+    if lat is None or lng is None:
+        return ""
+    return f"{lat:.3f},{lng:.3f}"
+
+
+def search_place(log: Dict, prefix: str, lat, lng) -> Dict:
+    """The saved Location a search was made from or to, else its coordinates"""
+    if log.get(f"{prefix}Id") is not None:
+        return {
+            "id": log[f"{prefix}Id"],
+            "label": log.get(f"{prefix}Label"),
+            "address": log.get(f"{prefix}Address"),
+            "latitude": log.get(f"{prefix}Latitude"),
+            "longitude": log.get(f"{prefix}Longitude"),
+        }
+    return {"label": coordinate_label(lat, lng), "latitude": lat, "longitude": lng}
+
+
+class UserInsights:
+    """Per-user aggregates of completed rides and commute searches"""
+
+    def __init__(self, db=None, tz: Optional[str] = None, commute_db_path: Optional[str] = None,
+                 hot_size: int = 10000, hot_ttl: float = 30.0, batch_size: int = 1000,
+                 poll_interval: float = 5.0, poll_overlap: float = 300.0):
+        # None is the process's local time zone
+        self.zone = ZoneInfo(tz) if tz else None
+        self.commute_db_path = commute_db_path
+        self.hot_size = hot_size
+        # Bounds how stale a hot entry is when another process applied the update
+        self.hot_ttl = hot_ttl
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.poll_overlap = poll_overlap
+        self.ready = False
+        self._hot: "collections.OrderedDict[str, Tuple[float, Optional[Dict], Optional[Dict]]]" = collections.OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+        self._follower: Optional[asyncio.Task] = None
+        self.rides_applied = 0
+        self.searches_applied = 0
+        self.hits = 0
+        self.misses = 0
+        if db is not None:
+            self.bind(db)
+
+    def bind(self, db):
+        self.db = db
+        self.rides = db[RIDES_COLLECTION]
+        self.users = db[USERS_COLLECTION]
+        self.aggregates = db[AGGREGATE_COLLECTION]
+        self.applied = db[APPLIED_COLLECTION]
+        self.state = db[STATE_COLLECTION]
+
+    # Folding rides in
+
+    def local_time(self, when: datetime) -> datetime:
+        # pymongo returns naive UTC datetimes
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return when.astimezone(self.zone)
+
+    def hour_of_week(self, when: datetime) -> int:
+        local = self.local_time(when)
+        return local.weekday() * 24 + local.hour
+
+    def _ride_update(self, ride: Dict) -> UpdateOne:
+        price = number(ride.get("price"))
+        saved = number(ride.get("savedAmount"))
+        origin, destination = place_label(ride.get("from")), place_label(ride.get("to"))
+        route = route_key(origin, destination)
+        increments = {
+            "rides.count": 1,
+            "rides.distance": number(ride.get("distance")),
+            "rides.spent": price,
+            "rides.saved": saved,
+            f"routes.{route}.rides": 1,
+            f"routes.{route}.saved": saved,
+        }
+        # Node's recommendations bucket rides by their scheduled hour; rides
+        # without one are kept so they still push older rides out
+        scheduled = ride.get("scheduledTime")
+        recent = {
+            "completedTime": ride.get("completedTime"),
+            "hour": self.local_time(scheduled).hour if isinstance(scheduled, datetime) else None,
+            "price": price,
+        }
+        return UpdateOne(
+            {"_id": str(ride["userId"])},
+            {
+                "$inc": increments,
+                "$set": {
+                    f"routes.{route}.from": origin,
+                    f"routes.{route}.to": destination,
+                    "updatedAt": datetime.utcnow(),
+                },
+                "$push": {"recentRides": {
+                    "$each": [recent], "$sort": {"completedTime": -1}, "$slice": RECENT_RIDES,
+                }},
+            },
+            upsert=True,
+        )
+
+    async def _claim(self, ride_ids: List) -> Set:
+        """Ride IDs not folded in before; claiming them marks them folded"""
+        try:
+            await self.applied.insert_many([{"_id": ride_id} for ride_id in ride_ids], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            return set(ride_ids) - {ride_ids[error["index"]] for error in errors}
+        return set(ride_ids)
+
+    async def apply_rides(self, rides: Iterable[Dict]) -> int:
+        """Fold completed rides in once each; returns how many were new"""
+        completed = {
+            ride["_id"]: ride for ride in rides
+            if ride.get("type") == "COMPLETED" and ride.get("userId") is not None
+        }
+        if not completed:
+            return 0
+        fresh = await self._claim(list(completed))
+        # A crash between the claim and this write loses these rides rather
+        # than counting them twice
+        updates = [self._ride_update(completed[ride_id]) for ride_id in fresh]
+        if updates:
+            await self.aggregates.bulk_write(updates, ordered=False)
+        for ride_id in fresh:
+            self._hot.pop(str(completed[ride_id]["userId"]), None)
+        self.rides_applied += len(updates)
+        return len(updates)
+
+    async def backfill(self, query: Optional[Dict] = None) -> int:
+        """Fold in every completed ride matching query"""
+        applied = 0
+        batch = []
+        cursor = self.rides.find({"type": "COMPLETED", **(query or {})}, RIDE_PROJECTION)
+        async for ride in cursor.batch_size(self.batch_size):
+            batch.append(ride)
+            if len(batch) >= self.batch_size:
+                applied += await self.apply_rides(batch)
+                batch = []
+        if batch:
+            applied += await self.apply_rides(batch)
+        return applied
+
+    async def _operation_time(self):
+        """Cluster time to start the change stream from, None when standalone"""
+        reply = await self.db.command("ping")
+        return reply.get("operationTime")
+
+    async def _watch_rides(self, resume_token, start_at):
+        pipeline = [{"$match": {
+            "operationType": {"$in": ["insert", "update", "replace"]},
+            "fullDocument.type": "COMPLETED",
+        }}]
+        async with self.rides.watch(
+            pipeline, full_document="updateLookup", resume_after=resume_token,
+            start_at_operation_time=None if resume_token else start_at,
+        ) as stream:
+            while True:
+                change = await stream.next()
+                batch = [change["fullDocument"]]
+                # Drain whatever else has already arrived into the same batch
+                while len(batch) < self.batch_size:
+                    change = await stream.try_next()
+                    if change is None:
+                        break
+                    batch.append(change["fullDocument"])
+                await self.apply_rides([ride for ride in batch if ride])
+                await self.state.update_one(
+                    {"_id": STATE_ID}, {"$set": {"resumeToken": stream.resume_token}}, upsert=True
+                )
+
+    async def _poll_rides(self, since: datetime):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            started = datetime.utcnow()
+            # Overlapping windows are safe: claimed rides are skipped
+            await self.backfill({"completedTime": {"$gte": since - timedelta(seconds=self.poll_overlap)}})
+            since = started
+
+    async def _follow_rides(self):
+        state = await self.state.find_one({"_id": STATE_ID}) or {}
+        resume_token = state.get("resumeToken")
+        while True:
+            start_at = None
+            started = datetime.utcnow()
+            if resume_token is None:
+                start_at = await self._operation_time()
+                applied = await self.backfill()
+                logger.info(f"User insights backfilled {applied} rides")
+            if not self.ready:
+                # Tells workers that only read (follow_leader) the aggregates are complete
+                await self.state.update_one(
+                    {"_id": STATE_ID}, {"$set": {"readyAt": datetime.utcnow()}}, upsert=True
+                )
+            self.ready = True
+            try:
+                await self._watch_rides(resume_token, start_at)
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("Change streams unavailable; polling rides for user insights")
+                    await self._poll_rides(started)
+                elif e.code == CHANGE_STREAM_HISTORY_LOST:
+                    logger.warning("User insights fell behind the oplog; rescanning rides")
+                    resume_token = None
+                else:
+                    raise
+
+    # Folding commute searches in
+
+    def _search_update(self, log: Dict) -> UpdateOne:
+        estimate = number(log.get("uberEstimateMin"))
+        origin = search_place(log, "origin", log.get("originLat"), log.get("originLng"))
+        destination = search_place(log, "dest", log.get("destLat"), log.get("destLng"))
+        route = route_key(origin["label"] or "", destination["label"] or "")
+        increments = {
+            "searches.count": 1,
+            "searches.estimate": estimate,
+            f"searchRoutes.{route}.count": 1,
+            f"searchRoutes.{route}.estimate": estimate,
+        }
+        searched_at = parse_searched_at(log.get("searchedAt"))
+        if searched_at is not None:
+            increments[f"searchHours.{self.hour_of_week(searched_at)}"] = 1
+        return UpdateOne(
+            {"_id": str(log["userId"])},
+            {
+                "$inc": increments,
+                "$set": {
+                    f"searchRoutes.{route}.origin": origin,
+                    f"searchRoutes.{route}.destination": destination,
+                    "updatedAt": datetime.utcnow(),
+                },
+            },
+            upsert=True,
+        )
+
+    async def apply_commute_logs(self) -> int:
+        state = await self.state.find_one({"_id": STATE_ID}) or {}
+        rowid = state.get("commuteRowid", 0)
+        logs = await asyncio.to_thread(read_commute_logs_after, self.commute_db_path, rowid, self.batch_size)
+        if not logs:
+            return 0
+        await self.aggregates.bulk_write([self._search_update(log) for log in logs], ordered=False)
+        # Saved after the aggregates: a crash in between replays this batch
+        await self.state.update_one(
+            {"_id": STATE_ID}, {"$set": {"commuteRowid": logs[-1]["rowid"]}}, upsert=True
+        )
+        for log in logs:
+            self._hot.pop(str(log["userId"]), None)
+        self.searches_applied += len(logs)
+        return len(logs)
+
+    async def _follow_commute_logs(self):
+        while True:
+            try:
+                if await self.apply_commute_logs() == self.batch_size:
+                    continue
+            except Exception as e:
+                logger.warning(f"User insights commute log update failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _run_forever(self, follow, name: str):
+        delay = self.poll_interval
+        while True:
+            try:
+                await follow()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"User insights {name} failed: {e}; retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 300.0)
+
+    # Reads
+
+    async def _load(self, user_id: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+        object_id = ObjectId(user_id)
+        aggregate, user = await asyncio.gather(
+            self.aggregates.find_one({"_id": user_id}),
+            self.users.find_one({"_id": object_id}, {"timeSaved": 1, "rating": 1}),
+        )
+        return aggregate, user
+
+    async def get(self, user_id: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+        """The user's aggregate and profile; raises InvalidId for non-Mongo IDs"""
+        now = time.monotonic()
+        entry = self._hot.get(user_id)
+        if entry is not None and entry[0] > now:
+            self._hot.move_to_end(user_id)
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        aggregate, user = await self._load(user_id)
+        self._hot[user_id] = (now + self.hot_ttl, aggregate, user)
+        self._hot.move_to_end(user_id)
+        while len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+        return aggregate, user
+
+    async def _await_leader(self):
+        while not self.ready:
+            try:
+                state = await self.state.find_one({"_id": STATE_ID}, {"readyAt": 1}) or {}
+                self.ready = "readyAt" in state
+            except PyMongoError as e:
+                logger.warning(f"User insights readiness check failed: {e}")
+            if not self.ready:
+                await asyncio.sleep(self.poll_interval)
+
+    def follow_leader(self):
+        """Serve reads once the process that folds updates in (start) has caught up"""
+        if not self._tasks and self._follower is None:
+            self._follower = asyncio.create_task(self._await_leader())
+
+    def start(self):
+        if self._follower is not None:
+            self._follower.cancel()
+            self._follower = None
+        if not self._tasks:
+            self._tasks.append(asyncio.create_task(self._run_forever(self._follow_rides, "ride stream")))
+            if self.commute_db_path:
+                self._tasks.append(asyncio.create_task(
+                    self._run_forever(self._follow_commute_logs, "commute log reader")
+                ))
+
+    async def stop(self):
+        if self._follower is not None:
+            self._tasks.append(self._follower)
+            self._follower = None
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "rides_applied": self.rides_applied,
+            "searches_applied": self.searches_applied,
+            "hot_entries": len(self._hot),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Node's insights responses, rendered from an aggregate
+
+def insights_summary(aggregate: Optional[Dict], user: Dict) -> Dict:
+    """GET /api/v1/insights/summary"""
+    rides = (aggregate or {}).get("rides", {})
+    total_rides = rides.get("count", 0)
+    total_spent = rides.get("spent", 0.0)
+    total_saved = rides.get("saved", 0.0)
+    routes = sorted(
+        (aggregate or {}).get("routes", {}).values(), key=lambda route: route["rides"], reverse=True
+    )[:3]
+    return {
+        "stats": {
+            "totalRides": total_rides,
+            "totalDistance": js_round(rides.get("distance", 0.0) * 10) / 10,
+            "totalSaved": js_round(total_saved),
+            "totalSpent": js_round(total_spent),
+            "avgPricePerRide": js_round(total_spent / total_rides) if total_rides else 0,
+            "timeSaved": user.get("timeSaved"),
+            "rating": user.get("rating") or 4.9,
+        },
+        "savingsBreakdown": [
+            {
+                "id": "surge",
+                "title": "Surge Timing",
+                "subtitle": f"Avoided {math.floor(total_rides * 0.3)} peak surge periods",
+                "amount": math.floor(total_saved * 0.68),
+                "icon": "flash",
+                "iconColor": "#F97316",
+                "iconBg": "#FED7AA",
+            },
+            {
+                "id": "weather",
+                "title": "Weather Predictions",
+                "subtitle": f"Pre-booked before {math.floor(total_rides * 0.1)} rain events",
+                "amount": math.floor(total_saved * 0.14),
+                "icon": "cloudy",
+                "iconColor": "#3B82F6",
+                "iconBg": "#DBEAFE",
+            },
+            {
+                "id": "traffic",
+                "title": "Traffic Optimization",
+                "subtitle": f"Optimal route timing {math.floor(total_rides * 0.4)} times",
+                "amount": math.floor(total_saved * 0.18),
+                "icon": "stats-chart",
+                "iconColor": "#8B5CF6",
+                "iconBg": "#EDE9FE",
+            },
+        ],
+        "topRoutes": [
+            {"id": index + 1, "from": route.get("from"), "to": route.get("to"),
+             "rides": route["rides"], "saved": route.get("saved", 0)}
+            for index, route in enumerate(routes)
+        ],
+    }
+
+
+def insights_recommendations(aggregate: Optional[Dict]) -> List[Dict]:
+    """GET /api/v1/insights/recommendations"""
+    by_hour: Dict[int, List[float]] = {}
+    for ride in (aggregate or {}).get("recentRides", []):
+        if ride.get("hour") is None:
+            continue
+        totals = by_hour.setdefault(ride["hour"], [0, 0.0])
+        totals[0] += 1
+        totals[1] += ride.get("price", 0.0)
+    # Ties go to the earlier hour, as with Node's stable sort over hour keys
+    hours = sorted(
+        ((hour, price / count) for hour, (count, price) in sorted(by_hour.items())),
+        key=lambda item: item[1],
+    )
+    cheapest_hour = hours[0][0] if hours else 9
+    peak_hour = hours[-1][0] if hours else 18
+    return [
+        {
+            "id": 1,
+            "type": "timing",
+            "title": "Best Booking Time",
+            "description": f"Your cheapest rides are usually around {cheapest_hour}:00. Consider adjusting your schedule.",
+            "icon": "time",
+            "priority": "high",
+        },
+        {
+            "id": 2,
+            "type": "surge",
+            "title": "Avoid Peak Hours",
+            "description": f"Book rides after {peak_hour}:00 to save an average of 15-20%. Your peak hour rides cost 18% more.",
+            "icon": "flash",
+            "priority": "high",
+        },
+        {
+            "id": 3,
+            "type": "schedule",
+            "title": "Schedule in Advance",
+            "description": "Pre-booking rides helps you avoid surge pricing during rush hours and rain.",
+            "icon": "calendar",
+            "priority": "medium",
+        },
+    ]
+
+
+def surge_multiplier(hour: int) -> float:
+    """Node's simplified surge by hour of day"""
+    if 8 <= hour < 10:
+        return 1.3
+    if 17 <= hour < 20:
+        return 1.4
+    if 12 <= hour < 14:
+        return 1.1
+    return 1.0
+
+
+def smart_recommendation(aggregate: Optional[Dict], current_hour: int) -> Dict:
+    """GET /api/v1/recommendations/smart
+
+    The user's most searched route and most usual search hour, counted over
+    every logged search rather than Node's last 30 days.
+    """
+    routes = (aggregate or {}).get("searchRoutes", {})
+    if not routes:
+        return {"hasRecommendation": False, "message": "Not enough data for smart recommendations yet"}
+    by_hour: Dict[int, int] = collections.Counter()
+    for hour_of_week, count in (aggregate or {}).get("searchHours", {}).items():
+        by_hour[int(hour_of_week) % 24] += count
+    if not by_hour:
+        return {"hasRecommendation": False, "message": "Not enough data"}
+    route = max(routes.values(), key=lambda route: route.get("count", 0))
+    usual_hour = max(sorted(by_hour), key=lambda hour: by_hour[hour])
+    avg_price = route.get("estimate", 0.0) / route["count"] if route.get("count") else 0.0
+    current_surge = surge_multiplier(current_hour)
+    savings_percent = js_round((current_surge - surge_multiplier(usual_hour)) / current_surge * 100)
+    if 17 <= current_hour < 20:
+        advice = f"Wait 15 mins for no surge. Uber Go is cheapest via Uber at ₹{js_round(avg_price * 0.9)}"
+    elif 8 <= current_hour < 10:
+        advice = f"Morning rush hour. Consider leaving at {usual_hour}:30 AM to save {savings_percent}%"
+    else:
+        advice = f"Good time to book! Prices are {savings_percent}% lower than peak hours"
+    return {
+        "hasRecommendation": True,
+        "destination": route.get("destination"),
+        "subtext": f"Your usual {usual_hour}:30 {'AM' if current_hour < 12 else 'PM'} ride",
+        "savingsPercent": max(0, savings_percent),
+        "estimatedPrice": js_round(avg_price),
+        "advice": advice,
+        "origin": route.get("origin"),
+    }
@@ -0,0 +1,129 @@
+"""Write-behind batching of Mongo inserts"""
+import asyncio
+import logging
+from typing import List, Optional
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Duplicate key: the document landed in an earlier, partially failed attempt
+DUPLICATE_KEY = 11000
+
+
+class WriteQueueFull(Exception):
+    """Raised when the queue stays full past the enqueue wait"""
+
+
+class WriteBehindQueue:
+    """Bounded in-process queue flushed with insert_many(ordered=False)
+
+    A batch is written once it reaches max_batch documents or once the
+    oldest queued document has waited flush_interval seconds. Callers wait
+    up to enqueue_timeout for space before WriteQueueFull is raised.
+    """
+
+    def __init__(self, max_batch: int = 500, flush_interval: float = 0.05,
+                 max_queue: int = 10000, enqueue_timeout: float = 0.1,
+                 max_retries: int = 3):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._batch_full = asyncio.Event()
+        self._collection = None
+        self._worker: Optional[asyncio.Task] = None
+        # Documents taken off the queue but not yet known to be written
+        self._batch: List[dict] = []
+        self.flushed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def start(self, collection):
+        self._collection = collection
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def put(self, doc: dict):
+        try:
+            if self.enqueue_timeout > 0:
+                await asyncio.wait_for(self._queue.put(doc), self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(doc)
+        except (asyncio.TimeoutError, asyncio.QueueFull):
+            self.rejected += 1
+            raise WriteQueueFull()
+        if self._queue.qsize() + 1 >= self.max_batch:
+            self._batch_full.set()
+
+    async def _run(self):
+        while True:
+            batch = self._batch = [await self._queue.get()]
+            if self._queue.qsize() + 1 < self.max_batch:
+                # asyncio.wait rather than wait_for, which can swallow the
+                # cancellation stop() relies on
+                self._batch_full.clear()
+                waiter = asyncio.ensure_future(self._batch_full.wait())
+                try:
+                    await asyncio.wait({waiter}, timeout=self.flush_interval)
+                finally:
+                    waiter.cancel()
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+            self._batch = []
+
+    async def _flush(self, batch: List[dict]):
+        # insert_many assigns each document's _id on the first attempt, so a
+        # retry after a partial write only hits duplicate keys for those
+        rejected = 0
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._collection.insert_many(batch, ordered=False)
+                break
+            except BulkWriteError as e:
+                errors = [err for err in e.details.get("writeErrors", [])
+                          if err.get("code") != DUPLICATE_KEY]
+                if errors:
+                    # Retrying cannot fix document-level errors
+                    rejected = len(errors)
+                    logger.error(f"Write-behind insert rejected {rejected} documents: {errors[0].get('errmsg')}")
+                break
+            except PyMongoError as e:
+                if attempt == self.max_retries:
+                    self.dropped += len(batch)
+                    logger.error(f"Write-behind flush of {len(batch)} documents failed: {e}")
+                    return
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        self.dropped += rejected
+        self.flushed += len(batch) - rejected
+        self.batches += 1
+
+    async def stop(self):
+        """Stop the worker and flush everything still queued"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._batch:
+            await self._flush(self._batch)
+            self._batch = []
+        while not self._queue.empty():
+            batch = []
+            while not self._queue.empty() and len(batch) < self.max_batch:
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+        }
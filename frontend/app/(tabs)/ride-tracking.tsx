@@ -57,45 +57,59 @@ export default function RideTrackingScreen() {
     };
   }, []);
 
+  const transactionId = activeRide ? activeRide.transactionId || activeRide.id : null; // Fallback
+
+  // Keyed on the transaction rather than the ride, which every status update replaces
   useEffect(() => {
-    if (activeRide && socket) {
-      const transactionId = activeRide.transactionId || activeRide.id; // Fallback
-
-      console.log('Listening for updates on:', `status_update_${transactionId}`);
-
-      socket.on(`status_update_${transactionId}`, (data: any) => {
-        console.log('Received Status Update:', data);
-
-        // Navigate to Analytics if completed
-        if (data.state === 'COMPLETED') {
-          console.log('Ride Completed! Navigating to Analytics...');
-          // Add a small delay for user to see "Completed" state if desired, or go immediately
-          setTimeout(() => {
-            router.replace({
-              pathname: '/ride-analytics',
-              params: { transactionId }
-            });
-          }, 1000);
-          return;
+    if (!transactionId || !socket) return;
+
+    const event = `status_update_${transactionId}`;
+    console.log('Listening for updates on:', event);
+
+    // Updates are only sent to sockets subscribed to the transaction
+    const subscribe = () => socket.emit('subscribe', transactionId);
+    subscribe();
+    socket.on('connect', subscribe);
+
+    const onStatusUpdate = (data: any) => {
+      console.log('Received Status Update:', data);
+
+      // Navigate to Analytics if completed
+      if (data.state === 'COMPLETED') {
+        console.log('Ride Completed! Navigating to Analytics...');
+        // Add a small delay for user to see "Completed" state if desired, or go immediately
+        setTimeout(() => {
+          router.replace({
+            pathname: '/ride-analytics',
+            params: { transactionId }
+          });
+        }, 1000);
+        return;
+      }
+
+      setActiveRide((prev: any) => {
+        // Update status
+        const updated = { ...prev };
+        if (data.state) updated.status = data.state;
+
+        // Update driver location (if available)
+        if (data.location) {
+          updated.driverLocation = data.location;
         }
-
-        setActiveRide((prev: any) => {
-          // Update status
-          const updated = { ...prev };
-          if (data.state) updated.status = data.state;
-
-          // Update driver location (if available)
-          if (data.location) {
-            updated.driverLocation = data.location;
-          }
-          return updated;
-        });
+        return updated;
       });
+    };
+    socket.on(event, onStatusUpdate);
 
-      // Also trigger a status check immediately
-      statusCheck(transactionId);
-    }
-  }, [activeRide, socket]);
+    // Also trigger a status check immediately
+    statusCheck(transactionId);
+
+    return () => {
+      socket.off('connect', subscribe);
+      socket.off(event, onStatusUpdate);
+      socket.emit('unsubscribe', transactionId);
+    };
+  }, [transactionId, socket]);
 
   const statusCheck = async (transactionId: string) => {
     try {
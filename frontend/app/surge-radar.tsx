@@ -124,6 +124,9 @@ export default function SurgeRadarScreen() {
 
       socketRef.current.on('connect', () => {
         console.log('Connected to WebSocket for ONDC updates');
+        // Updates are only sent to sockets subscribed to the transaction,
+        // and subscriptions do not survive a reconnect
+        socketRef.current.emit('subscribe', transactionId);
       });
 
       // Search Updates
@@ -139,6 +142,14 @@ export default function SurgeRadarScreen() {
         setOndcLoading(false);
       });
 
+      // AI insights arrive after their quotes
+      socketRef.current.on(`insight_update_${transactionId}`, (insights: any[]) => {
+        setOndcQuotes(prev => prev.map(q => {
+          const update = insights.find(i => i.id === q.id && i.bppId === q.bppId);
+          return update ? { ...q, tags: [...(q.tags || []), update.tag] } : q;
+        }));
+      });
+
       // Select Updates (Detailed Quote)
       socketRef.current.on(`select_update_${transactionId}`, (quote: any) => {
         console.log('Received Select Quote:', quote);
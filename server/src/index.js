@@ -17,7 +17,11 @@ import recommendationsRoutes from './routes/recommendations.js';
 import ondcRoutes from './routes/ondc.js';
 import igmRoutes from './routes/igm.js';
 import devRoutes from './routes/dev.js';
+import eventRoutes from './routes/events.js';
 import { ondcService } from './services/ondcService.js';
+import { uberEstimateCache } from './services/uberEstimateCache.js';
+import { insightQueue } from './services/insightQueue.js';
+import { roomFor } from './services/transactionEvents.js';
 
 dotenv.config();
 
@@ -35,6 +39,13 @@ ondcService.setSocketIo(io);
 
 io.on('connection', (socket) => {
   console.log('User connected:', socket.id);
+  // Transaction updates are delivered only to sockets that subscribed
+  socket.on('subscribe', (transactionId) => {
+    if (typeof transactionId === 'string') socket.join(roomFor(transactionId));
+  });
+  socket.on('unsubscribe', (transactionId) => {
+    if (typeof transactionId === 'string') socket.leave(roomFor(transactionId));
+  });
   socket.on('disconnect', () => {
     console.log('User disconnected:', socket.id);
   });
@@ -57,6 +68,8 @@ app.get('/api/v1/health', (req, res) => {
     app: process.env.APP_NAME || 'HailO',
     version: process.env.APP_VERSION || '1.0.0',
     uberMode: process.env.UBER_MOCK === 'true' ? 'MOCK' : 'REAL',
+    uberEstimateCache: uberEstimateCache.stats(),
+    insightQueue: insightQueue.stats(),
     database: 'MongoDB',
     firebaseAuth: 'enabled'
   });
@@ -76,6 +89,7 @@ app.use('/api/v1/recommendations', recommendationsRoutes);
 app.use('/api/v1/igm', igmRoutes);
 app.use('/api/dev', devRoutes);
 app.use('/ondc', ondcRoutes); // Mount at root matching Subscriber URL path
+app.use('/internal/events', eventRoutes); // Event feed for the Python gateway
 
 // Error handling
 app.use((err, req, res, next) => {
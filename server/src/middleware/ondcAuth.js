@@ -6,6 +6,12 @@ import { becknAuthService } from '../services/becknAuth.js';
  */
 export const verifyOndcSignature = async (req, res, next) => {
     try {
+        // The Python gateway already verified the signature over the raw body
+        const gatewayToken = process.env.ONDC_GATEWAY_TOKEN;
+        if (gatewayToken && req.headers['x-beckn-verified'] === gatewayToken) {
+            return next();
+        }
+
         const authHeader = req.headers['authorization'];
 
         if (!authHeader) {
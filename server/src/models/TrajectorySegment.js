@@ -0,0 +1,27 @@
+import mongoose from 'mongoose';
+
+/**
+ * A fixed-size, append-only chunk of a ride's breadcrumbs.
+ * Points are integers (epoch ms, degrees x 1e5) stored as deltas from the
+ * previous point; a segment's first delta is from zero, so it decodes alone.
+ * Only the newest segment of a ride is open for appends.
+ */
+const trajectorySegmentSchema = new mongoose.Schema({
+    transactionId: { type: String, required: true },
+    seq: { type: Number, required: true },
+    open: { type: Boolean, default: true },
+    count: { type: Number, default: 0 },
+    firstT: { type: Number },
+    // Last point, absolute, for the next delta
+    lastT: { type: Number, default: 0 },
+    lastLat: { type: Number, default: 0 },
+    lastLng: { type: Number, default: 0 },
+    dt: { type: [Number], default: [] },
+    dlat: { type: [Number], default: [] },
+    dlng: { type: [Number], default: [] }
+}, { versionKey: false });
+
+trajectorySegmentSchema.index({ transactionId: 1, seq: 1 }, { unique: true });
+
+const TrajectorySegment = mongoose.model('TrajectorySegment', trajectorySegmentSchema);
+export default TrajectorySegment;
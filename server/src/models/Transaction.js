@@ -34,12 +34,8 @@ const transactionSchema = new mongoose.Schema({
         longitude: Number,
         heading: Number,
         updatedAt: Date
-    },
-    rideHistory: [{ // Breadcrumbs for map
-        latitude: Number,
-        longitude: Number,
-        timestamp: Date
-    }]
+    }
+    // Breadcrumbs for the map live in TrajectorySegment, keeping this document small
 }, { timestamps: true });
 
 // transactionSchema.pre('save', function (next) {
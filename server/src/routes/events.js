@@ -0,0 +1,45 @@
+import crypto from 'crypto';
+import express from 'express';
+import { transactionEvents } from '../services/transactionEvents.js';
+
+const router = express.Router();
+
+const HEARTBEAT_MS = 15000;
+
+function tokenMatches(given, expected) {
+    const a = Buffer.from(given || '');
+    const b = Buffer.from(expected);
+    return a.length === b.length && crypto.timingSafeEqual(a, b);
+}
+
+// Server-Sent Events feed of every transaction event, read by the gateway's push hub.
+// Node is reachable by the app, so the feed is off (404) until EVENT_FEED_TOKEN is set,
+// and the gateway must be started with the same EVENT_FEED_TOKEN
+router.get('/', (req, res) => {
+    const token = process.env.EVENT_FEED_TOKEN;
+    if (!token) {
+        return res.status(404).json({ error: 'Not Found' });
+    }
+    if (!tokenMatches(req.get('x-event-feed-token'), token)) {
+        return res.status(403).json({ error: 'Forbidden' });
+    }
+
+    res.writeHead(200, {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        Connection: 'keep-alive'
+    });
+    res.write(': connected\n\n');
+
+    const unsubscribe = transactionEvents.subscribe((event) => {
+        res.write(`data: ${JSON.stringify(event)}\n\n`);
+    });
+    const heartbeat = setInterval(() => res.write(': ping\n\n'), HEARTBEAT_MS);
+
+    req.on('close', () => {
+        clearInterval(heartbeat);
+        unsubscribe();
+    });
+});
+
+export default router;
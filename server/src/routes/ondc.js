@@ -93,6 +93,31 @@ router.get('/results/:transactionId', async (req, res) => {
     }
 });
 
+// GET ride breadcrumbs for the map
+// ?tolerance=<meters> simplifies the path, ?since=<ms or ISO> returns only newer points,
+// ?format=polyline returns an encoded polyline instead of point objects
+router.get('/track/:transactionId', async (req, res) => {
+    try {
+        const { since, tolerance, format } = req.query;
+        let sinceMs = null;
+        if (since !== undefined) {
+            sinceMs = /^\d+$/.test(since) ? parseInt(since, 10) : Date.parse(since);
+            if (!Number.isFinite(sinceMs)) return res.status(400).json({ error: 'Invalid since' });
+        }
+        const toleranceMeters = tolerance === undefined ? 0 : parseFloat(tolerance);
+        if (!(toleranceMeters >= 0)) return res.status(400).json({ error: 'Invalid tolerance' });
+
+        const trajectory = await ondcService.getTrajectory(req.params.transactionId, {
+            since: sinceMs,
+            tolerance: toleranceMeters,
+            format: format === 'polyline' ? 'polyline' : 'points'
+        });
+        res.json(trajectory);
+    } catch (error) {
+        res.status(500).json({ error: error.message });
+    }
+});
+
 
 // Middleware to verify ONDC signatures on incoming callbacks
 import { verifyOndcSignature } from '../middleware/ondcAuth.js';
@@ -4,10 +4,15 @@ import dotenv from 'dotenv';
 dotenv.config();
 
 const API_KEY = process.env.GEMINI_API_KEY;
+// Local stand-in for benchmarking the callback path without the real model
+const GEMINI_MOCK = process.env.GEMINI_MOCK === 'true';
+const MOCK_LATENCY_MS = parseInt(process.env.GEMINI_MOCK_LATENCY_MS || '800', 10);
 let genAI = null;
 let model = null;
 
-if (API_KEY) {
+if (GEMINI_MOCK) {
+    console.log(`🚧 GEMINI_MOCK: Insights answered locally after ~${MOCK_LATENCY_MS}ms`);
+} else if (API_KEY) {
     genAI = new GoogleGenerativeAI(API_KEY);
     model = genAI.getGenerativeModel({ model: "gemini-2.0-flash" });
 } else {
@@ -19,10 +24,11 @@ export const geminiService = {
      * Generate insight for a ride quote
      * @param {Object} currentQuote - The quote to analyze
      * @param {Array} historicalData - Array of past rides in this area
-     * @returns {Promise<String>} - Short insight text
+     * @returns {Promise<String|null>} - Short insight text, or null if none could be generated
      */
     async generateInsight(currentQuote, historicalData) {
-        if (!model) return "AI unavailable";
+        if (GEMINI_MOCK) return this.mockInsight(currentQuote, historicalData);
+        if (!model) return null;
 
         try {
             const prompt = `
@@ -42,7 +48,24 @@ export const geminiService = {
             return response.text().trim();
         } catch (error) {
             console.error("Gemini Error:", error.message);
-            return "AI Analysis failed";
+            return null;
         }
+    },
+
+    /**
+     * mockInsight
+     * Heuristic insight after a randomised delay around GEMINI_MOCK_LATENCY_MS
+     */
+    async mockInsight(currentQuote, historicalData) {
+        const latency = MOCK_LATENCY_MS * (0.5 + Math.random());
+        await new Promise(resolve => setTimeout(resolve, latency));
+
+        const prices = historicalData.map(ride => ride.price).filter(Number.isFinite);
+        if (prices.length === 0 || !Number.isFinite(currentQuote.price)) return "Fair price for this time.";
+        const average = prices.reduce((sum, price) => sum + price, 0) / prices.length;
+        const difference = Math.round((1 - currentQuote.price / average) * 100);
+        if (difference >= 5) return `Great price! ${difference}% lower than average.`;
+        if (difference <= -5) return "High demand. Price is surging.";
+        return "Fair price for this time.";
     }
 };
@@ -0,0 +1,156 @@
+import dotenv from 'dotenv';
+
+dotenv.config();
+
+const CONCURRENCY = parseInt(process.env.INSIGHT_CONCURRENCY || '4', 10);
+const DEADLINE_MS = parseInt(process.env.INSIGHT_DEADLINE_MS || '5000', 10);
+const MAX_QUEUED = parseInt(process.env.INSIGHT_QUEUE_SIZE || '1000', 10);
+const CACHE_TTL_MS = parseInt(process.env.INSIGHT_CACHE_TTL_SECONDS || '900', 10) * 1000;
+const CACHE_SIZE = parseInt(process.env.INSIGHT_CACHE_SIZE || '5000', 10);
+// Quotes within the same ₹ band read the same to the model
+const PRICE_BAND = parseInt(process.env.INSIGHT_PRICE_BAND || '20', 10);
+
+// signature -> { insight, expiresAt }, least recently used first
+const memo = new Map();
+// signature -> { quote, history, targets: [{ transactionId, id, bppId, since }] }, waiting or running
+const jobs = new Map();
+// Signatures waiting for a worker, oldest first
+const queue = [];
+
+let active = 0;
+let generate = null;
+let deliver = null;
+
+const counters = { hits: 0, misses: 0, coalesced: 0, generated: 0, failures: 0, timeouts: 0, dropped: 0 };
+
+/**
+ * AI insights generated off the on_search path.
+ * Quotes are memoized by provider, vehicle, price band and hour; quotes without
+ * a memoized insight are queued, generated by at most CONCURRENCY workers and
+ * delivered to their transactions once ready.
+ */
+export const insightQueue = {
+
+    /**
+     * configure
+     * @param {Function} generator - (quote, history) => Promise of the insight text, or null
+     * @param {Function} onInsights - (transactionId, [{ id, bppId, insight }]) called as insights arrive
+     */
+    configure(generator, onInsights) {
+        generate = generator;
+        deliver = onInsights;
+    },
+
+    signature(quote, at = new Date()) {
+        const band = Number.isFinite(quote.price) ? Math.floor(quote.price / PRICE_BAND) : 'na';
+        return `${quote.providerId}|${quote.name || ''}|${band}|${at.getHours()}`;
+    },
+
+    /**
+     * lookup
+     * Memoized insight for a quote, or undefined
+     */
+    lookup(quote) {
+        const key = this.signature(quote);
+        const entry = memo.get(key);
+        if (!entry) return undefined;
+        if (entry.expiresAt <= Date.now()) {
+            memo.delete(key);
+            return undefined;
+        }
+        memo.delete(key);
+        memo.set(key, entry);
+        counters.hits++;
+        return entry.insight;
+    },
+
+    /**
+     * enqueue
+     * Generate an insight for a quote of a transaction and deliver it later.
+     * Quotes with the same signature share one generation.
+     */
+    enqueue(transactionId, quote, history) {
+        const key = this.signature(quote);
+        const target = { transactionId, id: quote.id, bppId: quote.bppId, since: Date.now() };
+        const job = jobs.get(key);
+        if (job) {
+            counters.coalesced++;
+            job.targets.push(target);
+            return;
+        }
+        if (queue.length >= MAX_QUEUED) {
+            // An insight is a nice-to-have; shed it rather than grow without bound
+            counters.dropped++;
+            return;
+        }
+        counters.misses++;
+        jobs.set(key, { quote, history, targets: [target] });
+        queue.push(key);
+        this.pump();
+    },
+
+    pump() {
+        while (active < CONCURRENCY && queue.length > 0) {
+            this.run(queue.shift());
+        }
+    },
+
+    async run(key) {
+        const job = jobs.get(key);
+        active++;
+        const started = Date.now();
+        try {
+            // The worker slot is held until the model answers, so CONCURRENCY bounds
+            // the calls in flight; only delivery gives up at the deadline
+            const insight = await generate(job.quote, job.history);
+            if (insight) {
+                counters.generated++;
+                this.remember(key, insight);
+                // Transactions wait DEADLINE_MS from when generation started or they joined it
+                const now = Date.now();
+                const waiting = job.targets.filter((target) => now - Math.max(started, target.since) <= DEADLINE_MS);
+                if (waiting.length < job.targets.length) counters.timeouts++;
+                if (waiting.length > 0) await this.deliverAll(waiting, insight);
+            }
+        } catch (error) {
+            counters.failures++;
+            console.error('Insight generation failed:', error.message);
+        } finally {
+            jobs.delete(key);
+            active--;
+            this.pump();
+        }
+    },
+
+    remember(key, insight) {
+        memo.delete(key);
+        memo.set(key, { insight, expiresAt: Date.now() + CACHE_TTL_MS });
+        while (memo.size > CACHE_SIZE) {
+            memo.delete(memo.keys().next().value);
+        }
+    },
+
+    async deliverAll(targets, insight) {
+        const byTransaction = new Map();
+        for (const { transactionId, id, bppId } of targets) {
+            if (!byTransaction.has(transactionId)) byTransaction.set(transactionId, []);
+            byTransaction.get(transactionId).push({ id, bppId, insight });
+        }
+        await Promise.all([...byTransaction].map(async ([transactionId, insights]) => {
+            try {
+                await deliver(transactionId, insights);
+            } catch (error) {
+                console.error(`Delivering insights for ${transactionId} failed:`, error.message);
+            }
+        }));
+    },
+
+    stats() {
+        return {
+            ...counters,
+            queued: queue.length,
+            active,
+            memoized: memo.size
+        };
+    }
+};
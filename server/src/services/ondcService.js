@@ -6,17 +6,25 @@ import { ondcRegistryService } from './ondcRegistryService.js';
 import { getEstimate as getUberEstimate } from './uberService.js';
 import { auditService } from './auditService.js';
 import { geminiService } from './geminiService.js';
+import { insightQueue } from './insightQueue.js';
+import { trajectoryService } from './trajectoryService.js';
 import Transaction from '../models/Transaction.js';
 import RideHistory from '../models/RideHistory.js';
+import { transactionEvents } from './transactionEvents.js';
 
 // In-memory store REMOVED (Replaced by MongoDB)
 // const activeRequests = new Map();
-let io; // Socket.io instance
+
+// Uber estimates still being fetched, by transaction ID
+const pendingUberEstimates = new Map();
+
+// Special AI tag
+const insightTag = (insight) => ({ label: "✨ " + insight, color: 'purple' });
 
 export const ondcService = {
 
     setSocketIo(socketIo) {
-        io = socketIo;
+        transactionEvents.setSocketIo(socketIo);
     },
 
     /**
@@ -74,16 +82,15 @@ export const ondcService = {
             }
         };
 
-        // Trigger background Uber fetch for comparison
-        let uberEstimate = null;
-        try {
-            uberEstimate = await getUberEstimate(
-                { latitude: location.latitude, longitude: location.longitude },
-                location.destination || { latitude: location.latitude + 0.01, longitude: location.longitude + 0.01 }
-            );
-        } catch (err) {
+        // Fetch the Uber comparison alongside the gateway call rather than before it
+        const uberEstimate = getUberEstimate(
+            { latitude: location.latitude, longitude: location.longitude },
+            location.destination || { latitude: location.latitude + 0.01, longitude: location.longitude + 0.01 }
+        ).catch((err) => {
             console.error('Uber estimate failed:', err.message);
-        }
+            return null;
+        });
+        pendingUberEstimates.set(transactionId, uberEstimate);
 
         // Get gateway URL
         const gatewayUrl = await ondcRegistryService.getGatewayUrl();
@@ -102,9 +109,9 @@ export const ondcService = {
             await Transaction.create({
                 transactionId,
                 status: 'SEARCH_INITIATED',
-                location,
-                uberEstimate
+                location
             });
+            this.attachUberEstimate(transactionId, uberEstimate);
 
             if (process.env.ONDC_MOCK === 'true') {
                 console.log('🚧 ONDC_MOCK: Skipping Gateway Call');
@@ -126,10 +133,29 @@ export const ondcService = {
 
         } catch (error) {
             console.error('ONDC Search Failed:', error.response?.data || error.message);
+            pendingUberEstimates.delete(transactionId);
             throw new Error('Failed to initiate ONDC search');
         }
     },
 
+    /**
+     * attachUberEstimate
+     * Saves the Uber comparison on the transaction once it arrives.
+     * Callbacks processed before then wait for it through pendingUberEstimates.
+     */
+    async attachUberEstimate(transactionId, uberEstimate) {
+        try {
+            const estimate = await uberEstimate;
+            if (estimate) {
+                await Transaction.updateOne({ transactionId }, { $set: { uberEstimate: estimate } });
+            }
+        } catch (err) {
+            console.error('Saving Uber estimate failed:', err.message);
+        } finally {
+            pendingUberEstimates.delete(transactionId);
+        }
+    },
+
     /**
      * onSearch
      * Callback received from BPPs with search results (Catalog).
@@ -146,6 +172,11 @@ export const ondcService = {
         const providers = message?.catalog?.providers || message?.catalog?.['bpp/providers'];
 
         if (providers && providers.length > 0) {
+            if (!transaction.uberEstimate && pendingUberEstimates.has(transaction_id)) {
+                // A fast BPP answered before the Uber comparison was saved
+                transaction.uberEstimate = await pendingUberEstimates.get(transaction_id);
+            }
+
             // Normalize results
             const newResults = providers.flatMap(provider =>
                 provider.items.map(item => ({
@@ -163,7 +194,7 @@ export const ondcService = {
             );
 
             // Process through HailO Brain
-            const processedResults = await this.brainProcess(transaction, newResults);
+            const { quotes: processedResults, pendingInsights } = this.brainProcess(transaction, newResults);
 
             // Update Transaction in DB
             const updatedTransaction = await Transaction.findOneAndUpdate(
@@ -173,10 +204,10 @@ export const ondcService = {
             );
 
             // Real-time Update
-            if (io) {
-                io.emit(`search_update_${transaction_id}`, processedResults);
-                console.log(`📡 Emitted ${processedResults.length} updates for ${transaction_id}`);
-            }
+            transactionEvents.publish('search_update', transaction_id, processedResults);
+            console.log(`📡 Emitted ${processedResults.length} updates for ${transaction_id}`);
+
+            this.requestInsights(transaction_id, pendingInsights);
         }
     },
 
@@ -184,7 +215,7 @@ export const ondcService = {
      * brainProcess
      * The Intelligence Layer: Ingests data and generates AI insights
      */
-    async brainProcess(transaction, newQuotes) {
+    brainProcess(transaction, newQuotes) {
         // 1. Ingest Data (Async - don't block response)
         this.ingestQuotes(transaction, newQuotes);
 
@@ -192,11 +223,11 @@ export const ondcService = {
         // For MVP speed, we might skip this query or keep it shallow
         // let history = await RideHistory.find(...); 
 
-        // 3. Generate Insights via Gemini
-        // We'll process quotes in parallel but limit to top 3 to save tokens/time
-        const enrichedQuotes = await Promise.all(newQuotes.map(async (quote, index) => {
+        // 3. AI Insights for the top 3 quotes: memoized ones are attached now,
+        // the rest are generated off the callback path (see requestInsights)
+        const pendingInsights = [];
+        const quotes = newQuotes.map((quote, index) => {
             let tags = [];
-            let insight = null;
 
             // Basic Heuristics (Uber comp)
             if (transaction.uberEstimate) {
@@ -210,17 +241,13 @@ export const ondcService = {
                 }
             }
 
-            // AI Insight (Only for top results to be fast)
+            // AI Insight (Only for top results to save tokens)
             if (index < 3) {
-                // Mock history for now since we just started ingesting
-                const mockHistory = [
-                    { price: quote.price * 1.1, timestamp: new Date(Date.now() - 3600000) },
-                    { price: quote.price * 0.9, timestamp: new Date(Date.now() - 7200000) }
-                ];
-
-                insight = await geminiService.generateInsight(quote, mockHistory);
+                const insight = insightQueue.lookup(quote);
                 if (insight) {
-                    tags.push({ label: "✨ " + insight, color: 'purple' }); // Special AI tag
+                    tags.push(insightTag(insight));
+                } else {
+                    pendingInsights.push(quote);
                 }
             }
 
@@ -229,9 +256,46 @@ export const ondcService = {
                 tags: tags,
                 source: 'ONDC'
             };
-        }));
+        });
+
+        return { quotes, pendingInsights };
+    },
 
-        return enrichedQuotes;
+    /**
+     * requestInsights
+     * Queue insight generation; call once the quotes are saved on the transaction.
+     */
+    requestInsights(transactionId, quotes) {
+        for (const quote of quotes) {
+            // Mock history for now since we just started ingesting
+            const mockHistory = [
+                { price: quote.price * 1.1, timestamp: new Date(Date.now() - 3600000) },
+                { price: quote.price * 0.9, timestamp: new Date(Date.now() - 7200000) }
+            ];
+            insightQueue.enqueue(transactionId, quote, mockHistory);
+        }
+    },
+
+    /**
+     * attachInsights
+     * Add generated insights to saved results and send them as an insight_update.
+     * @param {Array} insights - [{ id, bppId, insight }]
+     */
+    async attachInsights(transactionId, insights) {
+        const updates = insights.map(({ id, bppId, insight }) => ({
+            id,
+            bppId,
+            insight,
+            tag: insightTag(insight)
+        }));
+        await Transaction.bulkWrite(updates.map(({ id, bppId, tag }) => ({
+            updateOne: {
+                filter: { transactionId },
+                update: { $push: { 'results.$[result].tags': tag } },
+                arrayFilters: [{ 'result.id': id, 'result.bppId': bppId }]
+            }
+        })));
+        transactionEvents.publish('insight_update', transactionId, updates);
     },
 
     /**
@@ -383,14 +447,12 @@ export const ondcService = {
                 }
             );
 
-            if (io) {
-                io.emit(`select_update_${transaction_id}`, quote);
-                console.log(`📡 Emitted Quote update for ${transaction_id}`);
-            }
+            transactionEvents.publish('select_update', transaction_id, quote);
+            console.log(`📡 Emitted Quote update for ${transaction_id}`);
         } else if (message.order && message.order.error) {
             console.error('ONDC Provider returned error:', message.order.error);
             await Transaction.updateOne({ transactionId: transaction_id }, { status: 'SELECT_ERROR' });
-            if (io) io.emit(`select_error_${transaction_id}`, message.order.error);
+            transactionEvents.publish('select_error', transaction_id, message.order.error);
         }
     },
 
@@ -509,10 +571,8 @@ export const ondcService = {
                 }
             );
 
-            if (io) {
-                io.emit(`init_update_${transaction_id}`, message.order);
-                console.log(`📡 Emitted Init update for ${transaction_id}`);
-            }
+            transactionEvents.publish('init_update', transaction_id, message.order);
+            console.log(`📡 Emitted Init update for ${transaction_id}`);
         }
     },
 
@@ -625,10 +685,8 @@ export const ondcService = {
                 }
             );
 
-            if (io) {
-                io.emit(`confirm_update_${transaction_id}`, message.order);
-                console.log(`📡 Emitted Confirm update (BOOKING SUCCESS) for ${transaction_id}`);
-            }
+            transactionEvents.publish('confirm_update', transaction_id, message.order);
+            console.log(`📡 Emitted Confirm update (BOOKING SUCCESS) for ${transaction_id}`);
         }
     },
 
@@ -722,26 +780,43 @@ export const ondcService = {
             const driverLoc = message.order.fulfillment?.start?.location?.gps ?
                 { gps: message.order.fulfillment.start.location.gps } : null;
 
-            await Transaction.updateOne(
-                { transactionId: transaction_id },
-                {
-                    status: updateData.fulfillmentStatus, // Update main status based on fulfillment
-                    fulfillmentStatus: updateData.fulfillmentStatus,
-                    confirmedOrder: message.order // Store the latest order details
-                }
-            );
+            const update = {
+                status: updateData.fulfillmentStatus, // Update main status based on fulfillment
+                fulfillmentStatus: updateData.fulfillmentStatus,
+                confirmedOrder: message.order // Store the latest order details
+            };
 
-            if (io) {
-                io.emit(`status_update_${transaction_id}`, {
-                    state: updateData.fulfillmentStatus,
-                    location: driverLoc,
-                    order: message.order
-                });
-                console.log(`📡 Emitted Status update for ${transaction_id}: ${updateData.fulfillmentStatus}`);
+            const [latitude, longitude] = (driverLoc?.gps || '').split(',').map(parseFloat);
+            if (Number.isFinite(latitude) && Number.isFinite(longitude)) {
+                const timestamp = Date.parse(context.timestamp) || Date.now();
+                Object.assign(driverLoc, { latitude, longitude });
+                update.driverLocation = { latitude, longitude, updatedAt: new Date(timestamp) };
+                try {
+                    await trajectoryService.append(transaction_id, { latitude, longitude, timestamp });
+                } catch (err) {
+                    console.error('Saving breadcrumb failed:', err.message);
+                }
             }
+
+            await Transaction.updateOne({ transactionId: transaction_id }, update);
+
+            transactionEvents.publish('status_update', transaction_id, {
+                state: updateData.fulfillmentStatus,
+                location: driverLoc,
+                order: message.order
+            });
+            console.log(`📡 Emitted Status update for ${transaction_id}: ${updateData.fulfillmentStatus}`);
         }
     },
 
+    /**
+     * getTrajectory
+     * Breadcrumbs of a ride, simplified to `tolerance` meters.
+     */
+    async getTrajectory(transactionId, options) {
+        return trajectoryService.getTrajectory(transactionId, options);
+    },
+
     /**
      * cancel
      * Cancel the ride.
@@ -822,13 +897,11 @@ export const ondcService = {
                 }
             );
 
-            if (io) {
-                io.emit(`status_update_${transaction_id}`, {
-                    state: 'CANCELLED',
-                    order: message.order
-                });
-                console.log(`📡 Emitted Cancel update for ${transaction_id}`);
-            }
+            transactionEvents.publish('status_update', transaction_id, {
+                state: 'CANCELLED',
+                order: message.order
+            });
+            console.log(`📡 Emitted Cancel update for ${transaction_id}`);
         }
     },
 
@@ -853,10 +926,8 @@ export const ondcService = {
             }
         );
 
-        if (io) {
-            io.emit(`select_update_${transactionId}`, quote);
-            console.log(`🚧 MOCK: Emitted Quote update for ${transactionId}`);
-        }
+        transactionEvents.publish('select_update', transactionId, quote);
+        console.log(`🚧 MOCK: Emitted Quote update for ${transactionId}`);
     },
 
     async simulateOnInit(transactionId, item) {
@@ -895,10 +966,8 @@ export const ondcService = {
             }
         );
 
-        if (io) {
-            io.emit(`init_update_${transactionId}`, mockOrder);
-            console.log(`🚧 MOCK: Emitted Init update for ${transactionId}`);
-        }
+        transactionEvents.publish('init_update', transactionId, mockOrder);
+        console.log(`🚧 MOCK: Emitted Init update for ${transactionId}`);
     },
 
     async simulateOnConfirm(transactionId) {
@@ -922,10 +991,8 @@ export const ondcService = {
             }
         );
 
-        if (io) {
-            io.emit(`confirm_update_${transactionId}`, mockOrder);
-            console.log(`🚧 MOCK: Emitted Confirm update for ${transactionId}`);
-        }
+        transactionEvents.publish('confirm_update', transactionId, mockOrder);
+        console.log(`🚧 MOCK: Emitted Confirm update for ${transactionId}`);
     },
 
     // Simulate driver movement
@@ -1007,3 +1074,8 @@ export const ondcService = {
         }, 1000);
     }
 };
+
+insightQueue.configure(
+    (quote, history) => geminiService.generateInsight(quote, history),
+    (transactionId, insights) => ondcService.attachInsights(transactionId, insights)
+);
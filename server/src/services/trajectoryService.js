@@ -0,0 +1,111 @@
+import dotenv from 'dotenv';
+import TrajectorySegment from '../models/TrajectorySegment.js';
+import { SCALE, simplify, encodePolyline } from '../utils/polyline.js';
+
+dotenv.config();
+
+const SEGMENT_SIZE = parseInt(process.env.TRAJECTORY_SEGMENT_SIZE || '256', 10);
+
+export { simplify, encodePolyline };
+
+export const trajectoryService = {
+
+    /**
+     * append
+     * Add a breadcrumb to the ride's open segment, opening a new one when it is full.
+     * The delta is computed inside MongoDB, so concurrent status callbacks cannot corrupt it.
+     * @param {Object} point - { latitude, longitude, timestamp (Date or ms) }
+     */
+    async append(transactionId, point) {
+        const t = new Date(point.timestamp).getTime();
+        const lat = Math.round(point.latitude * SCALE);
+        const lng = Math.round(point.longitude * SCALE);
+        const update = [{
+            $set: {
+                dt: { $concatArrays: ['$dt', [{ $subtract: [t, '$lastT'] }]] },
+                dlat: { $concatArrays: ['$dlat', [{ $subtract: [lat, '$lastLat'] }]] },
+                dlng: { $concatArrays: ['$dlng', [{ $subtract: [lng, '$lastLng'] }]] },
+                firstT: { $ifNull: ['$firstT', t] },
+                lastT: t,
+                lastLat: lat,
+                lastLng: lng,
+                count: { $add: ['$count', 1] },
+                open: { $lt: [{ $add: ['$count', 1] }, SEGMENT_SIZE] }
+            }
+        }];
+
+        for (let attempt = 0; attempt < 3; attempt++) {
+            // Pipeline update through the driver; it is not a document Mongoose can cast
+            const { matchedCount } = await TrajectorySegment.collection.updateOne(
+                { transactionId, open: true }, update
+            );
+            if (matchedCount) return;
+
+            const newest = await TrajectorySegment.findOne({ transactionId }).sort({ seq: -1 }).select('seq').lean();
+            try {
+                await TrajectorySegment.create({ transactionId, seq: newest ? newest.seq + 1 : 0 });
+            } catch (error) {
+                // Another callback opened the segment first
+                if (error.code !== 11000) throw error;
+            }
+        }
+        throw new Error(`Could not open a trajectory segment for ${transactionId}`);
+    },
+
+    /**
+     * getPoints
+     * Decoded breadcrumbs in append order, optionally only those after `since` (ms)
+     */
+    async getPoints(transactionId, since = null) {
+        const filter = { transactionId };
+        if (since !== null) filter.lastT = { $gt: since };
+        const segments = await TrajectorySegment.find(filter)
+            .sort({ seq: 1 })
+            .select('dt dlat dlng')
+            .lean();
+
+        const points = [];
+        for (const segment of segments) {
+            let t = 0;
+            let lat = 0;
+            let lng = 0;
+            for (let i = 0; i < segment.dt.length; i++) {
+                t += segment.dt[i];
+                lat += segment.dlat[i];
+                lng += segment.dlng[i];
+                if (since === null || t > since) {
+                    points.push({ latitude: lat / SCALE, longitude: lng / SCALE, timestamp: t });
+                }
+            }
+        }
+        return points;
+    },
+
+    /**
+     * getTrajectory
+     * @param {Object} options - { since (ms), tolerance (meters), format ('points' | 'polyline') }
+     */
+    async getTrajectory(transactionId, { since = null, tolerance = 0, format = 'points' } = {}) {
+        const points = await this.getPoints(transactionId, since);
+        const simplified = simplify(points, tolerance);
+        let until = since;
+        for (const point of points) {
+            if (until === null || point.timestamp > until) until = point.timestamp;
+        }
+        const trajectory = {
+            transactionId,
+            count: points.length,
+            returned: simplified.length,
+            // Pass back as `since` to fetch only newer points
+            until
+        };
+        if (format === 'polyline') {
+            return {
+                ...trajectory,
+                polyline: encodePolyline(simplified),
+                timestamps: simplified.map(point => point.timestamp)
+            };
+        }
+        return { ...trajectory, points: simplified };
+    }
+};
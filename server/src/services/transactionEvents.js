@@ -0,0 +1,44 @@
+import { EventEmitter } from 'events';
+
+/**
+ * Per-transaction event bus.
+ * Socket.io clients only receive events for transactions they subscribed to
+ * (room `txn:<id>`), and the Python gateway reads every event once from the
+ * /internal/events feed and fans it out to its own subscribers.
+ */
+const bus = new EventEmitter();
+// One listener per connected gateway feed
+bus.setMaxListeners(0);
+
+let io; // Socket.io instance
+
+export const roomFor = (transactionId) => `txn:${transactionId}`;
+
+export const transactionEvents = {
+
+    setSocketIo(socketIo) {
+        io = socketIo;
+    },
+
+    /**
+     * publish
+     * @param {String} event - e.g. 'search_update', 'status_update'
+     * @param {String} transactionId
+     * @param {Object} data
+     */
+    publish(event, transactionId, data) {
+        if (io) {
+            io.to(roomFor(transactionId)).emit(`${event}_${transactionId}`, data);
+        }
+        bus.emit('event', { event, transactionId, data, timestamp: Date.now() });
+    },
+
+    /**
+     * subscribe
+     * Receive every published event; returns the unsubscribe function.
+     */
+    subscribe(listener) {
+        bus.on('event', listener);
+        return () => bus.off('event', listener);
+    }
+};
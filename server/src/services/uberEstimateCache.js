@@ -0,0 +1,94 @@
+import dotenv from 'dotenv';
+
+dotenv.config();
+
+// ~330 m of latitude; searches from the same block share an estimate
+const CELL_DEGREES = parseFloat(process.env.UBER_ESTIMATE_CELL_DEGREES || '0.003');
+// Uber re-prices surge every couple of minutes, so an estimate is stale well
+// before that. Buckets are aligned to the clock, so every search in a bucket
+// sees the same estimate.
+const BUCKET_MS = parseInt(process.env.UBER_ESTIMATE_TTL_SECONDS || '60', 10) * 1000;
+const MAX_ENTRIES = parseInt(process.env.UBER_ESTIMATE_CACHE_SIZE || '10000', 10);
+
+// key -> { estimate, expiresAt }, least recently used first
+const entries = new Map();
+// key -> Promise of the estimate being fetched
+const pending = new Map();
+
+const counters = { hits: 0, misses: 0, coalesced: 0, failures: 0, evictions: 0 };
+
+const cell = (point) =>
+    `${Math.round(point.latitude / CELL_DEGREES)}:${Math.round(point.longitude / CELL_DEGREES)}`;
+
+/**
+ * Uber estimates by origin cell, destination cell and time bucket.
+ * Concurrent misses for the same key share one Uber call; failures are not cached.
+ */
+export const uberEstimateCache = {
+
+    keyFor(origin, destination, now = Date.now()) {
+        return `${cell(origin)}>${cell(destination)}@${Math.floor(now / BUCKET_MS)}`;
+    },
+
+    /**
+     * get
+     * @param {Object} origin - { latitude, longitude }
+     * @param {Object} destination - { latitude, longitude }
+     * @param {Function} fetchEstimate - called on a miss, returns a Promise of the estimate
+     */
+    async get(origin, destination, fetchEstimate) {
+        const now = Date.now();
+        const key = this.keyFor(origin, destination, now);
+
+        const entry = entries.get(key);
+        if (entry && entry.expiresAt > now) {
+            counters.hits++;
+            // Move to the most recently used end
+            entries.delete(key);
+            entries.set(key, entry);
+            return { ...entry.estimate };
+        }
+
+        let inFlight = pending.get(key);
+        if (inFlight) {
+            counters.coalesced++;
+        } else {
+            counters.misses++;
+            inFlight = fetchEstimate()
+                .then((estimate) => {
+                    this.store(key, estimate, (Math.floor(now / BUCKET_MS) + 1) * BUCKET_MS);
+                    return estimate;
+                })
+                .catch((error) => {
+                    counters.failures++;
+                    throw error;
+                })
+                .finally(() => pending.delete(key));
+            pending.set(key, inFlight);
+        }
+        return { ...(await inFlight) };
+    },
+
+    store(key, estimate, expiresAt) {
+        entries.delete(key);
+        entries.set(key, { estimate, expiresAt });
+        while (entries.size > MAX_ENTRIES) {
+            entries.delete(entries.keys().next().value);
+            counters.evictions++;
+        }
+    },
+
+    clear() {
+        entries.clear();
+    },
+
+    stats() {
+        const lookups = counters.hits + counters.misses + counters.coalesced;
+        return {
+            ...counters,
+            entries: entries.size,
+            inFlight: pending.size,
+            hitRatio: lookups ? Number(((counters.hits + counters.coalesced) / lookups).toFixed(4)) : null
+        };
+    }
+};
@@ -2,6 +2,7 @@ import dotenv from 'dotenv';
 import axios from 'axios';
 import User from '../models/User.js';
 import { uberTokenService } from './uberTokenService.js';
+import { uberEstimateCache } from './uberEstimateCache.js';
 
 dotenv.config();
 
@@ -47,9 +48,13 @@ function generateMumbaiPricing(distanceKm, timeOfDay) {
   return { minPrice, maxPrice, surgePercent: (surgeMultiplier - 1) * 100 };
 }
 
-// Get Uber estimate
+// Get Uber estimate, shared by nearby searches in the same minute
 // NOTE: Now uses Server Token, so `userId` param is deprecated/unused for generic estimates
 export async function getEstimate(origin, destination, userId = null) {
+  return uberEstimateCache.get(origin, destination, () => fetchEstimate(origin, destination));
+}
+
+async function fetchEstimate(origin, destination) {
   if (UBER_MOCK) {
     // Mock realistic Mumbai data
     const distance = calculateDistance(
@@ -0,0 +1,85 @@
+/**
+ * Ride trajectory geometry, free of I/O so it can be tested without a database
+ */
+export const SCALE = 1e5; // ~1 m, the precision of an encoded polyline
+const METERS_PER_DEGREE = 111320;
+
+/**
+ * simplify
+ * Douglas-Peucker: drop points closer than toleranceMeters to the line
+ * through their kept neighbours. Iterative, so long rides cannot overflow the stack.
+ */
+export function simplify(points, toleranceMeters) {
+    const n = points.length;
+    if (n <= 2 || !(toleranceMeters > 0)) return points;
+
+    // Equirectangular projection around the first point; fine at city scale
+    const k = Math.cos(points[0].latitude * Math.PI / 180);
+    const xs = new Float64Array(n);
+    const ys = new Float64Array(n);
+    for (let i = 0; i < n; i++) {
+        xs[i] = points[i].longitude * k * METERS_PER_DEGREE;
+        ys[i] = points[i].latitude * METERS_PER_DEGREE;
+    }
+
+    const keep = new Uint8Array(n);
+    keep[0] = 1;
+    keep[n - 1] = 1;
+    const tolerance2 = toleranceMeters * toleranceMeters;
+    const stack = [[0, n - 1]];
+    while (stack.length > 0) {
+        const [first, last] = stack.pop();
+        const dx = xs[last] - xs[first];
+        const dy = ys[last] - ys[first];
+        const length2 = dx * dx + dy * dy;
+        let farthest = -1;
+        let farthest2 = tolerance2;
+        for (let i = first + 1; i < last; i++) {
+            // Distance to the segment, not the infinite line, so loops back to the start are kept
+            let px = xs[i] - xs[first];
+            let py = ys[i] - ys[first];
+            if (length2 > 0) {
+                const t = Math.max(0, Math.min(1, (px * dx + py * dy) / length2));
+                px -= t * dx;
+                py -= t * dy;
+            }
+            const distance2 = px * px + py * py;
+            if (distance2 > farthest2) {
+                farthest = i;
+                farthest2 = distance2;
+            }
+        }
+        if (farthest !== -1) {
+            keep[farthest] = 1;
+            stack.push([first, farthest], [farthest, last]);
+        }
+    }
+    return points.filter((_, i) => keep[i]);
+}
+
+/**
+ * encodePolyline
+ * Google encoded polyline of points, at 1e5 precision
+ */
+export function encodePolyline(points) {
+    let output = '';
+    let previousLat = 0;
+    let previousLng = 0;
+    const encode = (value) => {
+        let v = value < 0 ? ~(value << 1) : value << 1;
+        while (v >= 0x20) {
+            output += String.fromCharCode((0x20 | (v & 0x1f)) + 63);
+            v >>= 5;
+        }
+        output += String.fromCharCode(v + 63);
+    };
+    for (const point of points) {
+        const lat = Math.round(point.latitude * SCALE);
+        const lng = Math.round(point.longitude * SCALE);
+        encode(lat - previousLat);
+        encode(lng - previousLng);
+        previousLat = lat;
+        previousLng = lng;
+    }
+    return output;
+}
@@ -0,0 +1,51 @@
+import { test } from 'node:test';
+import assert from 'node:assert/strict';
+import { simplify, encodePolyline } from '../src/utils/polyline.js';
+
+// About 1.11 m of latitude
+const METER = 1 / 111320;
+
+const point = (latitude, longitude) => ({ latitude, longitude });
+
+test('encodePolyline matches the reference example', () => {
+    // From Google's encoded polyline algorithm format page
+    const points = [point(38.5, -120.2), point(40.7, -120.95), point(43.252, -126.453)];
+    assert.equal(encodePolyline(points), '_p~iF~ps|U_ulLnnqC_mqNvxq`@');
+});
+
+test('encodePolyline of no points is empty', () => {
+    assert.equal(encodePolyline([]), '');
+});
+
+test('simplify drops points within the tolerance of a straight line', () => {
+    const points = [];
+    for (let i = 0; i <= 100; i++) {
+        // Up to 2 m of GPS wobble along a 1 km north-bound leg
+        points.push(point(19.0 + i * 10 * METER, 72.8 + (i % 2 ? 2 : -2) * METER * 0.9));
+    }
+    const simplified = simplify(points, 5);
+    assert.deepEqual(simplified, [points[0], points[100]]);
+});
+
+test('simplify keeps corners beyond the tolerance', () => {
+    const points = [
+        point(19.0, 72.8),
+        point(19.0 + 500 * METER, 72.8),
+        point(19.0 + 1000 * METER, 72.8),
+        point(19.0 + 1000 * METER, 72.8 + 0.01),
+    ];
+    assert.deepEqual(simplify(points, 5), [points[0], points[2], points[3]]);
+});
+
+test('simplify keeps a loop back to the start', () => {
+    // The far end is on top of the first point, so the line between them has no length
+    const points = [point(19.0, 72.8), point(19.0 + 300 * METER, 72.8), point(19.0, 72.8)];
+    assert.deepEqual(simplify(points, 5), points);
+});
+
+test('simplify leaves short or untolerated tracks alone', () => {
+    const points = [point(19.0, 72.8), point(19.0 + METER, 72.8), point(19.0 + 2 * METER, 72.8)];
+    const ends = points.slice(0, 2);
+    assert.equal(simplify(ends, 5), ends);
+    assert.equal(simplify(points, 0), points);
+});
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The gateway's modules are imported flat from backend/, as server.py does
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,35 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def client():
+    # Without the lifespan: items are validated before anything is started
+    return TestClient(server.app)
+
+
+@pytest.mark.parametrize("path", [
+    "../../internal/events",
+    "/api/v1/../../internal/events",
+    "insights/../../../ondc/on_receiver_recon",
+    "./insights/summary",
+    "insights//summary",
+    "%2e%2e/internal/events",
+    "insights/%2E%2E/%2e%2E/internal/events",
+    "batch",
+])
+def test_paths_outside_api_v1_are_refused(client, path):
+    response = client.post("/api/v1/batch", json={"requests": [
+        {"path": "locations"}, {"path": path},
+    ]})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "requests[1] is not a batchable request"
+
+
+@pytest.mark.parametrize("path", [
+    "locations", "/api/v1/surge/forecast?originLat=19.07&originLng=72.87", "rides/a.b", "..rides",
+])
+def test_batchable_paths(path):
+    assert server.batch_path_safe(server.batch_target(server.BatchItem(path=path))[0])
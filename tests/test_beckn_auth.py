@@ -0,0 +1,150 @@
+import asyncio
+import base64
+import json
+
+import httpx
+import pytest
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from beckn_auth import (
+    BecknVerifier,
+    SignatureError,
+    SubscriberKeyStore,
+    authorization_header,
+    load_public_key,
+    parse_authorization,
+    signing_string,
+)
+
+BODY = json.dumps({"context": {"action": "on_search"}}).encode()
+# BLAKE2b-512("abc") from RFC 7693
+ABC_DIGEST = base64.b64encode(bytes.fromhex(
+    "ba80a53f981c4d0d6a2797b69f12f6e94c212f14685ac4b74b12bb6fdbffa2d1"
+    "7d87c5392aab792dc252d5de4533cc9518d38aa8dbf1925ab92386edd4009923"
+)).decode()
+
+
+class Keys:
+    """Stands in for SubscriberKeyStore"""
+
+    def __init__(self, keys, rotated_to=None):
+        self.keys = keys
+        self.rotated_to = rotated_to
+        self.gets = 0
+
+    async def get(self, subscriber_id, key_id):
+        self.gets += 1
+        return self.keys.get((subscriber_id, key_id))
+
+    async def rotated(self, subscriber_id, key_id):
+        return self.rotated_to
+
+
+def verify(verifier, header, body=BODY):
+    return asyncio.run(verifier.verify(header, body))
+
+
+@pytest.fixture
+def private_key():
+    return Ed25519PrivateKey.generate()
+
+
+def test_signing_string_matches_becknauth():
+    assert signing_string("1700000000", "1700000010", b"abc") == (
+        f"(created): 1700000000\n(expires): 1700000010\ndigest: BLAKE-512={ABC_DIGEST}"
+    ).encode()
+
+
+def test_signed_body_verifies(private_key):
+    verifier = BecknVerifier(Keys({("bap.example", "k1"): private_key.public_key()}))
+    header = authorization_header(private_key, "bap.example", "k1", BODY)
+    assert verify(verifier, header) == "bap.example"
+    assert (verifier.verified, verifier.rejected) == (1, 0)
+
+
+def test_changed_body_fails_the_digest(private_key):
+    verifier = BecknVerifier(Keys({("bap.example", "k1"): private_key.public_key()}))
+    header = authorization_header(private_key, "bap.example", "k1", BODY)
+    with pytest.raises(SignatureError, match="verification failed"):
+        verify(verifier, header, BODY + b" ")
+    assert verifier.rejected == 1
+
+
+def test_another_key_fails(private_key):
+    verifier = BecknVerifier(Keys({("bap.example", "k1"): Ed25519PrivateKey.generate().public_key()}))
+    with pytest.raises(SignatureError):
+        verify(verifier, authorization_header(private_key, "bap.example", "k1", BODY))
+
+
+def test_expired_signature_is_rejected_before_key_lookup(private_key):
+    keys = Keys({("bap.example", "k1"): private_key.public_key()})
+    verifier = BecknVerifier(keys)
+    with pytest.raises(SignatureError, match="expired"):
+        verify(verifier, authorization_header(private_key, "bap.example", "k1", BODY, ttl=-1))
+    assert keys.gets == 0
+
+
+def test_invalid_expires(private_key):
+    header = authorization_header(private_key, "bap.example", "k1", BODY)
+    header = header.replace('expires="', 'expires="soon', 1)
+    with pytest.raises(SignatureError, match="Invalid expires"):
+        verify(BecknVerifier(Keys({})), header)
+
+
+def test_unknown_key(private_key):
+    with pytest.raises(SignatureError, match="Public Key not found"):
+        verify(BecknVerifier(Keys({})), authorization_header(private_key, "bap.example", "k1", BODY))
+
+
+def test_other_algorithms_are_rejected(private_key):
+    header = authorization_header(private_key, "bap.example", "k1", BODY).replace("|ed25519", "|rsa")
+    with pytest.raises(SignatureError, match="Unsupported algorithm"):
+        verify(BecknVerifier(Keys({("bap.example", "k1"): private_key.public_key()})), header)
+
+
+def test_rotated_key_is_tried_after_a_failure(private_key):
+    stale = Ed25519PrivateKey.generate().public_key()
+    verifier = BecknVerifier(Keys({("bap.example", "k1"): stale}, rotated_to=private_key.public_key()))
+    assert verify(verifier, authorization_header(private_key, "bap.example", "k1", BODY)) == "bap.example"
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    'Bearer token',
+    'Signature keyId="a|b|ed25519",created="1",expires="2"',
+])
+def test_malformed_headers(header):
+    with pytest.raises(SignatureError):
+        parse_authorization(header)
+
+
+def test_public_keys_load_raw_or_der(private_key):
+    public_key = private_key.public_key()
+    raw = public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+    der = public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+    for encoded in (raw, der):
+        assert load_public_key(base64.b64encode(encoded).decode()).public_bytes(Encoding.Raw, PublicFormat.Raw) == raw
+
+
+def test_key_store_looks_up_once_for_concurrent_callbacks(private_key):
+    lookups = []
+    encoded = base64.b64encode(private_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)).decode()
+
+    async def registry(request):
+        lookups.append(json.loads(request.content)["subscriber_id"])
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json=[{"ukId": "k1", "signing_public_key": encoded}])
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(registry)) as client:
+            store = SubscriberKeyStore("http://registry/lookup", "ONDC:TRV10", "IND", "std:080", client=client)
+            found = await asyncio.gather(*(store.get("bap.example", "k1") for _ in range(5)))
+            missing = await store.get("bap.example", "k2")
+            return found, missing
+
+    found, missing = asyncio.run(main())
+    assert all(key is not None for key in found)
+    # An unseen key ID within min_refetch of the last lookup does not refetch
+    assert missing is None
+    assert lookups == ["bap.example"]
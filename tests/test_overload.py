@@ -0,0 +1,206 @@
+import asyncio
+
+import pytest
+
+import overload
+from overload import AdaptiveLimiter, CircuitBreaker, RetryBudget, UpstreamOverloaded
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(overload.time, "monotonic", clock)
+    return clock
+
+
+def test_limiter_admits_up_to_limit_then_queues():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=2, queue_timeout=1.0)
+        await limiter.acquire()
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        queued = limiter.snapshot()["queued"]
+        limiter.release()
+        await waiter
+        return limiter, queued
+
+    limiter, queued = asyncio.run(run())
+    assert queued == 1
+    assert limiter.in_flight == 2 and limiter.snapshot()["queued"] == 0
+
+
+def test_limiter_sheds_when_queue_full_or_wait_too_long():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=1, max_queue=1, queue_timeout=0.01)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamOverloaded) as full:
+            await limiter.acquire()
+        with pytest.raises(UpstreamOverloaded) as timeout:
+            await waiter
+        return limiter, full.value, timeout.value
+
+    limiter, full, timeout = asyncio.run(run())
+    assert full.reason == "queue_full" and timeout.reason == "queue_timeout"
+    assert limiter.shed == 2 and limiter.in_flight == 1 and limiter.snapshot()["queued"] == 0
+
+
+def test_limiter_cancelled_waiter_leaves_queue():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=1)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.release()
+        return limiter
+
+    limiter = asyncio.run(run())
+    assert limiter.in_flight == 0 and limiter.snapshot()["queued"] == 0
+
+
+def test_limiter_grows_on_fast_responses_and_backs_off_on_slow(clock):
+    limiter = AdaptiveLimiter(initial_limit=10, backoff=0.5, tolerance=2.0)
+    limiter.in_flight = 10
+    for _ in range(10):
+        limiter.observe(0.01, route="r")
+    grown = limiter.limit
+    assert grown > 10
+    clock.now += 1
+    for _ in range(50):
+        limiter.observe(1.0, route="r")
+    assert limiter.limit == pytest.approx(grown * 0.5)
+
+
+def test_limiter_backs_off_once_per_round_trip(clock):
+    limiter = AdaptiveLimiter(initial_limit=20, backoff=0.5, min_limit=2)
+    clock.now += 10
+    limiter.observe(0.5, ok=False)
+    limiter.observe(0.5, ok=False)
+    assert limiter.limit == 10
+    clock.now += 1
+    limiter.observe(0.5, ok=False)
+    assert limiter.limit == 5
+    for _ in range(5):
+        clock.now += 1
+        limiter.observe(0.5, ok=False)
+    assert limiter.limit == 2
+
+
+def test_limiter_baselines_are_per_route(clock):
+    limiter = AdaptiveLimiter(initial_limit=10, tolerance=2.0)
+    limiter.observe(0.002, route="health")
+    limiter.observe(0.2, route="search")
+    # A search is slow next to a health check, not next to other searches
+    assert limiter.limit >= 10
+    assert limiter.snapshot()["baseline_ms"] == {"health": 2.0, "search": 200.0}
+
+
+def test_circuit_opens_on_failure_ratio_and_closes_after_probe(clock):
+    breaker = CircuitBreaker(failure_ratio=0.5, min_requests=4, window=10, open_seconds=5)
+    for ok in (True, False, True, False):
+        breaker.allow()
+        breaker.record(ok)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(UpstreamOverloaded) as shed:
+        breaker.allow()
+    assert shed.value.reason == "circuit_open" and shed.value.retry_after == pytest.approx(5)
+
+    clock.now += 5
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe per open_seconds
+    with pytest.raises(UpstreamOverloaded):
+        breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.opened == 1
+
+
+def test_circuit_reopens_when_probe_fails(clock):
+    breaker = CircuitBreaker(failure_ratio=0.5, min_requests=2, open_seconds=5)
+    breaker.record(False)
+    breaker.record(False)
+    clock.now += 5
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opened == 2
+
+
+def test_circuit_needs_min_requests_and_forgets_old_failures(clock):
+    breaker = CircuitBreaker(failure_ratio=0.5, min_requests=4, window=10)
+    for _ in range(3):
+        breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+    clock.now += 11
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retry_budget_floor_and_ratio(clock):
+    budget = RetryBudget(ratio=0.1, min_per_second=0.5, window=10)
+    # The floor alone allows min_per_second * window retries
+    assert [budget.try_retry() for _ in range(6)] == [True] * 5 + [False]
+    for _ in range(100):
+        budget.record_request()
+    assert [budget.try_retry() for _ in range(11)] == [True] * 10 + [False]
+    assert budget.snapshot() == {"retries": 15, "exhausted": 2}
+
+
+def test_retry_budget_window_slides(clock):
+    budget = RetryBudget(ratio=0.0, min_per_second=0.1, window=10)
+    assert budget.try_retry() and not budget.try_retry()
+    clock.now += 11
+    assert budget.try_retry()
+
+
+async def served_order(limiter, requests):
+    """Names of queued (flow, cost, name) requests in the order they get a slot"""
+    order = []
+
+    async def request(flow, cost, name):
+        await limiter.acquire(flow, cost)
+        order.append(name)
+
+    tasks = [asyncio.ensure_future(request(*item)) for item in requests]
+    await asyncio.sleep(0)
+    for _ in requests:
+        limiter.release()
+        await asyncio.sleep(0.01)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_limiter_queues_fairly_across_flows():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=5.0)
+        await limiter.acquire("ip:a")
+        return await served_order(limiter, [
+            ("user:heavy", 10, "heavy 1"), ("user:heavy", 10, "heavy 2"), ("user:heavy", 10, "heavy 3"),
+            ("user:light", 1, "light 1"), ("user:light", 1, "light 2"),
+        ])
+
+    # Light's requests finish (in virtual time) before heavy's first does
+    assert asyncio.run(run()) == ["light 1", "light 2", "heavy 1", "heavy 2", "heavy 3"]
+
+
+def test_limiter_interleaves_equal_flows_and_is_fifo_within_one():
+    async def run():
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=5.0)
+        await limiter.acquire()
+        return await served_order(limiter, [
+            ("a", 1, "a1"), ("a", 1, "a2"), ("a", 1, "a3"), ("b", 1, "b1"), ("b", 1, "b2"),
+        ])
+
+    assert asyncio.run(run()) == ["a1", "b1", "a2", "b2", "a3"]
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import numpy as np
+
+from price_rollups import PRICE_BIN_EDGES, PriceRollups, geohash_encode_many, histogram_quantiles
+from response_cache import geohash_encode
+
+
+def quote(price, lng=72.8777, lat=19.0760, minute=0, provider="bpp-1", vehicle="AUTO"):
+    return {
+        "timestamp": datetime(2026, 3, 2, 3, minute),
+        "location": {"type": "Point", "coordinates": [lng, lat]},
+        "providerId": provider,
+        "vehicleType": vehicle,
+        "price": price,
+    }
+
+
+def test_geohash_encode_many_matches_scalar():
+    points = [(19.0760, 72.8777), (-33.8688, 151.2093), (40.7128, -74.0060), (57.64911, 10.40744)]
+    cells = geohash_encode_many([lat for lat, _ in points], [lng for _, lng in points], 8)
+    assert list(cells) == [geohash_encode(lat, lng, 8) for lat, lng in points]
+
+
+def test_aggregate_groups_by_cell_slot_provider_vehicle():
+    rollups = PriceRollups(ewma_alpha=0.5)
+    batch = rollups.aggregate([
+        quote(100, minute=0), quote(140, minute=5), quote(300, minute=5, vehicle="CAB"),
+    ])
+    by_vehicle = {row.vehicleType: row for row in batch.itertuples(index=False)}
+    assert by_vehicle["AUTO"].count == 2
+    assert (by_vehicle["AUTO"].min, by_vehicle["AUTO"].max, by_vehicle["AUTO"].first) == (100, 140, 100)
+    # 0.5 * 0.5 * 100 + 0.5 * 140, the terms added to the decayed prior
+    assert by_vehicle["AUTO"].ewma_terms == 95
+    assert by_vehicle["AUTO"].hist.sum() == 2 and len(by_vehicle["AUTO"].hist) == len(PRICE_BIN_EDGES) - 1
+    # 03:00 UTC on a Monday is 08:30 in Kolkata
+    assert by_vehicle["AUTO"].slot == 34
+
+
+def test_aggregate_skips_non_numeric_prices():
+    batch = PriceRollups().aggregate([quote("n/a"), quote(None), quote("120")])
+    assert list(batch["count"]) == [1]
+
+
+def test_aggregate_of_batch_without_prices_is_empty():
+    batch = PriceRollups().aggregate([quote("n/a"), quote(None)])
+    assert batch.empty
+
+
+def test_histogram_quantiles_within_a_bin():
+    hist = np.zeros(len(PRICE_BIN_EDGES) - 1, dtype=np.int64)
+    hist[np.searchsorted(PRICE_BIN_EDGES, 150, side="right") - 1] = 10
+    median, = histogram_quantiles(hist, [0.5])
+    assert 150 / 1.08 < median < 150 * 1.08
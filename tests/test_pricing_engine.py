@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from pricing_engine import (
+    estimate_breakdown,
+    haversine_km,
+    js_round,
+    mumbai_price_range,
+    price_batch,
+    surge_multiplier_for_hour,
+)
+
+# Expected values below were produced by running the Node formulas
+# (routes/pricing.js /estimate, uberService.calculateDistance and
+# generateMumbaiPricing with its random surge pinned) on the same inputs
+CST = (19.0760, 72.8777)
+ANDHERI = (19.1136, 72.8697)
+
+
+@pytest.mark.parametrize("value, rounded", [
+    (0.5, 1), (1.5, 2), (2.5, 3),
+    (-0.5, 0), (-1.5, -1), (-2.5, -2), (-3.5, -3), (-7.5000001, -8),
+    # floor(x + 0.5) would round these two up
+    (0.49999999999999994, 0), (-0.49999999999999994, 0),
+    (4503599627370495.5, 4503599627370496),
+])
+def test_js_round_matches_math_round(value, rounded):
+    assert js_round(value) == rounded
+
+
+def test_haversine_matches_calculate_distance():
+    distances = haversine_km(
+        [CST[0], 19.0176, 18.9220, CST[0]],
+        [CST[1], 72.8562, 72.8347, CST[1]],
+        [ANDHERI[0], 19.2183, 19.0330, CST[0]],
+        [ANDHERI[1], 72.9781, 73.0297, CST[1]],
+    )
+    # Within an ulp or two: NumPy's libm and V8 disagree on some cos/atan2 results
+    assert distances == pytest.approx([4.2645987173090605, 25.730553946683397, 23.932683570199277, 0.0], rel=1e-14)
+
+
+@pytest.mark.parametrize("distance, duration, surge, expected", [
+    (10.5, 25, 1.0, [126, 50, 0, 216, 216, 194, 238]),
+    (7.25, 18, 1.3, [87, 36, 49, 163, 212, 191, 233]),
+    (3.3, 11, 1.4, [40, 22, 41, 102, 142, 128, 156]),
+    (0.125, 0.25, 1.0, [2, 1, 0, 42, 42, 38, 46]),
+    (2, 3, 0.9, [24, 6, -7, 70, 63, 57, 69]),
+    (12.375, 30.25, 1.1, [149, 61, 25, 249, 274, 247, 301]),
+])
+def test_estimate_matches_the_estimate_route(distance, duration, surge, expected):
+    breakdown = estimate_breakdown(distance, duration, surge)
+    fields = ("distanceCharge", "timeCharge", "surgeCharge", "subtotal", "total", "estimatedMin", "estimatedMax")
+    assert [breakdown[field] for field in fields] == expected
+    assert breakdown["baseFare"] == 40
+
+
+def test_mumbai_peak_includes_the_upper_hour():
+    hours = np.array([7, 8, 9, 10, 11, 16, 17, 19, 20, 21])
+    peak = np.isin(hours, [8, 9, 10, 17, 19, 20])
+    plain = mumbai_price_range(4.2, hours)
+    surged = mumbai_price_range(4.2, hours, 1.2)
+    assert plain["priceMin"].tolist() == np.where(peak, 89, 75).tolist()
+    assert plain["priceMax"].tolist() == np.where(peak, 102, 85).tolist()
+    assert surged["priceMin"].tolist() == np.where(peak, 101, 84).tolist()
+    assert surged["priceMax"].tolist() == np.where(peak, 116, 97).tolist()
+
+
+def test_surge_curve_excludes_the_upper_hour():
+    hours = [7, 8, 9, 10, 12, 13, 14, 16, 17, 19, 20]
+    assert surge_multiplier_for_hour(hours).tolist() == [1.0, 1.3, 1.3, 1.0, 1.1, 1.1, 1.0, 1.0, 1.4, 1.4, 1.0]
+
+
+def test_one_origin_broadcasts_over_destinations():
+    batch = price_batch([CST[0]], [CST[1]], [ANDHERI[0], 19.2183, 19.0330], [ANDHERI[1], 72.9781, 73.0297], [10])
+    assert all(values.shape == (3,) for values in batch.values())
+    assert batch["distanceKm"] == pytest.approx([4.2645987173090605, 19.015636151592982, 16.675736356520865], rel=1e-14)
+    # Hour 10 is off the surge curve but still peak for the Mumbai range
+    assert batch["surgeMultiplier"].tolist() == [1.0, 1.0, 1.0]
+    assert batch["durationMin"].tolist() == [11, 48, 42]
+    assert batch["total"].tolist() == [113, 364, 324]
+    assert batch["priceMin"].tolist() == [90, 297, 264]
+    assert batch["priceMax"].tolist() == [103, 356, 316]
+
+
+def test_one_pair_broadcasts_over_hours():
+    batch = price_batch(CST[0], CST[1], ANDHERI[0], ANDHERI[1], [9, 13, 18, 20], duration_min=[20], surge_multiplier=1.2)
+    assert all(values.shape == (4,) for values in batch.values())
+    assert batch["durationMin"].tolist() == [20.0] * 4
+    assert batch["total"].tolist() == [157] * 4
+    # An explicit surge applies to both the estimate and the Mumbai range
+    assert batch["priceMin"].tolist() == [102, 85, 102, 102]
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+from metrics import EventLoopLagMonitor, Registry
+from profiling import LoopStallMonitor
+
+
+def lag_monitor():
+    registry = Registry()
+    return EventLoopLagMonitor(registry.histogram("lag", "lag"), registry.gauge("lag_now", "lag"))
+
+
+def hold_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def test_stall_is_captured_on_the_lag_monitors_heartbeat():
+    heartbeat = lag_monitor()
+    stalls = LoopStallMonitor(heartbeat, threshold=0.05)
+
+    async def run():
+        heartbeat.start()
+        stalls.start()
+        await asyncio.sleep(0.1)
+        hold_the_loop(0.3)
+        await asyncio.sleep(0.1)
+        running = stalls.stats()["running"]
+        await stalls.stop()
+        await heartbeat.stop()
+        return running
+
+    assert asyncio.run(run())
+    # One heartbeat shared with the lag metrics, beating twice per threshold
+    assert heartbeat.interval == 0.025
+    assert heartbeat.listeners == []
+    assert stalls.stalls == 1
+    stall = stalls.recent()[0]
+    assert stall["stack"][-1].endswith("in hold_the_loop")
+    assert stall["blockedMs"] >= 50
+    assert stall["stalledMs"] >= 250
+    assert not stalls.stats()["running"]
+
+
+def test_nothing_runs_until_started():
+    heartbeat = lag_monitor()
+    stalls = LoopStallMonitor(heartbeat, threshold=0.05)
+    assert heartbeat.interval == 0.5 and heartbeat.listeners == []
+    assert stalls.stats() == {"threshold_ms": 50.0, "running": False, "stalls": 0}
+    asyncio.run(stalls.stop())
+
+
+def test_zero_threshold_leaves_the_heartbeat_alone():
+    heartbeat = lag_monitor()
+
+    async def run():
+        LoopStallMonitor(heartbeat, threshold=0).start()
+
+    asyncio.run(run())
+    assert heartbeat.interval == 0.5 and heartbeat.listeners == []
@@ -0,0 +1,89 @@
+import pytest
+
+import rate_limit
+from rate_limit import RateLimited, RouteCosts, TokenBuckets, parse_costs
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def test_parse_costs():
+    assert parse_costs(" /commute/search/=10, ,health=0.1") == {"commute/search": 10.0, "health": 0.1}
+
+
+def test_route_cost_is_longest_prefix():
+    costs = RouteCosts({"commute": 3, "commute/search": 10}, default=1)
+    assert costs.cost("commute/search") == 10
+    assert costs.cost("/commute/search/recent/") == 10
+    assert costs.cost("commute/history") == 3
+    assert costs.cost("commuter") == 1
+    assert costs.cost("") == 1
+
+
+def test_bucket_spends_burst_then_limits(clock):
+    buckets = TokenBuckets(rate=2, burst=5)
+    for _ in range(5):
+        buckets.take("ip:a")
+    with pytest.raises(RateLimited) as limited:
+        buckets.take("ip:a", 2)
+    assert limited.value.caller == "ip:a"
+    assert limited.value.retry_after == pytest.approx(1.0)
+    # Other callers have buckets of their own
+    buckets.take("ip:b")
+    assert (buckets.admitted, buckets.limited) == (6, 1)
+
+
+def test_bucket_refills_at_rate_up_to_burst(clock):
+    buckets = TokenBuckets(rate=2, burst=5)
+    buckets.take("ip:a", 5)
+    clock.now += 1
+    buckets.take("ip:a", 2)
+    with pytest.raises(RateLimited):
+        buckets.take("ip:a", 1)
+    clock.now += 3600
+    buckets.take("ip:a", 5)
+    with pytest.raises(RateLimited):
+        buckets.take("ip:a", 1)
+
+
+def test_cost_above_burst_passes_on_a_full_bucket(clock):
+    buckets = TokenBuckets(rate=1, burst=5)
+    buckets.take("ip:a", 50)
+    with pytest.raises(RateLimited) as limited:
+        buckets.take("ip:a", 50)
+    assert limited.value.retry_after == pytest.approx(5.0)
+
+
+def test_refilled_buckets_are_swept(clock):
+    buckets = TokenBuckets(rate=1, burst=5, shards=1)
+    for caller in ("ip:a", "ip:b", "ip:c"):
+        buckets.take(caller)
+    clock.now += 5
+    buckets.take("ip:d")
+    assert buckets.callers() == 1
+    assert buckets.evicted == {"idle": 3, "capacity": 0}
+
+
+def test_full_table_evicts_least_recently_used(clock):
+    buckets = TokenBuckets(rate=1, burst=2, max_callers=2, shards=1)
+    buckets.take("ip:a", 2)
+    buckets.take("ip:b", 2)
+    buckets.take("ip:a", 0)
+    buckets.take("ip:c", 2)
+    assert buckets.evicted == {"idle": 0, "capacity": 1}
+    # b was evicted and comes back with a full bucket; a was kept and is empty
+    buckets.take("ip:b", 2)
+    with pytest.raises(RateLimited):
+        buckets.take("ip:c", 1)
@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+
+from response_cache import CachedResponse, ResponseCache, geohash_encode
+
+
+def response(body=b'{"ok": true}', status_code=200):
+    return CachedResponse(status_code, body, "application/json")
+
+
+class CountingLoader:
+    def __init__(self, delay=0.0, status_code=200, fail=False):
+        self.calls = 0
+        self.delay = delay
+        self.status_code = status_code
+        self.fail = fail
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return response(str(self.calls).encode(), self.status_code)
+
+
+def cell_bounds(geohash):
+    """(lat_min, lat_max, lng_min, lng_max) of a geohash cell"""
+    lat, lng = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = "0123456789bcdefghjkmnpqrstuvwxyz".index(char)
+        for shift in range(4, -1, -1):
+            interval = lng if even else lat
+            mid = (interval[0] + interval[1]) / 2
+            interval[0 if bits >> shift & 1 else 1] = mid
+            even = not even
+    return lat[0], lat[1], lng[0], lng[1]
+
+
+def test_geohash_known_cell():
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+
+@pytest.mark.parametrize("lat,lng", [(19.0760, 72.8777), (-33.8688, 151.2093), (40.7128, -74.0060), (0.0, 0.0)])
+def test_geohash_cell_contains_point(lat, lng):
+    lat_min, lat_max, lng_min, lng_max = cell_bounds(geohash_encode(lat, lng, 7))
+    assert lat_min <= lat < lat_max and lng_min <= lng < lng_max
+
+
+def test_geohash_prefix_of_longer_precision():
+    assert geohash_encode(19.0760, 72.8777, 9).startswith(geohash_encode(19.0760, 72.8777, 5))
+
+
+def test_concurrent_misses_share_one_load():
+    async def run():
+        cache = ResponseCache()
+        loader = CountingLoader(delay=0.01)
+        results = await asyncio.gather(*(cache.get_or_load("k", loader, 10, 10) for _ in range(5)))
+        return cache, loader, results
+
+    cache, loader, results = asyncio.run(run())
+    assert loader.calls == 1
+    assert {entry.body for entry, _ in results} == {b"1"}
+    assert [state for _, state in results] == ["MISS"] * 5
+    assert cache.misses == 1 and cache.coalesced == 4
+
+
+def test_fresh_entry_is_a_hit():
+    async def run():
+        cache = ResponseCache()
+        loader = CountingLoader()
+        await cache.get_or_load("k", loader, 10, 10)
+        return await cache.get_or_load("k", loader, 10, 10), loader
+
+    (entry, state), loader = asyncio.run(run())
+    assert state == "HIT" and entry.body == b"1" and loader.calls == 1
+
+
+def test_stale_entry_served_while_one_refresh_runs():
+    async def run():
+        cache = ResponseCache()
+        loader = CountingLoader(delay=0.01)
+        await cache.get_or_load("k", loader, 0, 10)
+        first = await cache.get_or_load("k", loader, 0, 10)
+        second = await cache.get_or_load("k", loader, 0, 10)
+        await asyncio.sleep(0.05)
+        return first, second, loader, cache
+
+    (first, first_state), (second, second_state), loader, cache = asyncio.run(run())
+    assert (first_state, second_state) == ("STALE", "STALE")
+    assert first.body == second.body == b"1"
+    # One background refresh for both stale reads, and its result is stored
+    assert loader.calls == 2
+    assert cache._entries["k"].body == b"2"
+
+
+def test_expired_entry_is_loaded_again():
+    async def run():
+        cache = ResponseCache()
+        loader = CountingLoader()
+        await cache.get_or_load("k", loader, 0, 0)
+        return await cache.get_or_load("k", loader, 0, 0), loader
+
+    (entry, state), loader = asyncio.run(run())
+    assert state == "MISS" and entry.body == b"2" and loader.calls == 2
+
+
+def test_errors_are_not_cached():
+    async def run():
+        cache = ResponseCache()
+        loader = CountingLoader(status_code=502)
+        await cache.get_or_load("k", loader, 10, 10)
+        return await cache.get_or_load("k", loader, 10, 10), loader
+
+    (entry, state), loader = asyncio.run(run())
+    assert state == "MISS" and entry.status_code == 502 and loader.calls == 2
+
+
+def test_failed_load_reaches_every_waiter_and_is_not_kept():
+    async def run():
+        cache = ResponseCache()
+        loader = CountingLoader(delay=0.01, fail=True)
+        results = await asyncio.gather(*(cache.get_or_load("k", loader, 10, 10) for _ in range(3)),
+                                       return_exceptions=True)
+        return cache, loader, results
+
+    cache, loader, results = asyncio.run(run())
+    assert loader.calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.load_errors == 1 and not cache._inflight and "k" not in cache._entries
+
+
+def test_cancelled_waiter_does_not_cancel_shared_load():
+    async def run():
+        cache = ResponseCache()
+        loader = CountingLoader(delay=0.02)
+        impatient = asyncio.ensure_future(cache.get_or_load("k", loader, 10, 10))
+        patient = asyncio.ensure_future(cache.get_or_load("k", loader, 10, 10))
+        await asyncio.sleep(0.005)
+        impatient.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+        return await patient, loader
+
+    (entry, _), loader = asyncio.run(run())
+    assert entry.body == b"1" and loader.calls == 1
+
+
+def test_evicts_least_recently_used_by_count_and_bytes():
+    async def run():
+        cache = ResponseCache(max_entries=2, max_bytes=1000)
+        for key in ("a", "b"):
+            await cache.get_or_load(key, CountingLoader(), 10, 10)
+        await cache.get_or_load("a", CountingLoader(), 10, 10)
+        await cache.get_or_load("c", CountingLoader(), 10, 10)
+        return cache
+
+    cache = asyncio.run(run())
+    assert list(cache._entries) == ["a", "c"]
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] == sum(entry.size for entry in cache._entries.values())
+
+
+def test_oversize_response_is_not_stored():
+    async def run():
+        cache = ResponseCache(max_bytes=4)
+
+        async def loader():
+            return response(b"x" * 10)
+
+        await cache.get_or_load("k", loader, 10, 10)
+        return cache
+
+    assert asyncio.run(run()).stats()["entries"] == 0
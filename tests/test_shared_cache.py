@@ -0,0 +1,185 @@
+import asyncio
+import os
+import struct
+import time
+from pathlib import Path
+
+import pytest
+
+from leader import LeaderElection
+from response_cache import CachedResponse
+from shared_cache import SLOT_HEADER, WAYS, SharedCache
+
+
+def response(body=b'{"ok": true}', ttl=60.0, stale=60.0, status=200):
+    loaded = CachedResponse(status, body, "application/json")
+    loaded.fresh_until = time.monotonic() + ttl
+    loaded.stale_until = loaded.fresh_until + stale
+    return loaded
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two workers' mappings of one file; the second stands in for another process"""
+    path = str(tmp_path / "cache")
+    first, second = SharedCache(path, slots=8, slot_size=1024), SharedCache(path, slots=8, slot_size=1024)
+    first.open()
+    second.open()
+    second._pid = first._pid + 1
+    yield first, second
+    first.close()
+    second.close()
+
+
+def test_response_stored_by_one_worker_is_read_by_another(workers):
+    first, second = workers
+    stored = response()
+    assert first.put("GET /api/v1/pricing/factors", stored)
+    shared = second.get("GET /api/v1/pricing/factors")
+    assert (shared.status_code, shared.body, shared.media_type) == (200, stored.body, "application/json")
+    assert (shared.fresh_until, shared.stale_until) == (stored.fresh_until, stored.stale_until)
+    assert second.get("GET /api/v1/locations") is None
+    assert (second.hits, second.misses) == (1, 1)
+
+
+def test_replacing_a_key_reuses_its_slot(workers):
+    first, second = workers
+    first.put("key", response(b"old"))
+    second.put("key", response(b"new"))
+    assert first.get("key").body == b"new"
+    assert first.stats()["entries"] == 1
+
+
+def test_expired_responses_are_not_served(workers):
+    first, second = workers
+    first.put("key", response(ttl=-2.0, stale=1.0))
+    assert second.get("key") is None
+
+
+def test_oversize_responses_are_not_shared(workers):
+    first, _ = workers
+    assert not first.put("key", response(b"x" * 1024))
+    assert first.oversize == 1 and first.get("key") is None
+
+
+def test_torn_or_corrupt_slots_read_as_misses(workers):
+    first, second = workers
+    first.put("key", response())
+    offset = first._find(first._bucket(first._hash("key")[0]), first._hash("key")[0])
+    seq = SLOT_HEADER.unpack_from(first._map, offset)[0]
+    # A writer in the middle of the slot
+    struct.pack_into("<Q", first._map, offset, seq + 1)
+    assert second.get("key") is None
+    assert second.torn_reads == 1
+    struct.pack_into("<Q", first._map, offset, seq)
+    first._map[offset + SLOT_HEADER.size + 3] ^= 0xFF
+    assert second.get("key") is None
+    assert second.torn_reads == 1
+
+
+def test_full_bucket_evicts_the_entry_expiring_first(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache"), slots=WAYS, slot_size=1024)
+    cache.open()
+    try:
+        for index in range(WAYS):
+            cache.put(f"key {index}", response(ttl=10.0 + index))
+        cache.put("key new", response(ttl=60.0))
+        assert cache.get("key 0") is None
+        assert all(cache.get(f"key {index}") is not None for index in range(1, WAYS))
+        assert cache.get("key new") is not None
+    finally:
+        cache.close()
+
+
+def test_leased_slots_are_not_evicted(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache"), slots=WAYS, slot_size=1024)
+    cache.open()
+    try:
+        cache.claim("loading", 30.0)
+        for index in range(WAYS):
+            cache.put(f"key {index}", response(ttl=10.0 + index))
+        # The last put took the slot of the entry expiring first instead
+        assert cache.get("key 0") is None
+        assert all(cache.get(f"key {index}") is not None for index in range(1, WAYS))
+        key_hash = cache._hash("loading")[0]
+        assert cache._find(cache._bucket(key_hash), key_hash) is not None
+    finally:
+        cache.close()
+
+
+def test_lease_makes_other_workers_wait(workers):
+    first, second = workers
+    assert first.claim("key", 30.0)
+    assert not second.claim("key", 30.0)
+    # The holder may renew its own lease
+    assert first.claim("key", 30.0)
+    first.put("key", response())
+    assert second.claim("key", 30.0)
+    assert (second.leases, second.lease_conflicts) == (1, 1)
+
+
+def test_released_or_lapsed_leases_can_be_taken(workers):
+    first, second = workers
+    first.claim("key", 30.0)
+    # Only the holder's release counts
+    second.release("key")
+    assert not second.claim("key", 30.0)
+    first.release("key")
+    assert second.claim("key", 0.0)
+    assert first.claim("key", 30.0)
+
+
+def test_lease_keeps_a_stale_response_servable(workers):
+    first, second = workers
+    first.put("key", response(ttl=-1.0, stale=60.0))
+    assert second.claim("key", 30.0)
+    assert first.get("key") is not None
+
+
+def test_workers_must_agree_on_geometry(tmp_path):
+    path = str(tmp_path / "cache")
+    cache = SharedCache(path, slots=8, slot_size=1024)
+    cache.open()
+    cache.close()
+    with pytest.raises(ValueError, match="share the slot settings"):
+        SharedCache(path, slots=16, slot_size=1024).open()
+
+
+def test_one_leader_per_lock_file(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    elected = []
+
+    async def run():
+        first = LeaderElection(path, retry_interval=0.01)
+        second = LeaderElection(path, retry_interval=0.01)
+        assert first.start(lambda: elected.append("first"))
+        assert not second.start(lambda: elected.append("second"))
+        await asyncio.sleep(0.05)
+        assert elected == ["first"] and not second.is_leader
+        # The kernel drops the lock with its holder; the other worker takes over
+        await first.stop()
+        await asyncio.sleep(0.05)
+        leader_pid = Path(path).read_text()
+        await second.stop()
+        return leader_pid
+
+    assert asyncio.run(run()) == f"{os.getpid()}\n"
+    assert elected == ["first", "second"]
+
+
+def test_single_process_always_leads():
+    elected = []
+    election = LeaderElection(None)
+    assert election.start(lambda: elected.append(True))
+    assert election.is_leader and elected == [True]
+
+
+def test_failing_leader_work_keeps_the_lead(tmp_path):
+    def fail():
+        raise RuntimeError("no database")
+
+    election = LeaderElection(str(tmp_path / "leader.lock"))
+    assert election.start(fail)
+    assert election.is_leader
+    asyncio.run(election.stop())
+    assert not election.is_leader
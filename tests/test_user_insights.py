@@ -0,0 +1,139 @@
+import sqlite3
+from datetime import datetime
+
+from user_insights import (
+    RECENT_RIDES,
+    UserInsights,
+    insights_recommendations,
+    js_round,
+    read_commute_logs_after,
+    route_key,
+    smart_recommendation,
+)
+
+
+def ride(**fields):
+    return {"_id": 1, "userId": "u1", "type": "COMPLETED", "price": 100, **fields}
+
+
+def descriptions(recommendations):
+    return [item["description"] for item in recommendations[:2]]
+
+
+def test_js_round_matches_math_round():
+    assert [js_round(v) for v in (0.5, 2.5, -0.5, -2.5, -3.5, 0.49999999999999994)] == [1, 3, 0, -2, -3, 0]
+    assert type(js_round(2.5)) is int
+
+
+def test_ride_update_keeps_the_latest_rides_by_completed_time():
+    insights = UserInsights(tz="Asia/Kolkata")
+    update = insights._ride_update(ride(
+        scheduledTime=datetime(2026, 3, 2, 3, 0), completedTime=datetime(2026, 3, 2, 3, 40),
+    ))._doc
+    push = update["$push"]["recentRides"]
+    assert push["$sort"] == {"completedTime": -1}
+    assert push["$slice"] == RECENT_RIDES
+    # 03:00 UTC is 08:30 in Kolkata
+    assert push["$each"] == [{"completedTime": datetime(2026, 3, 2, 3, 40), "hour": 8, "price": 100.0}]
+
+
+def test_ride_without_scheduled_time_has_no_hour():
+    update = UserInsights(tz="UTC")._ride_update(ride(completedTime=datetime(2026, 3, 2, 3, 40)))._doc
+    assert update["$push"]["recentRides"]["$each"][0]["hour"] is None
+
+
+def test_recommendations_use_the_cheapest_and_dearest_hours():
+    aggregate = {"recentRides": [
+        {"hour": 18, "price": 300.0}, {"hour": 18, "price": 100.0},
+        {"hour": 7, "price": 150.0}, {"hour": 9, "price": 250.0}, {"hour": None, "price": 1.0},
+    ]}
+    assert descriptions(insights_recommendations(aggregate)) == [
+        "Your cheapest rides are usually around 7:00. Consider adjusting your schedule.",
+        "Book rides after 9:00 to save an average of 15-20%. Your peak hour rides cost 18% more.",
+    ]
+
+
+def test_recommendations_break_ties_by_earlier_hour():
+    aggregate = {"recentRides": [{"hour": 20, "price": 100.0}, {"hour": 6, "price": 100.0}]}
+    assert descriptions(insights_recommendations(aggregate))[0].startswith("Your cheapest rides are usually around 6:00")
+
+
+def test_recommendations_default_without_rides():
+    assert descriptions(insights_recommendations(None)) == [
+        "Your cheapest rides are usually around 9:00. Consider adjusting your schedule.",
+        "Book rides after 18:00 to save an average of 15-20%. Your peak hour rides cost 18% more.",
+    ]
+
+
+def test_search_update_keeps_saved_locations():
+    log = {
+        "userId": "u1", "searchedAt": 1772420400000, "uberEstimateMin": 240,
+        "originId": "o1", "originLabel": "Home", "originAddress": "1 Main St",
+        "originLatitude": 19.07, "originLongitude": 72.87,
+        "destLat": 19.11, "destLng": 72.86,
+    }
+    update = UserInsights(tz="UTC")._search_update(log)._doc
+    route = route_key("Home", "19.110,72.860")
+    assert update["$inc"][f"searchRoutes.{route}.estimate"] == 240.0
+    # 2026-03-02 03:00 UTC is a Monday
+    assert update["$inc"]["searchHours.3"] == 1
+    assert update["$set"][f"searchRoutes.{route}.origin"] == {
+        "id": "o1", "label": "Home", "address": "1 Main St", "latitude": 19.07, "longitude": 72.87,
+    }
+    assert update["$set"][f"searchRoutes.{route}.destination"] == {
+        "label": "19.110,72.860", "latitude": 19.11, "longitude": 72.86,
+    }
+
+
+def test_read_commute_logs_joins_locations(tmp_path):
+    path = str(tmp_path / "dev.db")
+    with sqlite3.connect(path) as connection:
+        connection.executescript(
+            "CREATE TABLE Location (id TEXT, label TEXT, address TEXT, latitude REAL, longitude REAL);"
+            "CREATE TABLE CommuteLog (userId TEXT, searchedAt INTEGER, uberEstimateMin INTEGER,"
+            " originLat REAL, originLng REAL, destLat REAL, destLng REAL,"
+            " originLocationId TEXT, destLocationId TEXT);"
+            "INSERT INTO Location VALUES ('w', 'Work', '2 Park Rd', 19.1, 72.8);"
+            "INSERT INTO CommuteLog VALUES ('u1', 1, 200, 19.0, 72.9, NULL, NULL, NULL, 'w');"
+            "INSERT INTO CommuteLog VALUES ('u1', 2, 220, 19.0, 72.9, NULL, NULL, NULL, 'w');"
+        )
+    logs = read_commute_logs_after(path, 1, 10)
+    assert [log["rowid"] for log in logs] == [2]
+    assert logs[0]["destId"] == "w" and logs[0]["destLabel"] == "Work" and logs[0]["originId"] is None
+
+
+def smart_aggregate():
+    home, work, gym = {"label": "Home"}, {"label": "Work"}, {"label": "Gym"}
+    return {
+        "searchRoutes": {
+            "a": {"count": 3, "estimate": 600.0, "origin": home, "destination": work},
+            "b": {"count": 1, "estimate": 90.0, "origin": home, "destination": gym},
+        },
+        # Monday and Tuesday 09:00 beat Monday 18:00
+        "searchHours": {"9": 1, "33": 1, "18": 1},
+    }
+
+
+def test_smart_recommendation_in_the_evening_peak():
+    assert smart_recommendation(smart_aggregate(), 18) == {
+        "hasRecommendation": True,
+        "destination": {"label": "Work"},
+        "subtext": "Your usual 9:30 PM ride",
+        "savingsPercent": 7,
+        "estimatedPrice": 200,
+        "advice": "Wait 15 mins for no surge. Uber Go is cheapest via Uber at ₹180",
+        "origin": {"label": "Home"},
+    }
+
+
+def test_smart_recommendation_never_promises_negative_savings():
+    recommendation = smart_recommendation(smart_aggregate(), 11)
+    assert recommendation["savingsPercent"] == 0
+    assert recommendation["subtext"] == "Your usual 9:30 AM ride"
+    assert recommendation["advice"] == "Good time to book! Prices are -30% lower than peak hours"
+
+
+def test_smart_recommendation_without_searches():
+    assert smart_recommendation(None, 9) == {
+        "hasRecommendation": False, "message": "Not enough data for smart recommendations yet",
+    }